@@ -0,0 +1,718 @@
+"""Local Portal ベンチマーク
+
+ローカルにダミーのHTTP/WebSocketサーバー群（ポート3000-9999のランダムな空きポート）を起動し、
+主要な処理の性能を計測してJSONで出力する。
+
+    python bench.py --servers 20 --output bench.json
+    python bench.py --compare bench.json   # 前回の結果と比較
+
+計測項目:
+    scan_ports         scan_ports() の所要時間
+    stream             /api/ports/stream の最初のイベントまでの時間と完了までの時間
+    proxy.{small,large,stream}
+                       ReverseProxyMiddleware 経由のレイテンシとスループット
+    websocket          websocket_proxy 経由の往復レイテンシ
+    proxy_during_scan  スキャン（プロセス情報の取得を含む）実行中のプロキシのレイテンシ
+    docker             スタブのDocker Engine API（Unixソケット）からの公開ポート一覧の取得
+    headers            プロキシ1リクエストあたりのヘッダー処理（以前のdict方式との比較）
+
+--import-profile を付けると計測の代わりに main.py の読み込み時間の内訳（python -X importtime）を出力する。
+
+--check を付けると、スキャン中のプロキシのp99だけを計測して平常時から悪化していないかを検査し、
+悪化していれば終了コード1で終わる（tests/test_proxy_during_scan.py も同じ検査をする）。
+"""
+import argparse
+import asyncio
+import base64
+import contextlib
+import hashlib
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+SMALL_BODY = b"ok"
+LARGE_BODY = os.urandom(4 * 1024 * 1024)
+STREAM_CHUNK = b"x" * 65536
+STREAM_CHUNKS = 32
+
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+# --check の基準: スキャン中のp99 <= 平常時のp99 * 倍率 + 許容差
+P99_RATIO_LIMIT = 2.0
+P99_SLACK_MS = 5.0
+
+# ---- 統計 ----
+
+def summarize(samples: List[float]) -> dict:
+    """秒単位のサンプルをミリ秒の統計値にまとめる"""
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+
+    def percentile(q: float) -> float:
+        index = min(len(ordered) - 1, max(0, int(round(q * (len(ordered) - 1)))))
+        return round(ordered[index] * 1000, 3)
+
+    return {
+        "count": len(ordered),
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000, 3),
+        "min_ms": round(ordered[0] * 1000, 3),
+        "p50_ms": percentile(0.50),
+        "p90_ms": percentile(0.90),
+        "p99_ms": percentile(0.99),
+        "max_ms": round(ordered[-1] * 1000, 3),
+    }
+
+# ---- WebSocketフレーム ----
+
+def encode_frame(opcode: int, payload: bytes, mask: bool) -> bytes:
+    header = bytearray([0x80 | opcode])
+    mask_bit = 0x80 if mask else 0
+    length = len(payload)
+    if length < 126:
+        header.append(mask_bit | length)
+    elif length < 65536:
+        header.append(mask_bit | 126)
+        header += length.to_bytes(2, "big")
+    else:
+        header.append(mask_bit | 127)
+        header += length.to_bytes(8, "big")
+    if mask:
+        key = os.urandom(4)
+        header += key
+        payload = bytes(b ^ key[i % 4] for i, b in enumerate(payload))
+    return bytes(header) + payload
+
+async def read_frame(reader: asyncio.StreamReader) -> tuple:
+    b0, b1 = await reader.readexactly(2)
+    opcode = b0 & 0x0F
+    length = b1 & 0x7F
+    if length == 126:
+        length = int.from_bytes(await reader.readexactly(2), "big")
+    elif length == 127:
+        length = int.from_bytes(await reader.readexactly(8), "big")
+    key = await reader.readexactly(4) if b1 & 0x80 else None
+    payload = await reader.readexactly(length)
+    if key:
+        payload = bytes(b ^ key[i % 4] for i, b in enumerate(payload))
+    return opcode, payload
+
+async def read_http_head(reader: asyncio.StreamReader) -> tuple:
+    """リクエスト行/ステータス行とヘッダーを読む"""
+    first_line = (await reader.readline()).decode("latin-1").rstrip("\r\n")
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    return first_line, headers
+
+# ---- ダミーサーバー ----
+
+class DummyServer:
+    """ベンチマーク用のHTTP/WebSocketサーバー
+
+    /        小さなHTMLページ
+    /small   数バイトのボディ
+    /large   4MBのボディ
+    /stream  チャンク転送のボディ
+    WebSocketのアップグレード要求には受け取ったフレームをそのまま返す
+    """
+
+    def __init__(self, port: int, title: Optional[str]):
+        self.port = port
+        self.title = title
+        self.server = None
+        self._connections = {}  # task -> writer
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle, "127.0.0.1", self.port)
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+        # 残っている接続を閉じてハンドラの終了を待つ
+        for writer in self._connections.values():
+            writer.close()
+        await asyncio.gather(*self._connections, return_exceptions=True)
+
+    def _index(self) -> bytes:
+        title = f"<title>{self.title}</title>" if self.title else ""
+        return f"<!DOCTYPE html><html><head>{title}</head><body>{self.port}</body></html>".encode()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        task = asyncio.current_task()
+        self._connections[task] = writer
+        try:
+            while True:
+                request_line, headers = await read_http_head(reader)
+                if not request_line:
+                    break
+                length = int(headers.get("content-length") or 0)
+                if length:
+                    await reader.readexactly(length)
+
+                if headers.get("upgrade", "").lower() == "websocket":
+                    await self._websocket_echo(reader, writer, headers)
+                    break
+
+                path = request_line.split(" ")[1].split("?")[0]
+                if path == "/stream":
+                    writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/octet-stream\r\n"
+                                 b"Transfer-Encoding: chunked\r\n\r\n")
+                    for _ in range(STREAM_CHUNKS):
+                        writer.write(b"%x\r\n%s\r\n" % (len(STREAM_CHUNK), STREAM_CHUNK))
+                        await writer.drain()
+                    writer.write(b"0\r\n\r\n")
+                else:
+                    if path == "/large":
+                        body, content_type = LARGE_BODY, b"application/octet-stream"
+                    elif path == "/small":
+                        body, content_type = SMALL_BODY, b"text/plain"
+                    else:
+                        body, content_type = self._index(), b"text/html; charset=utf-8"
+                    writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: %s\r\nContent-Length: %d\r\n\r\n"
+                                 % (content_type, len(body)))
+                    writer.write(body)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, IndexError):
+            pass
+        finally:
+            writer.close()
+            self._connections.pop(task, None)
+
+    async def _websocket_echo(self, reader, writer, headers: dict):
+        accept = base64.b64encode(
+            hashlib.sha1((headers["sec-websocket-key"] + WS_GUID).encode()).digest()
+        ).decode()
+        writer.write(("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                      f"Sec-WebSocket-Accept: {accept}\r\n\r\n").encode())
+        await writer.drain()
+        while True:
+            opcode, payload = await read_frame(reader)
+            if opcode == 0x8:
+                writer.write(encode_frame(0x8, payload, mask=False))
+                await writer.drain()
+                return
+            if opcode == 0x9:
+                writer.write(encode_frame(0xA, payload, mask=False))
+            elif opcode in (0x1, 0x2):
+                writer.write(encode_frame(opcode, payload, mask=False))
+            await writer.drain()
+
+class DockerStub:
+    """Docker Engine APIのスタブ（GET /containers/json だけに応答する）"""
+
+    def __init__(self, path: str, ports: List[int]):
+        self.path = path
+        self.containers = [
+            {
+                "Id": hashlib.sha256(str(port).encode()).hexdigest(),
+                "Names": [f"/bench-web-{i}"],
+                "Image": "nginx:latest",
+                "Labels": {"com.docker.compose.project": "bench", "com.docker.compose.service": f"web-{i}"},
+                "Ports": [{"IP": "0.0.0.0", "PrivatePort": 80, "PublicPort": port, "Type": "tcp"}],
+            }
+            for i, port in enumerate(ports)
+        ]
+        self.server = None
+
+    async def start(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.server = await asyncio.start_unix_server(self._handle, self.path)
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+        os.remove(self.path)
+
+    async def _handle(self, reader, writer):
+        try:
+            await read_http_head(reader)
+            body = json.dumps(self.containers).encode()
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                         b"Content-Length: %d\r\nConnection: close\r\n\r\n" % len(body) + body)
+            await writer.drain()
+        finally:
+            writer.close()
+
+def is_port_free(port: int) -> bool:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        sock.bind(("127.0.0.1", port))
+        return True
+    except OSError:
+        return False
+    finally:
+        sock.close()
+
+async def start_fleet(count: int, with_titles: bool, exclude: set) -> List[DummyServer]:
+    """3000-9999の空いているポートにダミーサーバーを起動"""
+    servers = []
+    candidates = [p for p in range(3000, 10000) if p not in exclude]
+    random.shuffle(candidates)
+    for port in candidates:
+        if len(servers) >= count:
+            break
+        if not is_port_free(port):
+            continue
+        server = DummyServer(port, f"Bench {port}" if with_titles else None)
+        try:
+            await server.start()
+        except OSError:
+            continue
+        servers.append(server)
+    return servers
+
+# ---- 計測 ----
+
+async def bench_scan_ports(main, runs: int) -> dict:
+    samples = []
+    found = 0
+    for _ in range(runs):
+        start = time.perf_counter()
+        ports = await main.scan_ports()
+        samples.append(time.perf_counter() - start)
+        found = len(ports)
+    result = summarize(samples)
+    result["open_ports"] = found
+    return result
+
+async def bench_stream(client, base_url: str, runs: int) -> dict:
+    first_event = []
+    complete = []
+    events = 0
+    for _ in range(runs):
+        start = time.perf_counter()
+        first = None
+        events = 0
+        async with client.stream("GET", f"{base_url}/api/ports/stream", headers={"Host": "localhost"}) as response:
+            async for line in response.aiter_lines():
+                if not line.startswith("data: "):
+                    continue
+                if first is None:
+                    first = time.perf_counter() - start
+                if line == "data: [DONE]":
+                    break
+                events += 1
+        complete.append(time.perf_counter() - start)
+        if first is not None:
+            first_event.append(first)
+    return {
+        "events": events,
+        "time_to_first_event": summarize(first_event),
+        "time_to_complete": summarize(complete),
+    }
+
+async def bench_proxy(client, base_url: str, ports: List[int], path: str,
+                      requests: int, concurrency: int) -> dict:
+    samples = []
+    errors = 0
+    transferred = 0
+    counter = iter(range(requests))
+
+    async def worker():
+        nonlocal errors, transferred
+        for i in counter:
+            port = ports[i % len(ports)]
+            start = time.perf_counter()
+            try:
+                response = await client.get(f"{base_url}{path}", headers={"Host": f"{port}.bench.local"})
+                body = response.content
+                if response.status_code != 200:
+                    errors += 1
+                    continue
+            except Exception:
+                errors += 1
+                continue
+            samples.append(time.perf_counter() - start)
+            transferred += len(body)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    result = summarize(samples)
+    result.update({
+        "errors": errors,
+        "concurrency": concurrency,
+        "requests_per_sec": round(len(samples) / elapsed, 2) if elapsed else 0,
+        "mb_per_sec": round(transferred / elapsed / 1024 / 1024, 2) if elapsed else 0,
+    })
+    return result
+
+async def bench_websocket(main, app_port: int, target_port: int, messages: int) -> dict:
+    reader, writer = await asyncio.open_connection("127.0.0.1", app_port)
+    key = base64.b64encode(os.urandom(16)).decode()
+    writer.write((f"GET /echo HTTP/1.1\r\nHost: {target_port}.bench.local\r\nUpgrade: websocket\r\n"
+                  f"Connection: Upgrade\r\nSec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n").encode())
+    await writer.drain()
+    status_line, _ = await read_http_head(reader)
+    if " 101 " not in status_line + " ":
+        writer.close()
+        return {"error": status_line}
+
+    samples = []
+    try:
+        for i in range(messages):
+            payload = f"ping {i}".encode()
+            start = time.perf_counter()
+            writer.write(encode_frame(0x1, payload, mask=True))
+            await writer.drain()
+            while True:
+                opcode, data = await read_frame(reader)
+                if opcode == 0x1 and data == payload:
+                    break
+            samples.append(time.perf_counter() - start)
+        writer.write(encode_frame(0x8, b"\x03\xe8", mask=True))
+        await writer.drain()
+    finally:
+        writer.close()
+
+    # ブラウザ側が切断したら中継も終わり、localportal_websocket_relays_active が0に戻るはず
+    deadline = time.perf_counter() + 5
+    while main.WEBSOCKET_RELAYS_ACTIVE._values.get((str(target_port),), 0) and time.perf_counter() < deadline:
+        await asyncio.sleep(0.01)
+    return {
+        "round_trip": summarize(samples),
+        "relays_after_close": main.WEBSOCKET_RELAYS_ACTIVE._values.get((str(target_port),), 0),
+    }
+
+async def bench_proxy_during_scan(main, client, base_url: str, ports: List[int],
+                                  requests: int, concurrency: int) -> dict:
+    """スキャンを繰り返し実行している間のプロキシのレイテンシを平常時と比べる"""
+    baseline = await bench_proxy(client, base_url, ports, "/small", requests, concurrency)
+
+    scans = 0
+    stop = asyncio.Event()
+
+    async def scan_loop():
+        nonlocal scans
+        while not stop.is_set():
+            found = await main.scan_ports()
+            await main.get_processes_info([p.port for p in found])
+            scans += 1
+
+    scanner = asyncio.ensure_future(scan_loop())
+    try:
+        during = await bench_proxy(client, base_url, ports, "/small", requests, concurrency)
+    finally:
+        stop.set()
+        await scanner
+
+    baseline_p99 = baseline.get("p99_ms", 0)
+    during_p99 = during.get("p99_ms", 0)
+    return {
+        "baseline": baseline,
+        "during_scan": during,
+        "scans": scans,
+        "p99_ratio": round(during_p99 / baseline_p99, 3) if baseline_p99 else None,
+        "p99_flat": during_p99 <= baseline_p99 * P99_RATIO_LIMIT + P99_SLACK_MS,
+    }
+
+# ---- 実行 ----
+
+async def bench_docker(main, ports: List[int], runs: int) -> dict:
+    """スタブのDocker APIから公開ポートとコンテナの対応を取得する時間（キャッシュなし）"""
+    stub = DockerStub(f"/tmp/localportal-bench-{os.getpid()}-docker.sock", ports)
+    await stub.start()
+    original = main.DOCKER_SOCKET
+    main.DOCKER_SOCKET = stub.path
+    samples = []
+    mapped = {}
+    try:
+        for _ in range(runs):
+            main._docker_cache_time = 0
+            start = time.perf_counter()
+            mapped = await main.run_blocking(main.get_docker_ports)
+            samples.append(time.perf_counter() - start)
+    finally:
+        main.DOCKER_SOCKET = original
+        main._docker_cache_time = 0
+        await stub.stop()
+    result = summarize(samples)
+    result["containers"] = len(ports)
+    result["mapped_ports"] = len(mapped)
+    return result
+
+# ブラウザとアプリの典型的なヘッダー
+SAMPLE_REQUEST_HEADERS = [
+    (b"host", b"5173.air.local:8888"),
+    (b"connection", b"keep-alive"),
+    (b"user-agent", b"Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36"),
+    (b"accept", b"text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8"),
+    (b"accept-encoding", b"gzip, deflate, br"),
+    (b"accept-language", b"ja,en-US;q=0.9,en;q=0.8"),
+    (b"cache-control", b"max-age=0"),
+    (b"cookie", b"session=abc123; csrftoken=def456; theme=dark"),
+    (b"referer", b"https://5173.air.local:8888/"),
+    (b"sec-fetch-dest", b"document"),
+    (b"sec-fetch-mode", b"navigate"),
+    (b"sec-fetch-site", b"same-origin"),
+    (b"upgrade-insecure-requests", b"1"),
+]
+SAMPLE_RESPONSE_HEADERS = [
+    (b"Content-Type", b"text/html; charset=utf-8"),
+    (b"Content-Length", b"1024"),
+    (b"Connection", b"keep-alive"),
+    (b"Cache-Control", b"no-cache"),
+    (b"ETag", b'W/"400-abc"'),
+    (b"Set-Cookie", b"session=abc123; Path=/; HttpOnly"),
+    (b"Set-Cookie", b"csrftoken=def456; Path=/"),
+    (b"Set-Cookie", b"theme=dark; Path=/"),
+    (b"Vary", b"Accept-Encoding"),
+    (b"Date", b"Mon, 19 Oct 2026 00:00:00 GMT"),
+]
+
+def bench_headers(main, iterations: int) -> dict:
+    """1リクエストあたりのヘッダー処理時間（以前のdict方式と比較）"""
+    import httpx
+    from starlette.datastructures import Headers
+
+    def legacy():
+        request_headers = {k: v for k, v in Headers(raw=SAMPLE_REQUEST_HEADERS).items()
+                           if k.lower() not in ('host', 'content-length', 'transfer-encoding')}
+        request_headers['Host'] = "localhost:5173"
+        httpx.Headers(request_headers)
+        response_headers = dict(httpx.Headers(SAMPLE_RESPONSE_HEADERS))
+        for header in ['transfer-encoding', 'connection', 'keep-alive']:
+            response_headers.pop(header, None)
+        return response_headers
+
+    def raw():
+        request_headers = main.filter_request_headers(SAMPLE_REQUEST_HEADERS, b"localhost:5173")
+        httpx.Headers(request_headers)
+        response_headers, _ = main.filter_response_headers(httpx.Headers(SAMPLE_RESPONSE_HEADERS).raw)
+        return response_headers
+
+    result = {}
+    for name, func in (("dict", legacy), ("raw", raw)):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            func()
+        result[f"{name}_us"] = round((time.perf_counter() - start) / iterations * 1e6, 3)
+    result["set_cookie_dict"] = sum(1 for k in legacy() if k.lower() == "set-cookie")
+    result["set_cookie_raw"] = sum(1 for k, _ in raw() if k == b"set-cookie")
+    return result
+
+def git_commit() -> Optional[str]:
+    try:
+        result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=PROJECT_DIR,
+                                capture_output=True, text=True, timeout=2)
+        return result.stdout.strip() or None
+    except Exception:
+        return None
+
+async def start_app(main, port: int):
+    import uvicorn
+
+    config = uvicorn.Config(main.app, host="127.0.0.1", port=port, log_level="warning")
+    server = uvicorn.Server(config)
+    task = asyncio.ensure_future(server.serve())
+    while not server.started:
+        if task.done():
+            task.result()
+        await asyncio.sleep(0.01)
+    return server, task
+
+@contextlib.asynccontextmanager
+async def bench_environment(args, with_titles: bool):
+    """ダミーサーバー群と計測用のLocal Portalを起動し、(main, ダミーサーバーのポート) を渡す"""
+    # main.py は static ディレクトリを相対パスで参照する
+    os.chdir(PROJECT_DIR)
+    sys.path.insert(0, PROJECT_DIR)
+    # 保存済みの状態の読み込みと起動時の再検証は計測の邪魔になるので無効にする
+    os.environ["LOCALPORTAL_STATE_PATH"] = ""
+    os.environ["LOCALPORTAL_BROWSER_WARMUP"] = "0"
+    import main
+
+    fleet = await start_fleet(args.servers, with_titles, exclude={8888, args.app_port})
+    server, task = await start_app(main, args.app_port)
+    try:
+        yield main, [s.port for s in fleet]
+    finally:
+        server.should_exit = True
+        await task
+        for s in fleet:
+            await s.stop()
+
+def report_meta(args, servers: int) -> dict:
+    return {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "servers": servers,
+        "thumbnails": args.thumbnails,
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+    }
+
+def client_limits(args):
+    import httpx
+
+    return httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+
+async def run(args) -> dict:
+    import httpx
+
+    base_url = f"http://127.0.0.1:{args.app_port}"
+    results = {}
+    async with bench_environment(args, args.thumbnails) as (main, ports):
+        results["scan_ports"] = await bench_scan_ports(main, args.scan_runs)
+        async with httpx.AsyncClient(timeout=60.0, limits=client_limits(args)) as client:
+            results["stream"] = await bench_stream(client, base_url, args.stream_runs)
+            results["proxy"] = {}
+            for name, path, requests in (("small", "/small", args.requests),
+                                         ("large", "/large", max(1, args.requests // 20)),
+                                         ("stream", "/stream", max(1, args.requests // 20))):
+                results["proxy"][name] = await bench_proxy(client, base_url, ports, path,
+                                                           requests, args.concurrency)
+            results["proxy_during_scan"] = await bench_proxy_during_scan(main, client, base_url, ports,
+                                                                         args.requests, args.concurrency)
+        results["websocket"] = await bench_websocket(main, args.app_port, ports[0], args.ws_messages)
+        results["docker"] = await bench_docker(main, ports, args.scan_runs)
+        results["headers"] = bench_headers(main, args.header_iterations)
+
+    return {"meta": report_meta(args, len(ports)), "results": results}
+
+async def run_check(args) -> dict:
+    """スキャン中のプロキシのレイテンシだけを計測する（--check）"""
+    import httpx
+
+    async with bench_environment(args, False) as (main, ports):
+        async with httpx.AsyncClient(timeout=60.0, limits=client_limits(args)) as client:
+            during_scan = await bench_proxy_during_scan(main, client, f"http://127.0.0.1:{args.app_port}",
+                                                        ports, args.requests, args.concurrency)
+    return {"meta": report_meta(args, len(ports)), "results": {"proxy_during_scan": during_scan}}
+
+def import_profile(top: int) -> dict:
+    """python -X importtime で main.py の読み込み時間を計測"""
+    env = dict(os.environ, LOCALPORTAL_STATE_PATH="", LOCALPORTAL_BROWSER_WARMUP="0")
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"],
+                            cwd=PROJECT_DIR, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        lines = result.stderr.strip().splitlines()
+        return {"error": lines[-1] if lines else f"exit code {result.returncode}"}
+
+    # (深さ, self, cumulative, モジュール名)。importされた順に並び、子は親より先に出る
+    entries = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3:
+            continue
+        depth = len(fields[2]) - len(fields[2].lstrip())
+        entries.append((depth, int(fields[0]), int(fields[1]), fields[2].strip()))
+
+    # main の直前に並んでいる、main より深いものが main から読み込まれたモジュール
+    total_us = None
+    modules = []
+    for i, (depth, _, cumulative_us, name) in enumerate(entries):
+        if name != "main":
+            continue
+        total_us = cumulative_us
+        j = i - 1
+        while j >= 0 and entries[j][0] > depth:
+            child_depth, self_us, child_cumulative_us, child_name = entries[j]
+            modules.append({"module": child_name, "depth": child_depth - depth,
+                            "self_ms": round(self_us / 1000, 3),
+                            "cumulative_ms": round(child_cumulative_us / 1000, 3)})
+            j -= 1
+        break
+    modules.sort(key=lambda m: m["cumulative_ms"], reverse=True)
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+        },
+        "results": {
+            "import_main_ms": round(total_us / 1000, 3) if total_us is not None else None,
+            "modules": modules[:top],
+        },
+    }
+
+def flatten(data: dict, prefix: str = "") -> Dict[str, float]:
+    flat = {}
+    for key, value in data.items():
+        name = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            flat.update(flatten(value, name))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+def compare(old: dict, new: dict):
+    """2つの結果の数値を並べて表示（stderr）"""
+    old_flat = flatten(old.get("results", {}))
+    new_flat = flatten(new.get("results", {}))
+    print(f"{'metric':<48} {'old':>12} {'new':>12} {'ratio':>8}", file=sys.stderr)
+    for name in sorted(set(old_flat) & set(new_flat)):
+        before, after = old_flat[name], new_flat[name]
+        ratio = f"{after / before:.2f}" if before else "-"
+        print(f"{name:<48} {before:>12} {after:>12} {ratio:>8}", file=sys.stderr)
+
+def parse_args(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Local Portal ベンチマーク")
+    parser.add_argument("--servers", type=int, default=20, help="ダミーサーバーの数")
+    parser.add_argument("--app-port", type=int, default=18888, help="計測用に起動するLocal Portalのポート")
+    parser.add_argument("--thumbnails", action="store_true",
+                        help="ダミーページにタイトルを付けてサムネイル撮影まで計測する")
+    parser.add_argument("--scan-runs", type=int, default=5)
+    parser.add_argument("--stream-runs", type=int, default=3)
+    parser.add_argument("--requests", type=int, default=2000, help="small の総リクエスト数（large/streamは1/20）")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--ws-messages", type=int, default=500)
+    parser.add_argument("--header-iterations", type=int, default=20000)
+    parser.add_argument("--output", help="結果を書き出すJSONファイル（省略時は標準出力）")
+    parser.add_argument("--compare", help="比較対象の過去の結果JSON")
+    parser.add_argument("--import-profile", action="store_true",
+                        help="main.py の読み込み時間の内訳を出力する（ベンチマークは実行しない）")
+    parser.add_argument("--check", action="store_true",
+                        help="スキャン中のプロキシのp99だけを計測し、悪化していたら終了コード1で終わる")
+    return parser.parse_args(argv)
+
+def main():
+    args = parse_args()
+
+    if args.import_profile:
+        report = import_profile(top=30)
+    elif args.check:
+        report = asyncio.run(run_check(args))
+    else:
+        report = asyncio.run(run(args))
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+
+    if args.check and not args.import_profile:
+        during_scan = report["results"]["proxy_during_scan"]
+        if not during_scan["p99_flat"]:
+            print(f"NG: スキャン中のプロキシp99が悪化しました "
+                  f"({during_scan['baseline']['p99_ms']}ms -> {during_scan['during_scan']['p99_ms']}ms)",
+                  file=sys.stderr)
+            sys.exit(1)
+        print("OK: スキャン中もプロキシのp99は平常時と同等です", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -43,6 +43,20 @@ if [ ! -f "$CERT_KEY" ] || [ ! -f "$CERT_FILE" ]; then
 fi
 
 UVICORN_PATH="$VENV_DIR/bin/uvicorn"
+PYTHON_PATH="$VENV_DIR/bin/python"
+
+# ワーカー数（2以上でマルチワーカー構成。スキャンは専用プロセス1つが担当）
+WORKERS="${LOCALPORTAL_WORKERS:-1}"
+
+if [ "$WORKERS" -gt 1 ]; then
+    PROGRAM_ARGS="        <string>$PYTHON_PATH</string>
+        <string>$PROJECT_DIR/serve.py</string>
+        <string>--workers</string>
+        <string>$WORKERS</string>"
+else
+    PROGRAM_ARGS="        <string>$UVICORN_PATH</string>
+        <string>main:app</string>"
+fi
 
 # plistファイルを生成
 cat > /tmp/com.localportal.plist.tmp << EOF
@@ -54,8 +68,7 @@ cat > /tmp/com.localportal.plist.tmp << EOF
     <string>com.localportal</string>
     <key>ProgramArguments</key>
     <array>
-        <string>$UVICORN_PATH</string>
-        <string>main:app</string>
+$PROGRAM_ARGS
         <string>--host</string>
         <string>0.0.0.0</string>
         <string>--port</string>
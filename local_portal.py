@@ -0,0 +1,127 @@
+"""Local Portal コマンドライン
+
+uvicornやChromium、プロキシを起動せずに、LISTENしているポートを調べて表示する。
+スキャンとプロセス情報の取得は main.py のものをそのまま使う。
+
+    python -m local_portal scan
+    python -m local_portal scan --ports 3000-3999,27017 --format json
+    python -m local_portal scan --watch 2
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def load_main():
+    """main.py を読み込む（状態の保存は使わない）"""
+    # 保存済みの状態をCLIから書き換えないようにする
+    os.environ["LOCALPORTAL_STATE_PATH"] = ""
+    cwd = os.getcwd()
+    # main.py は static ディレクトリを相対パスで参照する
+    os.chdir(PROJECT_DIR)
+    sys.path.insert(0, PROJECT_DIR)
+    try:
+        import main
+    finally:
+        os.chdir(cwd)
+    return main
+
+async def scan_once(main, ports: list, processes: bool, sniff: bool, titles: bool) -> dict:
+    started = time.perf_counter()
+    records = await main.scan_port_list(ports)
+    scan_ms = (time.perf_counter() - started) * 1000
+    if processes:
+        infos = await main.get_processes_info([r.port for r in records])
+        for r in records:
+            r.set_process(infos[r.port])
+    if sniff:
+        protocols = await asyncio.gather(*(main.sniff_port(r) for r in records))
+        for r, protocol in zip(records, protocols):
+            r.protocol = protocol
+    if titles:
+        # HTTP以外と判別できたポートにはリクエストを送らない
+        web = [r for r in records if r.protocol in (None, "http")]
+        found = await asyncio.gather(*(main.get_page_title(r.port) for r in web))
+        for r, title in zip(web, found):
+            r.title = title
+    return {
+        "ports": [{k: v for k, v in r.to_dict().items() if not k.startswith("thumbnail")} for r in records],
+        "scan_ms": round(scan_ms, 1),
+        "total_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
+
+def format_table(result: dict) -> str:
+    rows = [("PORT", "ADDRESS", "PROTOCOL", "PID", "PROCESS", "ORIGIN", "TITLE")]
+    for p in result["ports"]:
+        origin = p["origin"]
+        rows.append((
+            str(p["port"]),
+            ",".join(p["bind"]),
+            p["protocol"] or "",
+            str(p["pid"] or ""),
+            p["process"] or "",
+            (origin.label or origin.type) if origin is not None else "",
+            p["title"] or "",
+        ))
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]) - 1)]
+    lines = ["  ".join(cell.ljust(width) for cell, width in zip(row, widths)) + "  " + row[-1] for row in rows]
+    lines.append(f"{len(result['ports'])} ports open (scan {result['scan_ms']} ms, total {result['total_ms']} ms)")
+    return "\n".join(line.rstrip() for line in lines)
+
+def print_result(main, result: dict, output_format: str, watching: bool):
+    if output_format == "json":
+        # --watch では1スキャン1行（JSON Lines）で出力する
+        text = main.dumps(result).decode() if watching else json.dumps(result, default=main._to_json, ensure_ascii=False, indent=2)
+    else:
+        text = format_table(result)
+        if watching and sys.stdout.isatty():
+            text = "\033[H\033[J" + time.strftime("%H:%M:%S") + "\n" + text
+    print(text, flush=True)
+
+async def scan_command(args) -> int:
+    main = load_main()
+    ports = ([port for r in main.parse_port_spec(args.ports) for port in r]
+             if args.ports else main.scan_plan.all_ports())
+    wanted = set(ports)
+    processes = not args.no_process
+    sniff = not args.no_sniff
+
+    if args.watch is None:
+        print_result(main, await scan_once(main, ports, processes, sniff, args.titles), args.format, False)
+        return 0
+
+    previous = object()
+    while True:
+        # LISTENの一覧（Linuxでは /proc を読むだけ）が変わったときだけスキャンし直す
+        listeners = await main.run_blocking(main.read_listeners)
+        if listeners is not None:
+            listeners = {port: inodes for port, inodes in listeners.items() if port in wanted}
+        if listeners is None or listeners != previous:
+            previous = listeners
+            print_result(main, await scan_once(main, ports, processes, sniff, args.titles), args.format, True)
+        await asyncio.sleep(args.watch)
+
+def main():
+    parser = argparse.ArgumentParser(prog="local_portal", description="Local Portal コマンドライン")
+    commands = parser.add_subparsers(dest="command", required=True)
+    scan = commands.add_parser("scan", help="LISTENしているポートを表示する")
+    scan.add_argument("--ports", help="スキャンするポート（例: 3000-9999,27017）。省略時は LOCALPORTAL_SCAN_RANGES などの設定に従う")
+    scan.add_argument("--format", choices=("table", "json"), default="table")
+    scan.add_argument("--no-process", action="store_true", help="プロセス情報（lsof/ps）を取得しない")
+    scan.add_argument("--no-sniff", action="store_true", help="プロトコルを判別しない（ポートへデータを送らない）")
+    scan.add_argument("--titles", action="store_true", help="HTTPでページのタイトルも取得する")
+    scan.add_argument("--watch", type=float, nargs="?", const=2.0, metavar="SECONDS",
+                      help="変化があるたびに表示し直す（確認間隔の秒数、既定2秒）")
+    args = parser.parse_args()
+
+    try:
+        sys.exit(asyncio.run(scan_command(args)))
+    except KeyboardInterrupt:
+        sys.exit(130)
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,198 @@
+import time
+_IMPORT_STARTED = time.perf_counter()
+
 from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect
 from fastapi.responses import HTMLResponse, StreamingResponse, JSONResponse, Response
 from fastapi.staticfiles import StaticFiles
 from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.background import BackgroundTask
+from starlette.datastructures import Headers
 import socket
+import sqlite3
 import json
 import subprocess
 import os
-import time
+import sys
+import signal
 import re
 from typing import List, Dict, Optional
 import asyncio
 import httpx
-from bs4 import BeautifulSoup
 import base64
-from playwright.async_api import async_playwright
-import websockets
+import concurrent.futures
+import functools
+import collections
+import contextlib
+import logging
+import random
+import bisect
+import gzip
+import hashlib
+import mimetypes
+import heapq
+import itertools
+import importlib
+import http.client
+import http.cookiejar
+import array
+import math
+# bs4 / websockets はプロキシに不要で読み込みも重いので、使うときに読み込む
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# ---- メトリクス（Prometheusテキスト形式） ----
+# 計測はプロキシのホットパスでも使うので、dictの更新と二分探索だけで済ませる
+
+_metrics = []
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values = {}
+        _metrics.append(self)
+
+    def _format_labels(self, labels: tuple, extra: str = "") -> str:
+        pairs = [f'{k}="{v}"' for k, v in zip(self.labelnames, labels)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for labels, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{self._format_labels(labels)} {value}")
+        return lines
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def inc(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) - amount
+
+    def set(self, value: float, *labels):
+        self._values[labels] = value
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "start")
+
+    def __init__(self, histogram, labels: tuple):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+        return False
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *labels):
+        state = self._values.get(labels)
+        if state is None:
+            # [バケットごとの件数..., +Infの件数, 合計]
+            state = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        state[bisect.bisect_left(self.buckets, value)] += 1
+        state[-1] += value
+
+    def time(self, *labels) -> _Timer:
+        return _Timer(self, labels)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for labels, state in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), state[:-1]):
+                cumulative += count
+                le = self._format_labels(labels, 'le="%s"' % bound)
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            lines.append(f"{self.name}_sum{self._format_labels(labels)} {state[-1]}")
+            lines.append(f"{self.name}_count{self._format_labels(labels)} {cumulative}")
+        return lines
+
+# マルチワーカー構成でワーカー自身の値を返すメトリクス（それ以外はスキャナーの値を返す）
+WORKER_METRIC_PREFIXES = ("localportal_proxy_", "localportal_websocket_")
+
+def render_metrics(prefixes: Optional[tuple] = None) -> str:
+    """prefixes を指定すると、名前がそのどれかで始まるメトリクスだけを出力する"""
+    lines = []
+    for metric in _metrics:
+        if prefixes is None or metric.name.startswith(prefixes):
+            lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+def drop_metrics(text: str, prefixes: tuple) -> str:
+    """Prometheusテキスト形式から、名前が prefixes のどれかで始まるメトリクスを取り除く"""
+    lines = []
+    for line in text.splitlines():
+        name = line.split()[2] if line.startswith("#") else re.split(r"[{ ]", line, 1)[0]
+        if line and not name.startswith(prefixes):
+            lines.append(line)
+    return "\n".join(lines) + "\n"
+
+SCAN_DURATION = Histogram("localportal_scan_duration_seconds", "scan_portsの所要時間")
+PROCESS_INFO_DURATION = Histogram("localportal_process_info_duration_seconds",
+                                  "プロセス情報の取得1回の所要時間（スキャン1回分のポートをまとめて調べる。ポートごとではない）")
+PAGE_INFO_DURATION = Histogram("localportal_page_info_duration_seconds", "ポートごとのget_page_infoの所要時間")
+SUBPROCESS_TOTAL = Counter("localportal_subprocess_total", "起動したサブプロセス数", ("command",))
+BROWSER_LAUNCH_DURATION = Histogram("localportal_browser_launch_seconds", "Chromiumの起動時間")
+THUMBNAIL_CAPTURE_DURATION = Histogram("localportal_thumbnail_capture_seconds", "サムネイル撮影の所要時間")
+THUMBNAIL_WORKER_RESTARTS_TOTAL = Counter("localportal_thumbnail_worker_restarts_total", "サムネイル撮影ワーカーを起動し直した回数", ("reason",))
+THUMBNAIL_WORKER_MEMORY = Gauge("localportal_thumbnail_worker_memory_bytes", "サムネイル撮影ワーカー（Chromiumを含む）のRSS")
+PROXY_REQUEST_DURATION = Histogram("localportal_proxy_request_duration_seconds", "プロキシしたHTTPリクエストの所要時間", ("port",))
+PROXY_REQUESTS_TOTAL = Counter("localportal_proxy_requests_total", "プロキシしたHTTPリクエスト数", ("port", "status"))
+PROXY_RESPONSE_BYTES = Counter("localportal_proxy_response_bytes_total", "プロキシしたレスポンスボディのバイト数", ("port",))
+PROXY_QUEUE_DURATION = Histogram("localportal_proxy_queue_seconds", "プロキシしたHTTPリクエストが同時実行数の制限で待った時間", ("port",))
+PROXY_REJECTED_TOTAL = Counter("localportal_proxy_rejected_total", "待ち行列が一杯で503を返したリクエスト数", ("port",))
+PROXY_REQUESTS_ACTIVE = Gauge("localportal_proxy_requests_active", "処理中のプロキシリクエスト数", ("port",))
+WEBSOCKET_RELAYS_ACTIVE = Gauge("localportal_websocket_relays_active", "中継中のWebSocket接続数", ("port",))
+
+def run_command(args: List[str], timeout: float) -> subprocess.CompletedProcess:
+    """subprocess.runのラッパー（起動回数をメトリクスに記録）"""
+    SUBPROCESS_TOTAL.inc(args[0])
+    return subprocess.run(args, capture_output=True, text=True, timeout=timeout)
+
+# lsof/ps やポートへの接続などブロッキングする処理はこのスレッドプールで実行し、
+# イベントループ（プロキシやWebSocket中継）を止めないようにする
+INTROSPECTION_WORKERS = 4
+_introspection_pool = concurrent.futures.ThreadPoolExecutor(
+    max_workers=INTROSPECTION_WORKERS, thread_name_prefix="introspection"
+)
+
+async def run_blocking(func, *args):
+    """ブロッキングする関数を専用スレッドプールで実行"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_introspection_pool, functools.partial(func, *args))
 
 def extract_port_from_host(host: str) -> Optional[int]:
     """Hostヘッダーからサブドメイン（ポート番号）を抽出
@@ -36,49 +214,363 @@ def extract_port_from_host(host: str) -> Optional[int]:
             return None
     return None
 
+# ---- プロキシのトレース（オプトイン） ----
+# サンプリングしたリクエストの区間ごとの所要時間をリングバッファに記録し、
+# 閾値より遅いリクエストは内訳をログに出す
+
+logger = logging.getLogger("localportal")
+
+trace_config = {
+    "sample_rate": float(os.environ.get("LOCALPORTAL_TRACE_SAMPLE_RATE", "0")),
+    "slow_ms": float(os.environ.get("LOCALPORTAL_TRACE_SLOW_MS", "0")),
+}
+_traces = collections.deque(maxlen=int(os.environ.get("LOCALPORTAL_TRACE_BUFFER", "200")))
+
+class ProxyTrace:
+    """1リクエスト分の区間計測
+
+    区間: queue（処理開始まで。同時実行数の制限による待ちを含む）, request_body（クライアントからのボディ受信）,
+    connect（上流へのTCP接続）, ttfb（上流へ送信してからヘッダー受信まで）,
+    body（上流からのボディ受信）, send（クライアントへの送信）
+    """
+    __slots__ = ("port", "method", "path", "sampled", "started_at", "start", "last", "spans",
+                 "status", "bytes", "_connect_started")
+
+    def __init__(self, port: int, method: str, path: str, sampled: bool):
+        self.port = port
+        self.method = method
+        self.path = path
+        self.sampled = sampled
+        self.started_at = time.time()
+        self.start = self.last = time.perf_counter()
+        self.spans = {}
+        self.status = None
+        self.bytes = 0
+        self._connect_started = 0.0
+
+    def lap(self, name: str):
+        """前回のlapからの経過時間を区間nameとして記録"""
+        now = time.perf_counter()
+        self.spans[name] = self.spans.get(name, 0.0) + (now - self.last) * 1000
+        self.last = now
+
+    async def httpx_trace(self, event_name: str, info: dict):
+        """httpcoreのtraceフックからTCP接続時間を拾う"""
+        if event_name == "connection.connect_tcp.started":
+            self._connect_started = time.perf_counter()
+        elif event_name == "connection.connect_tcp.complete":
+            self.spans["connect"] = (time.perf_counter() - self._connect_started) * 1000
+
+    def total_ms(self) -> float:
+        return (self.last - self.start) * 1000
+
+    def to_dict(self) -> dict:
+        return {
+            "port": self.port,
+            "method": self.method,
+            "path": self.path,
+            "started_at": self.started_at,
+            "status": self.status,
+            "bytes": self.bytes,
+            "total_ms": round(self.total_ms(), 3),
+            "spans": {name: round(ms, 3) for name, ms in self.spans.items()},
+        }
+
+def start_proxy_trace(request: Request, target_port: int) -> Optional[ProxyTrace]:
+    """トレースが有効ならProxyTraceを作成（無効ならNone）"""
+    sample_rate = trace_config["sample_rate"]
+    if sample_rate <= 0 and trace_config["slow_ms"] <= 0:
+        return None
+    sampled = sample_rate >= 1 or random.random() < sample_rate
+    return ProxyTrace(target_port, request.method, request.url.path, sampled)
+
+async def finish_proxy_trace(trace: ProxyTrace):
+    """クライアントへの送信完了後に呼ばれ、記録とスローログを行う"""
+    trace.lap("send")
+    if trace.sampled:
+        _traces.append(trace)
+    slow_ms = trace_config["slow_ms"]
+    if slow_ms > 0 and trace.total_ms() >= slow_ms:
+        logger.warning("slow proxy request: %s", json.dumps(trace.to_dict()))
+
+# ---- 同時実行数の制限 ----
+# テストやホットリロードのループが1つのポートに大量のリクエストを送っても、
+# 他のポートや管理画面が巻き込まれないようにする
+
+PROXY_MAX_CONCURRENCY = int(os.environ.get("LOCALPORTAL_PROXY_MAX_CONCURRENCY", "256"))
+PROXY_PORT_CONCURRENCY = int(os.environ.get("LOCALPORTAL_PROXY_PORT_CONCURRENCY", "32"))
+PROXY_QUEUE_LIMIT = int(os.environ.get("LOCALPORTAL_PROXY_QUEUE_LIMIT", "64"))
+PROXY_QUEUE_TIMEOUT = float(os.environ.get("LOCALPORTAL_PROXY_QUEUE_TIMEOUT", "10"))
+PROXY_RETRY_AFTER = 1
+
+class ConcurrencyLimiter:
+    """同時実行数の上限と、長さに上限のある待ち行列（先着順）"""
+
+    def __init__(self, limit: int, queue_limit: int):
+        self.limit = limit
+        self.queue_limit = queue_limit
+        self.active = 0
+        self._waiters = collections.deque()
+
+    @property
+    def idle(self) -> bool:
+        return self.active == 0 and not self._waiters
+
+    async def acquire(self, timeout: float) -> bool:
+        """枠を確保する（待ち行列が一杯、または待ちきれなければFalse）"""
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            return True
+        if len(self._waiters) >= self.queue_limit:
+            return False
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        try:
+            await asyncio.wait_for(future, timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        except asyncio.CancelledError:
+            # 枠を譲り受けた直後に取り消された場合は次へ回す
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+        finally:
+            try:
+                self._waiters.remove(future)
+            except ValueError:
+                pass
+
+    def release(self):
+        # 待っている人がいれば枠をそのまま譲る
+        while self._waiters:
+            future = self._waiters.popleft()
+            if not future.done():
+                future.set_result(None)
+                return
+        self.active -= 1
+
+class ProxyAdmission:
+    """ポートごとと全体の同時実行数を制限する"""
+
+    def __init__(self, limit: int, port_limit: int, queue_limit: int, timeout: float):
+        self.timeout = timeout
+        self.port_limit = port_limit
+        self.queue_limit = queue_limit
+        self._global = ConcurrencyLimiter(limit, queue_limit)
+        self._ports = {}  # port -> ConcurrencyLimiter
+
+    async def acquire(self, port: int) -> bool:
+        limiter = self._ports.get(port)
+        if limiter is None:
+            limiter = self._ports[port] = ConcurrencyLimiter(self.port_limit, self.queue_limit)
+        # ポートごとの枠を先に取るので、混んでいるポートのリクエストは全体の待ち行列を埋めない
+        if not await limiter.acquire(self.timeout):
+            self._discard_idle(port)
+            return False
+        try:
+            admitted = await self._global.acquire(self.timeout)
+        except asyncio.CancelledError:
+            self._release_port(port)
+            raise
+        if not admitted:
+            self._release_port(port)
+        return admitted
+
+    def release(self, port: int):
+        self._global.release()
+        self._release_port(port)
+
+    def _release_port(self, port: int):
+        self._ports[port].release()
+        self._discard_idle(port)
+
+    def _discard_idle(self, port: int):
+        limiter = self._ports.get(port)
+        if limiter is not None and limiter.idle:
+            del self._ports[port]
+
+proxy_admission = ProxyAdmission(PROXY_MAX_CONCURRENCY, PROXY_PORT_CONCURRENCY,
+                                 PROXY_QUEUE_LIMIT, PROXY_QUEUE_TIMEOUT)
+
+def overloaded_response() -> Response:
+    return JSONResponse(
+        {"error": "Too many concurrent requests to this server"},
+        status_code=503,
+        headers={"Retry-After": str(PROXY_RETRY_AFTER)},
+    )
+
 async def proxy_request(request: Request, target_port: int) -> Response:
     """HTTPリクエストをプロキシ"""
+    start = time.perf_counter()
+    trace = start_proxy_trace(request, target_port)
+    label = str(target_port)
+    if await proxy_admission.acquire(target_port):
+        PROXY_QUEUE_DURATION.observe(time.perf_counter() - start, label)
+        PROXY_REQUESTS_ACTIVE.inc(label)
+        try:
+            response = await _proxy_request(request, target_port, trace)
+        finally:
+            PROXY_REQUESTS_ACTIVE.dec(label)
+            proxy_admission.release(target_port)
+    else:
+        # 待ち行列が一杯なら待たせずにすぐ断る
+        PROXY_REJECTED_TOTAL.inc(label)
+        response = overloaded_response()
+    PROXY_REQUEST_DURATION.observe(time.perf_counter() - start, label)
+    PROXY_REQUESTS_TOTAL.inc(label, str(response.status_code))
+    PROXY_RESPONSE_BYTES.inc(label, amount=len(response.body))
+    if trace is not None:
+        trace.status = response.status_code
+        trace.bytes = len(response.body)
+        # 送信完了後に実行されるので、クライアントへの送信時間も計測できる
+        response.background = BackgroundTask(finish_proxy_trace, trace)
+    return response
+
+# hop-by-hop ヘッダー（ASGIのヘッダー名は小文字のバイト列なのでそのまま比較する）
+HOP_BY_HOP_HEADERS = frozenset({
+    b'connection', b'keep-alive', b'proxy-connection', b'proxy-authenticate',
+    b'proxy-authorization', b'te', b'trailer', b'transfer-encoding', b'upgrade',
+})
+REQUEST_SKIP_HEADERS = HOP_BY_HOP_HEADERS | {b'host', b'content-length'}
+
+def filter_request_headers(raw_headers: list, host: bytes) -> list:
+    """リクエストヘッダーをバイト列の組のまま転送用にする（Hostは書き換え）"""
+    headers = [(name, value) for name, value in raw_headers if name not in REQUEST_SKIP_HEADERS]
+    headers.append((b'host', host))
+    return headers
+
+def filter_response_headers(raw_headers: list) -> tuple:
+    """レスポンスヘッダーからhop-by-hopヘッダーを除く（Set-Cookieなどの重複はそのまま）
+
+    (ヘッダーのリスト, Content-Lengthがあったか) を返す。
+    """
+    headers = []
+    has_length = False
+    for name, value in raw_headers:
+        name = name.lower()
+        if name in HOP_BY_HOP_HEADERS:
+            continue
+        if name == b'content-length':
+            has_length = True
+        headers.append((name, value))
+    return headers, has_length
+
+# 上流への接続はクライアントを1つ使い回す（リクエストごとに作るとSSLコンテキストの作成や
+# 接続の確立が毎回かかる）。Cookieはブラウザ側のものをそのまま転送するので保存しない
+_upstream_client = None
+
+def get_upstream_client() -> httpx.AsyncClient:
+    global _upstream_client
+    if _upstream_client is None:
+        _upstream_client = httpx.AsyncClient(
+            timeout=30.0,
+            limits=httpx.Limits(max_connections=PROXY_MAX_CONCURRENCY, max_keepalive_connections=PROXY_PORT_CONCURRENCY),
+            cookies=http.cookiejar.CookieJar(policy=http.cookiejar.DefaultCookiePolicy(allowed_domains=[])),
+        )
+    return _upstream_client
+
+async def _proxy_request(request: Request, target_port: int, trace: Optional[ProxyTrace] = None) -> Response:
+    if trace is not None:
+        trace.lap("queue")
     path = request.url.path
     query = str(request.url.query)
-    target_url = f"http://localhost:{target_port}{path}"
+    target_url = f"http://{await upstream_host(target_port)}:{target_port}{path}"
     if query:
         target_url += f"?{query}"
 
-    # リクエストヘッダーをコピー（Hostは除く）
-    headers = {k: v for k, v in request.headers.items()
-               if k.lower() not in ('host', 'content-length', 'transfer-encoding')}
-    headers['Host'] = f"localhost:{target_port}"
+    headers = filter_request_headers(request.scope["headers"], b"localhost:%d" % target_port)
 
     # リクエストボディ取得
     body = await request.body()
+    if trace is not None:
+        trace.lap("request_body")
 
-    async with httpx.AsyncClient(timeout=30.0) as client:
+    client = get_upstream_client()
+    try:
+        upstream_request = client.build_request(
+            method=request.method,
+            url=target_url,
+            headers=headers,
+            content=body,
+            extensions={"trace": trace.httpx_trace} if trace is not None else None
+        )
+        response = await client.send(upstream_request, stream=True, follow_redirects=False)
+        if trace is not None:
+            trace.lap("ttfb")
+            # ttfbには接続時間を含めない
+            trace.spans["ttfb"] -= trace.spans.get("connect", 0.0)
         try:
-            response = await client.request(
-                method=request.method,
-                url=target_url,
-                headers=headers,
-                content=body,
-                follow_redirects=False
-            )
+            # Content-Encodingはそのまま転送するので展開しない
+            content = b''.join([chunk async for chunk in response.aiter_raw()])
+        finally:
+            await response.aclose()
+        if trace is not None:
+            trace.lap("body")
 
-            # レスポンスヘッダーをコピー
-            response_headers = dict(response.headers)
-            # hop-by-hop ヘッダーを除去
-            for header in ['transfer-encoding', 'connection', 'keep-alive']:
-                response_headers.pop(header, None)
-
-            return Response(
-                content=response.content,
-                status_code=response.status_code,
-                headers=response_headers,
-                media_type=response.headers.get('content-type')
-            )
-        except Exception as e:
-            return JSONResponse(
-                {"error": f"Proxy error: {str(e)}"},
-                status_code=502
-            )
+        response_headers, has_length = filter_response_headers(response.headers.raw)
+        if not has_length and request.method != 'HEAD' and response.status_code not in (204, 304):
+            response_headers.append((b'content-length', b'%d' % len(content)))
+        proxied = Response(content=content, status_code=response.status_code)
+        proxied.raw_headers = response_headers
+        return proxied
+    except Exception as e:
+        if isinstance(e, httpx.ConnectError):
+            upstream_failed(target_port)
+        return JSONResponse(
+            {"error": f"Proxy error: {str(e)}"},
+            status_code=502
+        )
+
+# ---- マルチワーカー構成 ----
+# serve.py でワーカーを複数起動した場合、スキャンとサムネイル撮影は
+# Unixソケットで待ち受ける1つのスキャナープロセスだけが行う。
+# ワーカーはスキャン関連のAPIをスキャナーへ中継し、Chromiumも起動しない。
+
+SCANNER_SOCKET = os.environ.get("LOCALPORTAL_SCANNER_SOCKET")
+SCANNER_PATHS = ("/api/ports", "/api/startup")
+
+_scanner_client = None
+
+def get_scanner_client() -> httpx.AsyncClient:
+    global _scanner_client
+    if _scanner_client is None:
+        _scanner_client = httpx.AsyncClient(
+            transport=httpx.AsyncHTTPTransport(uds=SCANNER_SOCKET),
+            base_url="http://localhost",
+            timeout=httpx.Timeout(10.0, read=None),
+        )
+    return _scanner_client
+
+async def relay_to_scanner(request: Request) -> Response:
+    """管理APIのリクエストをスキャナープロセスへ中継（SSEもそのまま流す）"""
+    url = request.url.path
+    if request.url.query:
+        url += f"?{request.url.query}"
+    headers = {k: v for k, v in request.headers.items()
+               if k.lower() not in ('host', 'content-length', 'transfer-encoding', 'connection')}
+    headers['Host'] = "localhost"
+
+    client = get_scanner_client()
+    try:
+        upstream_request = client.build_request(request.method, url, headers=headers, content=await request.body())
+        response = await client.send(upstream_request, stream=True)
+    except Exception as e:
+        return JSONResponse({"error": f"Scanner unavailable: {str(e)}"}, status_code=503)
+
+    response_headers = {k: v for k, v in response.headers.items()
+                        if k.lower() not in ('transfer-encoding', 'connection', 'keep-alive', 'content-length')}
+
+    async def relay_body():
+        try:
+            async for chunk in response.aiter_raw():
+                yield chunk
+        finally:
+            # ブラウザが切断したらスキャナーへの接続も閉じ、スキャナー側の処理を止める
+            await response.aclose()
+
+    return StreamingResponse(relay_body(), status_code=response.status_code, headers=response_headers)
 
 class ReverseProxyMiddleware(BaseHTTPMiddleware):
     async def dispatch(self, request: Request, call_next):
@@ -86,6 +578,9 @@ class ReverseProxyMiddleware(BaseHTTPMiddleware):
         target_port = extract_port_from_host(host)
 
         if target_port is None:
+            # マルチワーカー構成ではスキャン関連のAPIをスキャナーへ
+            if SCANNER_SOCKET and request.url.path.startswith(SCANNER_PATHS):
+                return await relay_to_scanner(request)
             # 管理画面 - 通常のルーティングへ
             return await call_next(request)
 
@@ -96,27 +591,576 @@ class ReverseProxyMiddleware(BaseHTTPMiddleware):
         # プロキシ処理
         return await proxy_request(request, target_port)
 
-app = FastAPI()
-app.add_middleware(ReverseProxyMiddleware)
-app.mount("/static", StaticFiles(directory="static"), name="static")
+class DashboardStaticFiles(StaticFiles):
+    """/static の配信
+
+    ダッシュボードのアセットは内容のハッシュを含むファイル名で配信する。
+    内容が変わればURLも変わるので長期キャッシュさせ、
+    圧縮済みのgzip/brotli版をAccept-Encodingに応じて返す。
+    """
+
+    def __init__(self, *args, assets=(), **kwargs):
+        super().__init__(*args, **kwargs)
+        self.urls = {}     # 元のファイル名 -> ハッシュ付きURL
+        self._assets = {}  # ハッシュ付きファイル名 -> (media_type, etag, {encoding: bytes})
+        for name in assets:
+            self._load_asset(name)
 
-async def check_port(port: int) -> Dict:
-    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    sock.settimeout(0.1)
+    def _load_asset(self, name: str):
+        with open(os.path.join(self.directory, name), 'rb') as f:
+            content = f.read()
+        digest = hashlib.sha256(content).hexdigest()[:12]
+        base, ext = os.path.splitext(name)
+        hashed_name = f"{base}.{digest}{ext}"
+
+        variants = {"gzip": gzip.compress(content, compresslevel=9)}
+        if brotli is not None:
+            variants["br"] = brotli.compress(content)
+        # 圧縮しても小さくならないものは配信しない
+        variants = {enc: data for enc, data in variants.items() if len(data) < len(content)}
+        variants["identity"] = content
+
+        media_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        self._assets[hashed_name] = (media_type, f'"{digest}"', variants)
+        self.urls[name] = f"/static/{hashed_name}"
+
+    @staticmethod
+    def _accepted_encodings(accept_encoding: str) -> set:
+        encodings = set()
+        for item in accept_encoding.split(','):
+            token, _, params = item.strip().partition(';')
+            if params.replace(' ', '') in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+                continue
+            encodings.add(token.strip().lower())
+        return encodings
+
+    async def get_response(self, path: str, scope) -> Response:
+        asset = self._assets.get(path)
+        if asset is None:
+            return await super().get_response(path, scope)
+
+        media_type, etag, variants = asset
+        request_headers = Headers(scope=scope)
+        headers = {
+            "Cache-Control": "public, max-age=31536000, immutable",
+            "ETag": etag,
+            "Vary": "Accept-Encoding",
+        }
+        if request_headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers=headers)
+
+        accepted = self._accepted_encodings(request_headers.get("accept-encoding", ""))
+        for encoding in ("br", "gzip"):
+            if encoding in variants and encoding in accepted:
+                headers["Content-Encoding"] = encoding
+                return Response(variants[encoding], media_type=media_type, headers=headers)
+        return Response(variants["identity"], media_type=media_type, headers=headers)
+
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
+    """起動と終了の処理（それぞれの関数はこのモジュールの後半で定義）"""
+    await schedule_browser_warmup()
+    await restore_state()
     try:
-        result = sock.connect_ex(('127.0.0.1', port))
-        if result == 0:
-            return {"port": port, "status": "open"}
-    except:
-        pass
+        yield
     finally:
-        sock.close()
+        await close_upstream_client()
+        await shutdown_screenshots()
+        # 間隔を空けて保存している学習済みポートの時刻を書き込んでおく
+        saving = scan_plan.save_learned(force=True)
+        if saving is not None:
+            await saving
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(ReverseProxyMiddleware)
+static_files = DashboardStaticFiles(directory="static", assets=("dashboard.css", "dashboard.js"))
+app.mount("/static", static_files, name="static")
+
+async def close_upstream_client():
+    global _upstream_client
+    if _upstream_client is not None:
+        await _upstream_client.aclose()
+        _upstream_client = None
+
+# ---- レコード ----
+# ポート・プロセス・起動元の情報は __slots__ の軽量なクラスで持ち、
+# JSONへのエンコードは orjson があれば使う（なければ標準のjson）
+
+def _to_json(obj):
+    if isinstance(obj, Record):
+        return obj.to_dict()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+def dumps(obj) -> bytes:
+    """JSONにエンコード（Recordはそのまま渡せる）"""
+    if orjson is not None:
+        return orjson.dumps(obj, default=_to_json)
+    return json.dumps(obj, default=_to_json, ensure_ascii=False, separators=(',', ':')).encode()
+
+class Record:
+    """__slots__ の名前をそのままJSONのキーにする（"_" で始まるものは除く）"""
+    __slots__ = ()
+
+    def to_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__ if not name.startswith('_')}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Record":
+        return cls(**{name: data[name] for name in cls.__slots__ if name in data})
+
+    def __eq__(self, other) -> bool:
+        return type(other) is type(self) and self.to_dict() == other.to_dict()
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+class Origin(Record):
+    """プロセスの起動元（container はDockerのコンテナ情報）"""
+    __slots__ = ("type", "label", "parent", "command", "start_time", "container")
+
+    def __init__(self, type: str = "unknown", label: str = "", parent: str = "", command: str = "",
+                 start_time: str = "", container: Optional[dict] = None):
+        self.type = type
+        self.label = label
+        self.parent = parent
+        self.command = command
+        self.start_time = start_time
+        self.container = container
+
+class ProcessInfo(Record):
+    """ポートを開いているプロセス（group はプロセスツリーの根のPIDかDockerのプロジェクト）"""
+    __slots__ = ("process", "is_likely_web", "origin", "pid", "group")
+
+    def __init__(self, process: str = "Unknown", is_likely_web: bool = True, origin: Optional[Origin] = None,
+                 pid: Optional[int] = None, group=None):
+        self.process = process
+        self.is_likely_web = is_likely_web
+        self.origin = origin if origin is not None else Origin()
+        self.pid = pid
+        self.group = group
+
+# サムネイルとその古さは撮影のたびに変わるので、エンコード結果のキャッシュに含めない
+_VOLATILE_FIELDS = ("thumbnail", "thumbnail_stale", "_encoded", "_connect_ms")
+
+class PortRecord(Record):
+    """1ポート分の情報
+
+    サムネイル以外のフィールドのエンコード結果をキャッシュし、変更されたときだけ作り直す。
+    """
+    __slots__ = ("port", "status", "address", "family", "bind", "process", "origin", "pid", "group",
+                 "protocol", "title", "thumbnail", "thumbnail_stale", "thumbnail_of", "_encoded", "_connect_ms")
+
+    def __init__(self, port: int, status: str = "open", address: str = "127.0.0.1", family: str = "ipv4",
+                 bind: Optional[List[str]] = None, process: Optional[str] = None, origin: Optional[Origin] = None,
+                 pid: Optional[int] = None, group=None, protocol: Optional[str] = None, title: Optional[str] = None,
+                 thumbnail: Optional[str] = None, thumbnail_stale: bool = False,
+                 thumbnail_of: Optional[int] = None):
+        self.port = port
+        self.status = status
+        self.address = address
+        self.family = family
+        self.bind = bind if bind is not None else [address]
+        self.process = process
+        self.origin = origin
+        self.pid = pid
+        self.group = group
+        self.protocol = protocol  # プロトコルの判別結果（判別できなければNone）
+        self.title = title
+        self.thumbnail = thumbnail
+        self.thumbnail_stale = thumbnail_stale
+        self.thumbnail_of = thumbnail_of
+        self._encoded = None
+        self._connect_ms = math.nan  # スキャン時の接続時間（応答性の履歴に使う）
+
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        if name not in _VOLATILE_FIELDS:
+            object.__setattr__(self, "_encoded", None)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "PortRecord":
+        record = super().from_dict(data)
+        if isinstance(record.origin, dict):
+            record.origin = Origin.from_dict(record.origin)
+        return record
+
+    def copy(self) -> "PortRecord":
+        record = PortRecord.__new__(PortRecord)
+        for name in self.__slots__:
+            object.__setattr__(record, name, getattr(self, name))
+        return record
+
+    def set_process(self, info: ProcessInfo):
+        self.process = info.process
+        self.origin = info.origin
+        self.pid = info.pid
+        self.group = info.group
+
+    def same_as(self, other: "PortRecord") -> bool:
+        """サムネイル以外が同じか"""
+        return all(getattr(self, name) == getattr(other, name)
+                   for name in self.__slots__ if name not in _VOLATILE_FIELDS)
+
+    def adopt_encoding(self, other: "PortRecord"):
+        """内容が同じレコードのエンコード結果を引き継ぐ"""
+        if other._encoded is not None and self.same_as(other):
+            object.__setattr__(self, "_encoded", other._encoded)
+
+    def encode_fields(self) -> bytes:
+        """サムネイル以外のフィールドのJSON（キャッシュする）"""
+        if self._encoded is None:
+            fields = {name: getattr(self, name) for name in self.__slots__ if name not in _VOLATILE_FIELDS}
+            object.__setattr__(self, "_encoded", dumps(fields))
+        return self._encoded
+
+    def encode(self) -> bytes:
+        """JSONにエンコード（base64のサムネイルはエスケープ不要なのでそのまま埋め込む）"""
+        thumbnail = b'"%s"' % self.thumbnail.encode('ascii') if self.thumbnail else b'null'
+        stale = b'true' if self.thumbnail_stale else b'false'
+        return b''.join((self.encode_fields()[:-1], b',"thumbnail_stale":', stale, b',"thumbnail":', thumbnail, b'}'))
+
+def encode_ports(ports: List[PortRecord], **extra) -> bytes:
+    """{"ports": [...], ...} を各レコードのキャッシュを使ってエンコード"""
+    parts = [b'{"ports":[', b','.join(p.encode() for p in ports), b']']
+    for key, value in extra.items():
+        parts.append(b',"%s":%s' % (key.encode(), dumps(value)))
+    parts.append(b'}')
+    return b''.join(parts)
+
+def connect_address(bound: str) -> str:
+    """LISTENしているアドレスから接続先のアドレスを決める"""
+    if bound in ('0.0.0.0', '*'):
+        return '127.0.0.1'
+    if bound == '::':
+        return '::1'
+    if bound.startswith('::ffff:'):
+        # IPv4射影アドレス
+        return bound[7:]
+    return bound
+
+def check_port(port: int, bound_addresses: Optional[List[str]] = None) -> Optional[PortRecord]:
+    """ポートに接続できるか確認し、接続できたアドレスも記録する
+
+    bound_addresses はLISTENしているアドレス（分からなければNone）。
+    分からない場合は127.0.0.1に加えて::1も試す。
+    """
+    candidates = [connect_address(a) for a in bound_addresses or ()] + ['127.0.0.1']
+    if bound_addresses is None:
+        candidates.append('::1')
+    for address in dict.fromkeys(candidates):
+        family = socket.AF_INET6 if ':' in address else socket.AF_INET
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.settimeout(0.1)
+        try:
+            start = time.perf_counter()
+            if sock.connect_ex((address, port)) == 0:
+                record = PortRecord(
+                    port,
+                    address=address,
+                    family="ipv6" if family == socket.AF_INET6 else "ipv4",
+                    bind=sorted(bound_addresses) if bound_addresses else [address],
+                )
+                record._connect_ms = (time.perf_counter() - start) * 1000
+                return record
+        except OSError:
+            pass
+        finally:
+            sock.close()
     return None
 
-async def scan_ports(start: int = 3000, end: int = 9999) -> List[Dict]:
-    tasks = [check_port(port) for port in range(start, end + 1)]
-    results = await asyncio.gather(*tasks)
-    return [r for r in results if r]
+def _check_ports(ports: List[int], bound: Optional[Dict[int, List[str]]] = None) -> List[PortRecord]:
+    results = []
+    for port in ports:
+        r = check_port(port, bound.get(port, []) if bound is not None else None)
+        if r:
+            results.append(r)
+    return results
+
+# ---- 接続先アドレス ----
+# "localhost" だと新しい接続のたびに名前解決とIPv6→IPv4のフォールバックが起きるので、
+# スキャンで見つけたアドレスへ直接接続する
+
+# 接続に失敗したポートは、スキャンや監視で新しいアドレスが分かるまでの間、
+# 間隔を空けて（見つからなければ倍にしながら）調べ直す。再起動中のサーバーへの
+# リクエストのたびに調べ直すと、/proc の読み込みや netstat の起動が繰り返される
+UPSTREAM_RECHECK_MIN = 1.0
+UPSTREAM_RECHECK_MAX = 30.0
+
+upstream_addresses: Dict[int, str] = {}
+_upstream_suspect = set()  # 接続に失敗したポート
+_upstream_backoff: Dict[int, tuple] = {}  # port -> (次に調べ直せる時刻, 直前の間隔)
+_upstream_resolving: Dict[int, asyncio.Future] = {}
+# 調べ直しはスキャンの lsof/ps で埋まることがある run_blocking のスレッドプールを待たないよう、
+# 専用の1スレッドで行う
+_resolve_pool = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="resolve-upstream")
+
+def record_upstream(record: PortRecord):
+    upstream_addresses[record.port] = record.address
+    _upstream_suspect.discard(record.port)
+    _upstream_backoff.pop(record.port, None)
+
+def forget_upstream(port: int):
+    upstream_addresses.pop(port, None)
+    _upstream_suspect.discard(port)
+    _upstream_backoff.pop(port, None)
+
+def upstream_failed(port: int):
+    """接続に失敗した（サーバーが別のアドレスで起動し直したかもしれないので調べ直す）"""
+    _upstream_suspect.add(port)
+
+def _resolve_upstream(port: int) -> Optional[str]:
+    bound = read_bound_addresses()
+    record = check_port(port, bound.get(port, []) if bound is not None else None)
+    return record.address if record else None
+
+async def _resolve(port: int) -> str:
+    loop = asyncio.get_running_loop()
+    address = await loop.run_in_executor(_resolve_pool, _resolve_upstream, port)
+    now = time.monotonic()
+    if address is None:
+        # まだ起動していない。しばらくは今までのアドレス（なければ127.0.0.1）を使う
+        interval = min(_upstream_backoff.get(port, (0.0, UPSTREAM_RECHECK_MIN / 2))[1] * 2, UPSTREAM_RECHECK_MAX)
+        _upstream_backoff[port] = (now + interval, interval)
+        return upstream_addresses.get(port, '127.0.0.1')
+    upstream_addresses[port] = address
+    _upstream_suspect.discard(port)
+    _upstream_backoff[port] = (now + UPSTREAM_RECHECK_MIN, UPSTREAM_RECHECK_MIN / 2)
+    return address
+
+async def upstream_host(port: int) -> str:
+    """プロキシの接続先ホスト（URLにそのまま使える形式）"""
+    address = upstream_addresses.get(port)
+    if address is None or port in _upstream_suspect:
+        # スキャナーが別プロセスのワーカーなどでは初回だけここで調べる
+        if time.monotonic() < _upstream_backoff.get(port, (0.0, 0.0))[0]:
+            address = address or '127.0.0.1'
+        else:
+            task = _upstream_resolving.get(port)
+            if task is None:
+                task = _upstream_resolving[port] = asyncio.ensure_future(_resolve(port))
+                task.add_done_callback(lambda _: _upstream_resolving.pop(port, None))
+            address = await asyncio.shield(task)
+    return f"[{address}]" if ':' in address else address
+
+async def scan_ports(start: int = 3000, end: int = 9999) -> List[PortRecord]:
+    return await scan_port_list(range(start, end + 1))
+
+def _scan_targets(ports: List[int]) -> tuple:
+    """接続して確かめるポートと、LISTENしているアドレス
+
+    LISTENの一覧が取れたときは、そこにあるポートとDockerの公開ポート（iptablesで転送され
+    一覧に出ないことがある）にだけ接続する。閉じているポートへの数千回の接続は
+    スレッドプールとイベントループでGILを取り合い、スキャン中のプロキシを遅くする。
+    """
+    bound = read_bound_addresses()
+    if bound is None:
+        return ports, None
+    docker_ports = get_docker_ports()
+    return [port for port in ports if port in bound or port in docker_ports], bound
+
+async def scan_port_list(ports) -> List[PortRecord]:
+    with SCAN_DURATION.time():
+        # 分割してスレッドプールで並行にスキャン
+        ports, bound = await run_blocking(_scan_targets, list(ports))
+        step = max(1, -(-len(ports) // INTROSPECTION_WORKERS))
+        chunks = [ports[i:i + step] for i in range(0, len(ports), step)]
+        results = await asyncio.gather(*(run_blocking(_check_ports, chunk, bound) for chunk in chunks))
+    found = [r for chunk in results for r in chunk]
+    for r in found:
+        record_upstream(r)
+        responsiveness.record_connect(r.port, r._connect_ms)
+    return found
+
+# ---- 応答性の履歴 ----
+# スキャン時の接続時間とタイトル取得時のTTFB・ステータスをポートごとに記録する。
+# 追加の計測はせず、固定長のarrayを使ったリングバッファなのでポートが多くてもメモリは一定。
+
+HISTORY_SIZE = 120
+HISTORY_MERGE_WINDOW = 5.0  # 接続時間の直後に届いたTTFBは同じサンプルにまとめる
+
+class ResponsivenessHistory:
+    """1ポート分のリングバッファ（未計測の値はNaN、ステータスは0）"""
+    __slots__ = ("times", "connect_ms", "ttfb_ms", "status", "next", "count")
+
+    def __init__(self, size: int = HISTORY_SIZE):
+        self.times = array.array('d', bytes(8 * size))
+        self.connect_ms = array.array('f', [math.nan]) * size
+        self.ttfb_ms = array.array('f', [math.nan]) * size
+        self.status = array.array('H', bytes(2 * size))
+        self.next = 0
+        self.count = 0
+
+    def _latest(self) -> int:
+        return (self.next - 1) % len(self.times)
+
+    def append(self, connect_ms: float = math.nan, ttfb_ms: float = math.nan, status: int = 0):
+        i = self.next
+        self.times[i] = time.time()
+        self.connect_ms[i] = connect_ms
+        self.ttfb_ms[i] = ttfb_ms
+        self.status[i] = status
+        self.next = (i + 1) % len(self.times)
+        self.count = min(self.count + 1, len(self.times))
+
+    def record_http(self, ttfb_ms: float, status: int):
+        i = self._latest()
+        if self.count and math.isnan(self.ttfb_ms[i]) and time.time() - self.times[i] < HISTORY_MERGE_WINDOW:
+            self.ttfb_ms[i] = ttfb_ms
+            self.status[i] = status
+        else:
+            self.append(ttfb_ms=ttfb_ms, status=status)
+
+    def _ordered(self, values) -> list:
+        start = (self.next - self.count) % len(self.times)
+        indices = [(start + k) % len(self.times) for k in range(self.count)]
+        return [values[i] for i in indices]
+
+    def to_dict(self) -> dict:
+        """古い順の系列（NaNはnull、ミリ秒は小数第1位まで）"""
+        def ms(values):
+            return [None if math.isnan(v) else round(v, 1) for v in self._ordered(values)]
+        return {
+            "t": [round(t, 1) for t in self._ordered(self.times)],
+            "connect_ms": ms(self.connect_ms),
+            "ttfb_ms": ms(self.ttfb_ms),
+            "status": [s or None for s in self._ordered(self.status)],
+        }
+
+class ResponsivenessTracker:
+    def __init__(self, size: int = HISTORY_SIZE):
+        self.size = size
+        self._histories = {}  # port -> ResponsivenessHistory
+
+    def _history(self, port: int) -> ResponsivenessHistory:
+        history = self._histories.get(port)
+        if history is None:
+            history = self._histories[port] = ResponsivenessHistory(self.size)
+        return history
+
+    def record_connect(self, port: int, connect_ms: float):
+        self._history(port).append(connect_ms=connect_ms)
+
+    def record_http(self, port: int, ttfb_ms: float, status: int):
+        self._history(port).record_http(ttfb_ms, status)
+
+    def forget(self, port: int):
+        self._histories.pop(port, None)
+
+    def get(self, port: int) -> Optional[dict]:
+        history = self._histories.get(port)
+        return history.to_dict() if history is not None else None
+
+    def sparklines(self) -> Dict[int, dict]:
+        # orjsonは文字列以外のキーを受け付けないので文字列にする
+        return {str(port): history.to_dict() for port, history in sorted(self._histories.items())}
+
+responsiveness = ResponsivenessTracker()
+
+# ---- スキャン計画 ----
+# 一度開いているのを見たポート（学習済み）と明示したポートは毎回、
+# それ以外の範囲はたまにだけスキャンする
+
+def parse_port_spec(spec: str) -> List[range]:
+    """"3000-9999,27017" のような指定をrangeのリストにする"""
+    ranges = []
+    for item in spec.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        if '-' in item:
+            start, end = item.split('-', 1)
+            ranges.append(range(int(start), int(end) + 1))
+        else:
+            ranges.append(range(int(item), int(item) + 1))
+    return ranges
+
+# 学習したポートの最後に開いていた時刻だけが変わったときに保存する間隔（秒）。
+# 忘れるまでの時間（既定7日）に比べて十分短ければよいので、スキャンのたびには書き込まない
+LEARNED_SAVE_INTERVAL = 600
+
+class ScanPlan:
+    """スキャン対象のポートと、どのポートを毎回スキャンするかを決める"""
+
+    def __init__(self, ranges: List[range], include: List[range], exclude: List[range],
+                 cold_interval: float, learned_ttl: float):
+        self.ranges = ranges
+        self.include = {port for r in include for port in r}
+        self.exclude = {port for r in exclude for port in r}
+        self.cold_interval = cold_interval
+        self.learned_ttl = learned_ttl
+        self.learned = {}  # port -> 最後に開いていた時刻
+        self._last_full_scan = 0.0
+        self._learned_changed = False  # 学習したポートが増えた・減った（次のスキャンで保存）
+        self._learned_touched = False  # 最後に開いていた時刻だけが変わった
+        self._learned_saved_at = 0.0
+
+    @classmethod
+    def from_env(cls) -> "ScanPlan":
+        return cls(
+            ranges=parse_port_spec(os.environ.get("LOCALPORTAL_SCAN_RANGES", "3000-9999")),
+            include=parse_port_spec(os.environ.get("LOCALPORTAL_SCAN_INCLUDE", "")),
+            exclude=parse_port_spec(os.environ.get("LOCALPORTAL_SCAN_EXCLUDE", "8888")),
+            cold_interval=float(os.environ.get("LOCALPORTAL_SCAN_COLD_INTERVAL", "60")),
+            learned_ttl=float(os.environ.get("LOCALPORTAL_SCAN_LEARNED_TTL", str(7 * 24 * 3600))),
+        )
+
+    def contains(self, port: int) -> bool:
+        if port in self.exclude:
+            return False
+        return port in self.include or any(port in r for r in self.ranges)
+
+    def hot_ports(self) -> List[int]:
+        ports = (set(self.learned) | self.include) - self.exclude
+        return sorted(ports)
+
+    def all_ports(self) -> List[int]:
+        """学習済みのポートを先頭に、対象の全ポート"""
+        hot = self.hot_ports()
+        hot_set = set(hot)
+        cold = [port for r in self.ranges for port in r if port not in hot_set and port not in self.exclude]
+        return hot + cold
+
+    def needs_full_scan(self) -> bool:
+        return time.time() - self._last_full_scan >= self.cold_interval
+
+    def learn(self, ports):
+        now = time.time()
+        for port in ports:
+            if port not in self.learned:
+                self._learned_changed = True
+            self.learned[port] = now
+            self._learned_touched = True
+        # 長い間見かけていないポートは忘れる
+        for port in [p for p, seen in self.learned.items() if now - seen > self.learned_ttl]:
+            del self.learned[port]
+            self._learned_changed = True
+
+    def save_learned(self, force: bool = False) -> Optional[asyncio.Future]:
+        """学習したポートを保存する（書き込んだ場合はその完了のFutureを返す）
+
+        ポートが増減したときはすぐに保存し、時刻だけの変化は LEARNED_SAVE_INTERVAL 秒ごと
+        （force を指定したときは必ず）にまとめて保存する。
+        """
+        if state_store is None:
+            return None
+        due = force or time.time() - self._learned_saved_at >= LEARNED_SAVE_INTERVAL
+        if not (self._learned_changed or (self._learned_touched and due)):
+            return None
+        self._learned_changed = self._learned_touched = False
+        self._learned_saved_at = time.time()
+        return state_store.save_learned(dict(self.learned))
+
+    async def scan(self, full: bool = False) -> List[PortRecord]:
+        """計画に従ってスキャン（必要なときだけ全範囲を見る）"""
+        full = full or self.needs_full_scan()
+        ports = await scan_port_list(self.all_ports() if full else self.hot_ports())
+        if full:
+            self._last_full_scan = time.time()
+        self.learn(p.port for p in ports)
+        self.save_learned()
+        return ports
+
+scan_plan = ScanPlan.from_env()
 
 # launchdサービスキャッシュ
 _launchd_cache = {}
@@ -131,18 +1175,104 @@ def get_launchd_services() -> dict:
         return _launchd_cache
 
     try:
-        result = subprocess.run(['launchctl', 'list'], capture_output=True, text=True, timeout=2)
-        _launchd_cache = {}
+        result = run_command(['launchctl', 'list'], timeout=2)
+        # スレッドプールから並行に呼ばれるので、作り終えてから差し替える
+        services = {}
         for line in result.stdout.strip().split('\n')[1:]:
             parts = line.split('\t')
             if len(parts) >= 3 and parts[0] != '-':
-                _launchd_cache[parts[0]] = parts[2]  # PID -> Label
+                services[parts[0]] = parts[2]  # PID -> Label
+        _launchd_cache = services
         _launchd_cache_time = time.time()
     except:
         pass
     return _launchd_cache
 
-def get_process_origin(pid: str) -> dict:
+# ---- Docker ----
+# 公開ポートとコンテナの対応はDocker Engine APIからまとめて取得する
+# （docker-proxyごとにpsを実行するより安く、コンテナ名やcomposeプロジェクトも分かる）
+
+def default_docker_socket() -> str:
+    for path in ('/var/run/docker.sock', os.path.expanduser('~/.docker/run/docker.sock')):
+        if os.path.exists(path):
+            return path
+    return '/var/run/docker.sock'
+
+DOCKER_SOCKET = os.environ.get("LOCALPORTAL_DOCKER_SOCKET") or default_docker_socket()
+NON_WEB_IMAGES = {'postgres', 'mysql', 'mariadb', 'mongo', 'redis', 'memcached', 'rabbitmq'}
+
+_docker_cache = {}
+_docker_cache_time = 0
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """Unixソケット越しのHTTP接続"""
+
+    def __init__(self, path: str, timeout: float = 1.0):
+        super().__init__('localhost', timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.path)
+        self.sock = sock
+
+def _list_containers() -> list:
+    conn = UnixHTTPConnection(DOCKER_SOCKET)
+    try:
+        conn.request('GET', '/containers/json')
+        response = conn.getresponse()
+        if response.status != 200:
+            raise OSError(f"Docker API returned {response.status}")
+        return json.loads(response.read())
+    finally:
+        conn.close()
+
+def get_docker_ports() -> Dict[int, dict]:
+    """公開ポート -> コンテナ情報をキャッシュ付きで取得（Dockerが動いていなければ空）"""
+    global _docker_cache, _docker_cache_time
+
+    if time.time() - _docker_cache_time < CACHE_TTL:
+        return _docker_cache
+    if not os.path.exists(DOCKER_SOCKET):
+        return {}
+
+    try:
+        containers = _list_containers()
+    except Exception:
+        # 失敗してもしばらくは問い合わせない
+        _docker_cache, _docker_cache_time = {}, time.time()
+        return _docker_cache
+
+    # スレッドプールから並行に呼ばれるので、作り終えてから差し替える
+    ports = {}
+    for container in containers:
+        labels = container.get("Labels") or {}
+        names = container.get("Names") or []
+        info = {
+            "id": container.get("Id", "")[:12],
+            "name": names[0].lstrip('/') if names else "",
+            "image": container.get("Image", ""),
+            "project": labels.get("com.docker.compose.project", ""),
+            "service": labels.get("com.docker.compose.service", ""),
+        }
+        for mapping in container.get("Ports") or []:
+            if mapping.get("Type") != "tcp" or not mapping.get("PublicPort"):
+                continue
+            ports.setdefault(mapping["PublicPort"], dict(info, container_port=mapping.get("PrivatePort")))
+    _docker_cache = ports
+    _docker_cache_time = time.time()
+    return _docker_cache
+
+def docker_origin(container: dict) -> Origin:
+    """コンテナ情報を起動元情報の形式にする"""
+    if container["project"]:
+        label = f"{container['project']}/{container['service'] or container['name']}"
+    else:
+        label = container["name"]
+    return Origin("docker", label, "docker", container["image"], container=container)
+
+def get_process_origin(pid: str) -> Origin:
     """プロセスの起動元情報を取得"""
     origin = {
         "type": "unknown",
@@ -160,10 +1290,7 @@ def get_process_origin(pid: str) -> dict:
             origin["label"] = launchd_services[pid]
 
         # ps で親プロセス・コマンド・起動時刻を取得
-        ps_result = subprocess.run(
-            ['ps', '-p', pid, '-o', 'ppid=,command=,lstart='],
-            capture_output=True, text=True, timeout=1
-        )
+        ps_result = run_command(['ps', '-p', pid, '-o', 'ppid=,command=,lstart='], timeout=1)
         if ps_result.stdout.strip():
             output = ps_result.stdout.strip()
             # ppidは最初の数字
@@ -189,10 +1316,7 @@ def get_process_origin(pid: str) -> dict:
 
                 # 親プロセス名を取得
                 if ppid and ppid != '0':
-                    parent_result = subprocess.run(
-                        ['ps', '-p', ppid, '-o', 'comm='],
-                        capture_output=True, text=True, timeout=1
-                    )
+                    parent_result = run_command(['ps', '-p', ppid, '-o', 'comm='], timeout=1)
                     if parent_result.stdout.strip():
                         parent_name = os.path.basename(parent_result.stdout.strip())
                         origin["parent"] = parent_name
@@ -212,96 +1336,974 @@ def get_process_origin(pid: str) -> dict:
     except:
         pass
 
-    return origin
+    return Origin.from_dict(origin)
 
-def get_process_info(port: int) -> dict:
-    """プロセス名、Web判定、起動元情報を取得"""
-    default_origin = {"type": "unknown", "label": "", "parent": "", "command": "", "start_time": ""}
-    try:
-        result = subprocess.run(
-            ['lsof', '-i', f':{port}', '-sTCP:LISTEN', '-n', '-P'],
-            capture_output=True, text=True, timeout=1
-        )
-        lines = result.stdout.strip().split('\n')
-        if len(lines) > 1:
-            parts = lines[1].split()
-            pid = parts[1] if len(parts) > 1 else None
-
-            # PIDからプロセス名を取得（フルパスからbasename）
-            process = "Unknown"
-            origin = default_origin
-            if pid:
-                ps_result = subprocess.run(
-                    ['ps', '-p', pid, '-o', 'comm='],
-                    capture_output=True, text=True, timeout=1
-                )
-                if ps_result.stdout.strip():
-                    process = os.path.basename(ps_result.stdout.strip())
-                # 起動元情報を取得
-                origin = get_process_origin(pid)
-
-            non_web_processes = {'postgres', 'mysql', 'mysqld', 'mongod', 'redis-server', 'memcached', 'code helper'}
-            is_non_web = any(nwp in process.lower() for nwp in non_web_processes)
-            return {"process": process, "is_likely_web": not is_non_web, "origin": origin}
-    except:
-        pass
-    return {"process": "Unknown", "is_likely_web": True, "origin": default_origin}
+# ---- プロセスの集約 ----
+# 1つのプロセス（やnext dev・docker-composeのようなプロセスツリー）が複数のポートを開くことが多いので、
+# lsof/psはスキャンごとに1回、起動元の取得はプロセスごとに1回だけ行う
 
-async def get_page_info(port: int) -> tuple:
-    try:
-        async with httpx.AsyncClient(timeout=0.5) as client:
-            response = await client.get(f"http://localhost:{port}")
-            soup = BeautifulSoup(response.text, 'html.parser')
-            title = soup.find('title')
-            title_text = title.string.strip() if title and title.string else None
-            
-            if not title_text:
-                return None, None
-            
-            async with async_playwright() as p:
-                browser = await p.chromium.launch()
-                page = await browser.new_page(viewport={'width': 1280, 'height': 720})
-                await page.goto(f"http://localhost:{port}", timeout=5000, wait_until='load')
-                await page.wait_for_timeout(500)
-                screenshot = await page.screenshot(type='png')
-                await browser.close()
-                thumbnail = base64.b64encode(screenshot).decode('utf-8')
-                return title_text, thumbnail
-    except:
-        return None, None
+NON_WEB_PROCESSES = {'postgres', 'mysql', 'mysqld', 'mongod', 'redis-server', 'memcached', 'code helper'}
+# ここまで遡ったらプロセスツリーの根とする（シェルやlaunchdの子）
+TREE_BOUNDARIES = {'launchd', 'init', 'systemd', 'login', 'sshd', 'tmux', 'screen',
+                   'terminal', 'iterm2', 'zsh', 'bash', 'fish'}
 
-@app.get("/api/health")
-async def health_check():
-    return {"status": "ok"}
+_origin_cache = {}  # (pid, プロセス名) -> 起動元情報
 
-@app.get("/api/hostname")
-async def get_hostname():
-    """ホスト名とDNS設定情報を返す"""
-    hostname = socket.gethostname()
-    return {
-        "hostname": hostname,
-        "setup_command": f"sudo mkdir -p /etc/resolver && echo 'nameserver 127.0.0.1' | sudo tee /etc/resolver/{hostname.split('.')[-1] if '.' in hostname else 'local'}"
-    }
+def _default_process_info() -> ProcessInfo:
+    return ProcessInfo()
 
-@app.websocket("/{path:path}")
-async def websocket_proxy(websocket: WebSocket, path: str = ""):
-    """WebSocketリバースプロキシ"""
-    host = websocket.headers.get("host", "")
-    target_port = extract_port_from_host(host)
+def _listening_pids(port: Optional[int] = None) -> Dict[int, str]:
+    """LISTEN中のポートとPIDの対応（lsof 1回。port を指定するとそのポートだけ調べる）"""
+    target = f'-iTCP:{port}' if port is not None else '-iTCP'
+    result = run_command(['lsof', '-nP', target, '-sTCP:LISTEN', '-Fpn'], timeout=2)
+    owners = {}
+    pid = None
+    for line in result.stdout.splitlines():
+        if line.startswith('p'):
+            pid = line[1:]
+        elif line.startswith('n') and pid:
+            # "n*:3000" や "n[::1]:3000" の形式
+            try:
+                owners.setdefault(int(line.rsplit(':', 1)[1]), pid)
+            except ValueError:
+                continue
+    return owners
 
-    if target_port is None:
-        # 管理画面へのWebSocket接続は拒否
-        await websocket.close(code=4000, reason="WebSocket not supported on admin interface")
-        return
+_process_table_cache = ({}, 0.0)  # (PID -> (親PID, プロセス名), 取得時刻)
 
-    await websocket.accept()
+def _process_table(required=()) -> Dict[str, tuple]:
+    """全プロセスの PID -> (親PID, プロセス名)（ps 1回）
 
-    # WebSocket接続先URL
-    target_url = f"ws://localhost:{target_port}/{path}"
+    required を渡した場合、CACHE_TTL 秒以内に取得した表にそのPIDがすべてあればpsを実行しない
+    （監視で1ポートずつ調べるときに、直前のスキャンの表を使い回す）。
+    """
+    global _process_table_cache
+    table, fetched_at = _process_table_cache
+    if required and time.time() - fetched_at < CACHE_TTL and all(pid in table for pid in required):
+        return table
+    result = run_command(['ps', '-axo', 'pid=,ppid=,comm='], timeout=2)
+    table = {}
+    for line in result.stdout.splitlines():
+        parts = line.split(None, 2)
+        if len(parts) == 3:
+            table[parts[0]] = (parts[1], os.path.basename(parts[2].strip()))
+    _process_table_cache = (table, time.time())
+    return table
+
+def _tree_root(pid: str, table: Dict[str, tuple]) -> str:
+    """親をたどり、シェルやlaunchdの直前のプロセスを根とする"""
+    root = pid
+    seen = set()
+    while root in table and root not in seen:
+        seen.add(root)
+        ppid = table[root][0]
+        if ppid in ('0', '1') or ppid not in table or table[ppid][1].lower() in TREE_BOUNDARIES:
+            break
+        root = ppid
+    return root
 
+def _describe_processes(ports: List[int]) -> Dict[int, ProcessInfo]:
+    """ポートごとのプロセス名、Web判定、起動元、PID、グループ（プロセスツリーの根のPID）"""
+    infos = {}
     try:
-        async with websockets.connect(target_url) as ws:
-            async def forward_to_client():
+        # 1ポートだけのとき（監視で見つけた新しいポート）はlsofもそのポートに絞る
+        single = ports[0] if len(ports) == 1 else None
+        owners = _listening_pids(single)
+        table = _process_table(owners.values() if single is not None else ())
+    except Exception:
+        return {port: _default_process_info() for port in ports}
+
+    # 終了したプロセスの起動元情報は捨てる
+    for key in [key for key in _origin_cache if key[0] not in table]:
+        _origin_cache.pop(key, None)
+
+    docker_ports = get_docker_ports()
+    by_pid = {}
+    for port in ports:
+        pid = owners.get(port)
+        container = docker_ports.get(port)
+        if container is not None:
+            # Dockerの公開ポートはプロセスではなくコンテナ（composeプロジェクト）ごとにまとめる
+            image = container["image"].rsplit('/', 1)[-1].split(':', 1)[0].lower()
+            infos[port] = ProcessInfo(
+                process=table[pid][1] if pid in table else "docker",
+                is_likely_web=image not in NON_WEB_IMAGES,
+                origin=docker_origin(container),
+                pid=int(pid) if pid else None,
+                group=f"docker:{container['project'] or container['name']}",
+            )
+            continue
+        if pid is None:
+            infos[port] = _default_process_info()
+            continue
+        if pid not in by_pid:
+            process = table[pid][1] if pid in table else "Unknown"
+            key = (pid, process)
+            origin = _origin_cache.get(key)
+            if origin is None:
+                origin = _origin_cache[key] = get_process_origin(pid)
+            is_non_web = any(nwp in process.lower() for nwp in NON_WEB_PROCESSES)
+            by_pid[pid] = ProcessInfo(process, not is_non_web, origin, int(pid), int(_tree_root(pid, table)))
+        infos[port] = by_pid[pid]
+    return infos
+
+async def get_process_info(port: int) -> ProcessInfo:
+    """プロセス名、Web判定、起動元情報を取得（lsof/psはスレッドプールで実行）
+
+    lsofはこのポートだけを調べ、psは直前のスキャンの表にPIDがあればそれを使い回す。
+    """
+    with PROCESS_INFO_DURATION.time():
+        infos = await run_blocking(_describe_processes, [port])
+    return infos[port]
+
+async def get_processes_info(ports: List[int]) -> Dict[int, ProcessInfo]:
+    """複数ポートのプロセス情報をまとめて取得"""
+    with PROCESS_INFO_DURATION.time():
+        return await run_blocking(_describe_processes, ports)
+
+def group_ports(ports: List[PortRecord]) -> List[dict]:
+    """ポートをプロセスツリーごとにまとめる（プロセスが分からないポートは単独）"""
+    groups = {}
+    for p in ports:
+        key = p.group or f"port:{p.port}"
+        group = groups.setdefault(key, {
+            "group": p.group,
+            "process": p.process,
+            "origin": p.origin,
+            "pids": [],
+            "ports": [],
+        })
+        group["ports"].append(p.port)
+        if p.pid is not None and p.pid not in group["pids"]:
+            group["pids"].append(p.pid)
+    return list(groups.values())
+
+# ---- プロトコルの判別 ----
+# Webサーバーかどうかをプロセス名ではなく、ポートが実際に返すバイト列で判定する。
+# HTTPと確認できたポートだけをタイトル取得とサムネイル撮影に回す
+
+SNIFF_TIMEOUT = float(os.environ.get("LOCALPORTAL_SNIFF_TIMEOUT", "0.3"))
+SNIFF_READ_SIZE = 512
+HTTP_PROBE = b"HEAD / HTTP/1.1\r\nHost: localhost:%d\r\nConnection: close\r\n\r\n"
+POSTGRES_SSL_REQUEST = b"\x00\x00\x00\x08\x04\xd2\x16\x2f"
+H2_PREFACE = b"PRI * HTTP/2.0\r\n\r\nSM\r\n\r\n" + b"\x00\x00\x00\x04\x00\x00\x00\x00\x00"  # 空のSETTINGSも送る
+
+def classify_response(data: bytes) -> str:
+    """サーバーが最初に返したバイト列からプロトコルを判定"""
+    if data.startswith(b"SSH-"):
+        return "ssh"
+    if data.startswith(b"HTTP/"):
+        # HTTPSのポートに平文で送ったときのエラー（Go、nginx）
+        if b"to an HTTPS server" in data or b"sent to HTTPS port" in data:
+            return "tls"
+        return "http"
+    if len(data) >= 2 and data[0] in (0x15, 0x16) and data[1] == 0x03:
+        return "tls"  # TLSのアラートかハンドシェイクのレコード
+    if len(data) >= 9 and data[3] in (0x04, 0x07) and data[5:9] == b"\x00\x00\x00\x00":
+        return "h2"  # ストリーム0のSETTINGSかGOAWAYのフレーム
+    if len(data) >= 5 and data[3] == 0 and data[4] in (0x0a, 0xff) and int.from_bytes(data[:3], "little") < 1024:
+        return "mysql"  # 最初のパケット（ハンドシェイクかエラー）
+    if data[:1] in (b"-", b"+") and b"\r\n" in data:
+        return "redis"
+    if data in (b"S", b"N"):
+        return "postgres"  # SSLRequestへの応答
+    return "unknown"
+
+async def _probe(address: str, port: int, payload: bytes) -> Optional[bytes]:
+    """payload を送って最初に返ってきたバイト列を返す（接続したまま応答がなければNone）"""
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(address, port), SNIFF_TIMEOUT)
+    except (OSError, asyncio.TimeoutError):
+        return b""
+    try:
+        writer.write(payload)
+        return await asyncio.wait_for(reader.read(SNIFF_READ_SIZE), SNIFF_TIMEOUT)
+    except asyncio.TimeoutError:
+        return None
+    except OSError:
+        return b""
+    finally:
+        writer.close()
+
+async def sniff_protocol(address: str, port: int) -> Optional[str]:
+    """ポートのプロトコルを判定（応答がなく判定できなければNone）
+
+    まずHTTPのリクエストを送る（SSHやMySQLはこちらが送る前にバナーを返すので、それで分かる）。
+    何も返さずに切断されたときだけ、PostgreSQLのSSLRequest、HTTP/2のプリフェースの順に試す。
+    """
+    for payload in (HTTP_PROBE % port, POSTGRES_SSL_REQUEST, H2_PREFACE):
+        data = await _probe(address, port, payload)
+        if data is None:
+            # 起動直後でコンパイル中の開発サーバーなども応答が遅いので、決めつけない
+            return None
+        if data:
+            return classify_response(data)
+    return None
+
+_protocol_cache: Dict[int, tuple] = {}  # port -> (PID, プロトコル)
+
+async def sniff_port(p: PortRecord) -> Optional[str]:
+    """ポートのプロトコルを判定（同じプロセスが開いている間は判定結果を使い回す）"""
+    cached = _protocol_cache.get(p.port)
+    if cached is not None and cached[0] == p.pid:
+        return cached[1]
+    protocol = await sniff_protocol(p.address, p.port)
+    if protocol is not None:
+        _protocol_cache[p.port] = (p.pid, protocol)
+    return protocol
+
+def forget_protocol(port: int):
+    _protocol_cache.pop(port, None)
+
+def is_web_port(p: PortRecord, info: ProcessInfo) -> bool:
+    """HTTPと確認できたポートか（判別できなかったときはプロセス名から推測）"""
+    if p.protocol is not None:
+        return p.protocol == "http"
+    return info.is_likely_web
+
+async def fetch_page(port: int) -> tuple:
+    """ページのタイトルと本文のハッシュを取得（取得できなければ (None, None)）"""
+    try:
+        from bs4 import BeautifulSoup
+
+        async with httpx.AsyncClient(timeout=0.5) as client:
+            url = f"http://{await upstream_host(port)}:{port}"
+            start = time.perf_counter()
+            async with client.stream("GET", url, headers={"Host": f"localhost:{port}"}) as response:
+                responsiveness.record_http(port, (time.perf_counter() - start) * 1000, response.status_code)
+                await response.aread()
+            digest = hashlib.sha256(response.content).digest()
+            soup = BeautifulSoup(response.text, 'html.parser')
+            title = soup.find('title')
+            return (title.string.strip() if title and title.string else None), digest
+    except:
+        return None, None
+
+async def get_page_title(port: int) -> Optional[str]:
+    """ページのタイトルを取得（取得できなければNone）"""
+    return (await fetch_page(port))[0]
+
+# ---- サムネイル撮影ワーカー ----
+# Chromiumの操作とPNGのエンコードは別プロセス（thumbnail_worker.py）で行い、
+# プロキシを処理するイベントループとCPU・メモリを取り合わないようにする。
+# ワーカーは優先度を下げて起動し、Chromiumを含むメモリ使用量が上限を超えたり
+# 終了したりしたら起動し直す
+
+THUMBNAIL_WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "thumbnail_worker.py")
+THUMBNAIL_WORKER_NICE = int(os.environ.get("LOCALPORTAL_THUMBNAIL_NICE", "10"))
+THUMBNAIL_WORKER_MEMORY_MB = int(os.environ.get("LOCALPORTAL_THUMBNAIL_MEMORY_MB", "1024"))
+THUMBNAIL_WORKER_RESTART_DELAY = 1.0
+THUMBNAIL_WORKER_MAX_LINE = 64 * 1024 * 1024  # 撮影結果（PNGのbase64）は1行で届く
+THUMBNAIL_CAPTURE_TIMEOUT = 30.0
+
+def _process_group_rss(pgid: int) -> Optional[int]:
+    """プロセスグループのRSSの合計（バイト）。psが使えなければNone"""
+    try:
+        result = run_command(["ps", "-A", "-o", "pgid=,rss="], timeout=5)
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    total = 0
+    for line in result.stdout.splitlines():
+        fields = line.split()
+        if len(fields) == 2 and fields[0] == str(pgid):
+            total += int(fields[1])
+    return total * 1024
+
+def _kill_process_group(process):
+    # ワーカーは新しいセッションで起動しているので、残ったChromiumもまとめて止める
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+class ThumbnailWorker:
+    """thumbnail_worker.py を子プロセスとして起動し、撮影を依頼する
+
+    標準入出力をパイプにして1行1件のJSONでやり取りする。
+    ワーカーが終了していれば次の依頼のときに起動し直す。
+    """
+
+    def __init__(self, nice: int = THUMBNAIL_WORKER_NICE, memory_limit_mb: int = THUMBNAIL_WORKER_MEMORY_MB):
+        self._nice = nice
+        self._memory_limit = memory_limit_mb * 1024 * 1024
+        self._process = None
+        self._pending = {}  # id -> 応答を待つFuture（起動中のワーカーの分）
+        self._ids = itertools.count(1)
+        self._lock = None
+        self._exited_at = None  # 直前のワーカーが落ちた時刻
+
+    async def _ensure_started(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if self._process is not None:
+                return
+            if self._exited_at is not None:
+                # 落ちてすぐに起動し直し続けないよう少し待つ
+                delay = THUMBNAIL_WORKER_RESTART_DELAY - (time.monotonic() - self._exited_at)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            self._process = await asyncio.create_subprocess_exec(
+                sys.executable, THUMBNAIL_WORKER_SCRIPT, "--nice", str(self._nice),
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                limit=THUMBNAIL_WORKER_MAX_LINE,
+                start_new_session=True,
+            )
+            self._pending = {}
+            asyncio.ensure_future(self._read_replies(self._process, self._pending))
+
+    async def _read_replies(self, process, pending: dict):
+        try:
+            while True:
+                line = await process.stdout.readline()
+                if not line:
+                    break
+                reply = json.loads(line)
+                future = pending.pop(reply["id"], None)
+                if future is not None and not future.done():
+                    future.set_result(reply)
+        except ValueError as e:
+            logger.warning("thumbnail worker sent an invalid reply: %s", e)
+        finally:
+            if process is self._process:
+                # 止めていないのに終了した
+                logger.warning("thumbnail worker exited, restarting on next capture")
+                THUMBNAIL_WORKER_RESTARTS_TOTAL.inc("exit")
+                self._process = None
+                self._exited_at = time.monotonic()
+                _kill_process_group(process)
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("thumbnail worker exited"))
+            pending.clear()
+
+    def _send(self, process, message: dict):
+        if process.returncode is None:
+            process.stdin.write(dumps(message) + b"\n")
+
+    async def _request(self, message: dict) -> dict:
+        await self._ensure_started()
+        process, pending = self._process, self._pending
+        job_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        pending[job_id] = future
+        self._send(process, dict(message, id=job_id))
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), THUMBNAIL_CAPTURE_TIMEOUT)
+        except asyncio.CancelledError:
+            # 撮影が取り消されたらワーカー側の撮影も止める
+            pending.pop(job_id, None)
+            self._send(process, {"id": next(self._ids), "op": "cancel", "target": job_id})
+            raise
+        except asyncio.TimeoutError:
+            # 応答しないワーカーは止めて、次の依頼で起動し直す
+            pending.pop(job_id, None)
+            THUMBNAIL_WORKER_RESTARTS_TOTAL.inc("timeout")
+            await self._stop(process)
+            raise
+
+    @staticmethod
+    def _observe_launch(reply: dict):
+        if reply.get("launch_s") is not None:
+            BROWSER_LAUNCH_DURATION.observe(reply["launch_s"])
+
+    async def warm_up(self):
+        """ワーカーを起動してChromiumも立ち上げておく"""
+        reply = await self._request({"op": "warmup"})
+        self._observe_launch(reply)
+        if "error" in reply:
+            raise RuntimeError(reply["error"])
+
+    async def capture(self, port: int) -> Optional[str]:
+        """ページのスクリーンショットを撮影してbase64で返す（失敗したらNone）"""
+        with THUMBNAIL_CAPTURE_DURATION.time():
+            reply = await self._request({"op": "capture", "port": port})
+        self._observe_launch(reply)
+        await self._check_memory()
+        return reply.get("thumbnail")
+
+    async def _check_memory(self):
+        process = self._process
+        if process is None or not self._memory_limit:
+            return
+        rss = await run_blocking(_process_group_rss, process.pid)
+        if rss is None:
+            return
+        THUMBNAIL_WORKER_MEMORY.set(rss)
+        if rss > self._memory_limit:
+            logger.warning("thumbnail worker uses %d MB (limit %d MB), restarting",
+                           rss // (1024 * 1024), self._memory_limit // (1024 * 1024))
+            THUMBNAIL_WORKER_RESTARTS_TOTAL.inc("memory")
+            await self._stop(process)
+
+    async def _stop(self, process):
+        if self._process is process:
+            self._process = None
+        if process.returncode is None:
+            # 標準入力を閉じるとワーカーはChromiumを閉じて終了する
+            process.stdin.close()
+            try:
+                await asyncio.wait_for(process.wait(), 5)
+            except asyncio.TimeoutError:
+                pass
+        _kill_process_group(process)
+
+    async def close(self):
+        if self._process is not None:
+            await self._stop(self._process)
+
+screenshot_worker = ThumbnailWorker()
+
+# ---- 状態の保存 ----
+# 最後に確認したポートの一覧とサムネイルをSQLiteに保存し、
+# 再起動直後でもスキャンやChromiumの撮影を待たずにダッシュボードを表示できるようにする
+
+STATE_PATH = os.environ.get("LOCALPORTAL_STATE_PATH", "localportal.db")
+
+class StateStore:
+    """ポートのスナップショットとサムネイルの保存先（SQLite）
+
+    書き込みは1スレッドの専用プールで順番に実行するので、イベントループは止まらない。
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS ports (
+            port INTEGER PRIMARY KEY,
+            record TEXT NOT NULL,
+            updated_at REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS thumbnails (
+            port INTEGER PRIMARY KEY,
+            image BLOB NOT NULL,
+            captured_at REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS learned_ports (
+            port INTEGER PRIMARY KEY,
+            last_seen REAL NOT NULL
+        );
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = None
+        self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="state")
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(self.SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def _load(self) -> tuple:
+        conn = self._connect()
+        records = {port: PortRecord.from_dict(json.loads(record))
+                   for port, record in conn.execute("SELECT port, record FROM ports")}
+        thumbnails = {
+            port: (base64.b64encode(image).decode('utf-8'), captured_at)
+            for port, image, captured_at in conn.execute("SELECT port, image, captured_at FROM thumbnails")
+        }
+        learned = dict(conn.execute("SELECT port, last_seen FROM learned_ports"))
+        return records, thumbnails, learned
+
+    def _replace_ports(self, records: List[PortRecord]):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("DELETE FROM ports")
+            conn.executemany(
+                "INSERT INTO ports (port, record, updated_at) VALUES (?, ?, ?)",
+                [(r.port, r.encode_fields().decode(), now) for r in records],
+            )
+            conn.execute("DELETE FROM thumbnails WHERE port NOT IN (SELECT port FROM ports)")
+
+    def _save_port(self, record: PortRecord):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO ports (port, record, updated_at) VALUES (?, ?, ?)",
+                (record.port, record.encode_fields().decode(), time.time()),
+            )
+
+    def _delete_port(self, port: int):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM ports WHERE port = ?", (port,))
+            conn.execute("DELETE FROM thumbnails WHERE port = ?", (port,))
+
+    def _replace_learned(self, learned: Dict[int, float]):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM learned_ports")
+            conn.executemany("INSERT INTO learned_ports (port, last_seen) VALUES (?, ?)", learned.items())
+
+    def _save_thumbnail(self, port: int, thumbnail: str, captured_at: float):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO thumbnails (port, image, captured_at) VALUES (?, ?, ?)",
+                (port, base64.b64decode(thumbnail), captured_at),
+            )
+
+    async def _call(self, func, *args):
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self._pool, functools.partial(func, *args))
+        except Exception as e:
+            logger.warning("state store error: %s", e)
+            return None
+
+    async def load(self) -> tuple:
+        return await self._call(self._load) or ({}, {}, {})
+
+    def submit(self, func, *args) -> asyncio.Future:
+        """書き込みを投げて完了を待たない（待つ場合は返したFutureを使う）"""
+        return asyncio.ensure_future(self._call(func, *args))
+
+    def replace_ports(self, records: List[PortRecord]):
+        self.submit(self._replace_ports, records)
+
+    def save_port(self, record: PortRecord):
+        self.submit(self._save_port, record)
+
+    def delete_port(self, port: int):
+        self.submit(self._delete_port, port)
+
+    def save_thumbnail(self, port: int, thumbnail: str, captured_at: float):
+        self.submit(self._save_thumbnail, port, thumbnail, captured_at)
+
+    def save_learned(self, learned: Dict[int, float]) -> asyncio.Future:
+        return self.submit(self._replace_learned, learned)
+
+# マルチワーカー構成のワーカーはスキャナーに任せるので保存しない
+state_store = StateStore(STATE_PATH) if STATE_PATH and not SCANNER_SOCKET else None
+
+# ---- 変更ログ ----
+# スナップショットの変更ごとにバージョンを進め、直近の変更を記録しておく。
+# SSEの再接続（Last-Event-ID）ではその後の変更だけを送り直し、スキャンし直さない。
+
+CHANGE_LOG_SIZE = 1000
+
+class ChangeLog:
+    """スナップショットの変更履歴（古いものから捨てる）
+
+    イベントIDは "エポック-バージョン" の形式。エポックは起動ごとに変わるので、
+    再起動前のIDで再接続された場合は履歴が分からないものとして扱う。
+    """
+
+    def __init__(self, size: int = CHANGE_LOG_SIZE):
+        self.epoch = os.urandom(4).hex()
+        self.version = 0
+        self._entries = collections.deque(maxlen=size)  # (version, port, レコード or None=削除)
+
+    def event_id(self, version: Optional[int] = None) -> str:
+        return f"{self.epoch}-{self.version if version is None else version}"
+
+    def parse_event_id(self, event_id: Optional[str]) -> Optional[int]:
+        """このプロセスが発行したIDならバージョンを返す"""
+        if not event_id:
+            return None
+        epoch, _, version = event_id.partition('-')
+        if epoch != self.epoch or not version.isdigit() or int(version) > self.version:
+            return None
+        return int(version)
+
+    def record(self, port: int, record: Optional[PortRecord]) -> int:
+        self.version += 1
+        self._entries.append((self.version, port, record))
+        return self.version
+
+    def since(self, version: int) -> Optional[List[tuple]]:
+        """version より後の変更（ポートごとに最新のものだけ、古い順）
+
+        履歴が既に捨てられていて分からない場合はNone。
+        """
+        if version < self.version and (not self._entries or self._entries[0][0] > version + 1):
+            return None
+        latest = {}
+        for entry in self._entries:
+            if entry[0] > version:
+                latest[entry[1]] = entry
+        return sorted(latest.values(), key=lambda entry: entry[0])
+
+change_log = ChangeLog()
+
+# 最後に確認したポートの一覧（port -> サムネイルを除いたレコード）
+port_snapshot: Dict[int, PortRecord] = {}
+_snapshot_version = 0  # ポートの内容が変わるたびに増える（サムネイルだけの変更では増えない）
+_persisted_version = 0
+_stale_ports = set()  # サムネイルが古いことを変更ログに記録済みのポート
+snapshot_refreshed_at = 0.0  # 最後にスキャンしてスナップショットを更新した時刻
+
+def _snapshot_record(p: PortRecord) -> PortRecord:
+    record = p.copy()
+    record.thumbnail = None
+    record.thumbnail_stale = False
+    # エンコード結果も引き継がれるので、次の更新で内容が同じなら使い回せる
+    record.encode_fields()
+    return record
+
+def apply_snapshot(p: PortRecord) -> bool:
+    """スナップショットに反映し、変わっていれば変更ログに記録する（保存はしない）"""
+    previous = port_snapshot.get(p.port)
+    if previous is not None and previous.same_as(p):
+        return False
+    global _snapshot_version
+    record = port_snapshot[p.port] = _snapshot_record(p)
+    _snapshot_version += 1
+    change_log.record(p.port, record)
+    _note_thumbnail(p.port)
+    return True
+
+def remember_ports(ports: List[PortRecord]):
+    """フルスキャンの結果でスナップショットを置き換える"""
+    global _persisted_version, _snapshot_version, snapshot_refreshed_at
+    snapshot_refreshed_at = time.time()
+    found = {p.port for p in ports}
+    for port in [port for port in port_snapshot if port not in found]:
+        del port_snapshot[port]
+        _snapshot_version += 1
+        _stale_ports.discard(port)
+        change_log.record(port, None)
+        responsiveness.forget(port)
+        forget_protocol(port)
+    for p in ports:
+        apply_snapshot(p)
+    # 変更がなければ書き込まない
+    if state_store is not None and _persisted_version != _snapshot_version:
+        state_store.replace_ports(list(port_snapshot.values()))
+    _persisted_version = _snapshot_version
+
+def remember_port(p: PortRecord):
+    if apply_snapshot(p) and state_store is not None:
+        state_store.save_port(port_snapshot[p.port])
+
+def forget_port(port: int):
+    global _snapshot_version
+    responsiveness.forget(port)
+    forget_protocol(port)
+    _stale_ports.discard(port)
+    if port_snapshot.pop(port, None) is not None:
+        _snapshot_version += 1
+        change_log.record(port, None)
+        if state_store is not None:
+            state_store.delete_port(port)
+
+# サムネイルはスナップショットのレコードに含めず、返すときに付ける（with_cached_thumbnail）。
+# 撮影し直したときと古くなったときも変更ログに記録し、?since= やSSEの再接続でも届くようにする
+
+def _thumbnail_stale(port: int) -> bool:
+    record = port_snapshot.get(port)
+    return record is not None and bool(record.title) and screenshot_scheduler.cached(port)[1]
+
+def _note_thumbnail(port: int):
+    """変更ログに記録したときのサムネイルの古さを覚えておく"""
+    if _thumbnail_stale(port):
+        _stale_ports.add(port)
+    else:
+        _stale_ports.discard(port)
+
+def record_stale_thumbnails():
+    """前回の記録から古くなったサムネイルを変更ログに記録する（時間がたつだけで変わるため）"""
+    for port, record in port_snapshot.items():
+        if port not in _stale_ports and _thumbnail_stale(port):
+            _stale_ports.add(port)
+            change_log.record(port, record)
+
+def _save_thumbnail(port: int, thumbnail: str, captured_at: float):
+    record = port_snapshot.get(port)
+    if record is not None:
+        change_log.record(port, record)
+        _note_thumbnail(port)
+    if state_store is not None:
+        state_store.save_thumbnail(port, thumbnail, captured_at)
+
+def with_cached_thumbnail(record: PortRecord) -> PortRecord:
+    """スナップショットのレコードにキャッシュ済みサムネイルを付ける"""
+    p = record.copy()
+    p.thumbnail, stale = screenshot_scheduler.cached(p.port)
+    p.thumbnail_stale = bool(p.title) and stale
+    return p
+
+def cached_ports() -> List[PortRecord]:
+    """スナップショットにキャッシュ済みサムネイルを付けて返す"""
+    return [with_cached_thumbnail(port_snapshot[port]) for port in sorted(port_snapshot)]
+
+# サムネイル撮影の優先度（小さいほど先に撮影）
+PRIORITY_NEW = 0      # 新しく検出されたポート
+PRIORITY_VISIBLE = 1  # 画面に表示されているカード
+PRIORITY_STALE = 2    # キャッシュが古くなったポート
+THUMBNAIL_TTL = 60
+
+class _ScreenshotJob:
+    __slots__ = ("priority", "future", "waiters", "background")
+
+    def __init__(self, priority: int, future: asyncio.Future):
+        self.priority = priority
+        self.future = future
+        self.waiters = 0         # request() で完了を待っている数
+        self.background = False  # submit() で投入された（待つ人がいなくても撮る）
+
+class ScreenshotScheduler:
+    """サムネイル撮影ジョブのスケジューラ
+
+    優先度順に1件ずつ撮影する。同じポートのジョブは1つにまとめ、
+    より高い優先度で再投入された場合は優先度だけ引き上げる。
+    """
+
+    def __init__(self, capture, ttl: float = THUMBNAIL_TTL, on_capture=None):
+        self._capture = capture
+        self._ttl = ttl
+        self._on_capture = on_capture  # 撮影完了時に (port, thumbnail, 撮影時刻) で呼ぶ
+        self._heap = []      # (priority, seq, port)
+        self._jobs = {}      # port -> _ScreenshotJob（待機中）
+        self._running = {}   # port -> (task, _ScreenshotJob)（撮影中）
+        self._cache = {}     # port -> (thumbnail, 撮影時刻)
+        self._seq = itertools.count()
+        self._wakeup = None
+        self._worker = None
+
+    def cached(self, port: int) -> tuple:
+        """キャッシュ済みサムネイルと、それが古いかどうかを返す"""
+        entry = self._cache.get(port)
+        if entry is None:
+            return None, True
+        thumbnail, captured_at = entry
+        return thumbnail, time.time() - captured_at >= self._ttl
+
+    def preload(self, port: int, thumbnail: str, captured_at: float):
+        """保存済みのサムネイルをキャッシュに入れる（撮影時刻で古さを判定）"""
+        if port not in self._cache:
+            self._cache[port] = (thumbnail, captured_at)
+
+    def submit(self, port: int, priority: int) -> asyncio.Future:
+        """撮影ジョブを投入し、結果のFutureを返す"""
+        job = self._enqueue(port, priority)
+        job.background = True
+        return job.future
+
+    def _enqueue(self, port: int, priority: int) -> _ScreenshotJob:
+        if port in self._running:
+            return self._running[port][1]
+
+        job = self._jobs.get(port)
+        if job is not None:
+            if priority < job.priority:
+                job.priority = priority
+                heapq.heappush(self._heap, (priority, next(self._seq), port))
+            return job
+
+        loop = asyncio.get_running_loop()
+        job = _ScreenshotJob(priority, loop.create_future())
+        self._jobs[port] = job
+        heapq.heappush(self._heap, (priority, next(self._seq), port))
+
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        self._wakeup.set()
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.ensure_future(self._run())
+        return job
+
+    async def request(self, port: int, priority: int) -> Optional[str]:
+        """撮影を依頼して完了を待つ（キャンセルされた場合はNone）"""
+        job = self._enqueue(port, priority)
+        job.waiters += 1
+        try:
+            return await asyncio.shield(job.future)
+        except asyncio.CancelledError:
+            if job.future.cancelled():
+                return None
+            job.waiters -= 1
+            # 待っている側が全員切断したら撮影も取り消す（submit() された撮り直しは残す）
+            if job.waiters == 0 and not job.background:
+                self._abandon(port, job)
+            raise
+
+    def _abandon(self, port: int, job: _ScreenshotJob):
+        if self._jobs.get(port) is job:
+            del self._jobs[port]
+            job.future.cancel()
+        running = self._running.get(port)
+        if running is not None and running[1] is job:
+            running[0].cancel()
+
+    def cancel(self, port: int):
+        """ポートの待機中・撮影中ジョブを取り消し、キャッシュも破棄"""
+        job = self._jobs.pop(port, None)
+        if job is not None and not job.future.done():
+            job.future.cancel()
+        running = self._running.get(port)
+        if running is not None:
+            running[0].cancel()
+        self._cache.pop(port, None)
+
+    def retain(self, ports):
+        """消えたポートのジョブとキャッシュを破棄"""
+        ports = set(ports)
+        for port in (set(self._jobs) | set(self._running) | set(self._cache)) - ports:
+            self.cancel(port)
+
+    async def _next_port(self) -> int:
+        while True:
+            while self._heap:
+                priority, _, port = heapq.heappop(self._heap)
+                job = self._jobs.get(port)
+                # 優先度が引き上げられた古いエントリや取り消し済みジョブは読み飛ばす
+                if job is not None and job.priority == priority:
+                    return port
+            self._wakeup.clear()
+            await self._wakeup.wait()
+
+    async def _run(self):
+        while True:
+            port = await self._next_port()
+            job = self._jobs.pop(port)
+            task = asyncio.ensure_future(self._capture(port))
+            self._running[port] = (task, job)
+            try:
+                await asyncio.wait({task})
+            finally:
+                self._running.pop(port, None)
+
+            if task.cancelled():
+                if not job.future.done():
+                    job.future.cancel()
+                continue
+
+            thumbnail = None if task.exception() else task.result()
+            if thumbnail:
+                captured_at = time.time()
+                self._cache[port] = (thumbnail, captured_at)
+                if self._on_capture is not None:
+                    self._on_capture(port, thumbnail, captured_at)
+            if not job.future.done():
+                job.future.set_result(thumbnail)
+
+    async def close(self):
+        for port in list(self._jobs) + list(self._running):
+            self.cancel(port)
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
+
+screenshot_scheduler = ScreenshotScheduler(screenshot_worker.capture, on_capture=_save_thumbnail)
+
+async def shutdown_screenshots():
+    await screenshot_scheduler.close()
+    await screenshot_worker.close()
+
+# 起動の経過時間（モジュールの読み込み開始からのミリ秒）
+startup_timeline = {"import_ms": None, "ready_ms": None, "browser_ready_ms": None}
+
+BROWSER_WARMUP = os.environ.get("LOCALPORTAL_BROWSER_WARMUP", "1") != "0"
+BROWSER_WARMUP_DELAY = 1.0
+
+def _elapsed_ms() -> float:
+    return round((time.perf_counter() - _IMPORT_STARTED) * 1000, 1)
+
+async def schedule_browser_warmup():
+    startup_timeline["ready_ms"] = _elapsed_ms()
+    # マルチワーカー構成のワーカーは撮影しない
+    if BROWSER_WARMUP and not SCANNER_SOCKET:
+        asyncio.ensure_future(warm_up_browser())
+
+async def warm_up_browser():
+    """接続の受け付けを始めてから、サムネイル撮影の準備をしておく"""
+    await asyncio.sleep(BROWSER_WARMUP_DELAY)
+    try:
+        # bs4のimportもそれなりに重いので、イベントループを止めないようスレッドで行う
+        await run_blocking(importlib.import_module, "bs4")
+        await screenshot_worker.warm_up()
+        startup_timeline["browser_ready_ms"] = _elapsed_ms()
+    except Exception as e:
+        logger.warning("browser warm-up failed: %s", e)
+
+async def get_page_info(port: int, priority: int = PRIORITY_NEW, title: Optional[str] = None) -> tuple:
+    """タイトルとサムネイルを取得（サムネイルは新しいキャッシュがあればそれを使う）"""
+    with PAGE_INFO_DURATION.time():
+        title_text = title or await get_page_title(port)
+        if not title_text:
+            return None, None
+
+        thumbnail, stale = screenshot_scheduler.cached(port)
+        if stale:
+            thumbnail = await screenshot_scheduler.request(port, priority) or thumbnail
+        return title_text, thumbnail
+
+@app.get("/api/health")
+async def health_check():
+    return {"status": "ok"}
+
+@app.get("/api/startup")
+async def get_startup_timeline():
+    """起動にかかった時間（読み込み完了・受付開始・Chromium準備完了）"""
+    return startup_timeline
+
+@app.get("/api/metrics")
+async def get_metrics():
+    """Prometheusテキスト形式のメトリクス
+
+    マルチワーカー構成では、スキャン・撮影などはスキャナーの値に、プロキシの値は
+    このリクエストを処理したワーカーのものにする。
+    """
+    text = render_metrics()
+    if SCANNER_SOCKET:
+        try:
+            response = await get_scanner_client().get("/api/metrics")
+            response.raise_for_status()
+            text = drop_metrics(response.text, WORKER_METRIC_PREFIXES) + render_metrics(WORKER_METRIC_PREFIXES)
+        except Exception as e:
+            logger.warning("failed to fetch scanner metrics: %s", e)
+    return Response(text, media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/api/traces")
+async def get_traces(limit: int = 50):
+    """サンプリングしたプロキシリクエストのトレース（新しい順）"""
+    traces = list(_traces)[-limit:] if limit > 0 else []
+    return {
+        "config": trace_config,
+        "traces": [t.to_dict() for t in reversed(traces)],
+    }
+
+@app.post("/api/traces/config")
+async def update_trace_config(sample_rate: Optional[float] = None, slow_ms: Optional[float] = None):
+    """トレースのサンプリング率とスローログ閾値を変更"""
+    if sample_rate is not None:
+        trace_config["sample_rate"] = min(max(sample_rate, 0.0), 1.0)
+    if slow_ms is not None:
+        trace_config["slow_ms"] = max(slow_ms, 0.0)
+    return trace_config
+
+@app.get("/api/hostname")
+async def get_hostname():
+    """ホスト名とDNS設定情報を返す"""
+    hostname = socket.gethostname()
+    return {
+        "hostname": hostname,
+        "setup_command": f"sudo mkdir -p /etc/resolver && echo 'nameserver 127.0.0.1' | sudo tee /etc/resolver/{hostname.split('.')[-1] if '.' in hostname else 'local'}"
+    }
+
+@app.websocket("/{path:path}")
+async def websocket_proxy(websocket: WebSocket, path: str = ""):
+    """WebSocketリバースプロキシ"""
+    host = websocket.headers.get("host", "")
+    target_port = extract_port_from_host(host)
+
+    if target_port is None:
+        # 管理画面へのWebSocket接続は拒否
+        await websocket.close(code=4000, reason="WebSocket not supported on admin interface")
+        return
+
+    await websocket.accept()
+
+    # WebSocket接続先URL
+    target_url = f"ws://{await upstream_host(target_port)}:{target_port}/{path}"
+
+    WEBSOCKET_RELAYS_ACTIVE.inc(str(target_port))
+    try:
+        import websockets
+
+        async with websockets.connect(target_url) as ws:
+            async def forward_to_client():
                 try:
                     async for message in ws:
                         if isinstance(message, bytes):
@@ -315,35 +2317,231 @@ async def websocket_proxy(websocket: WebSocket, path: str = ""):
                 try:
                     while True:
                         data = await websocket.receive()
-                        if "text" in data:
+                        if data["type"] == "websocket.disconnect":
+                            break
+                        if data.get("text") is not None:
                             await ws.send(data["text"])
-                        elif "bytes" in data:
+                        elif data.get("bytes") is not None:
                             await ws.send(data["bytes"])
                 except WebSocketDisconnect:
                     pass
                 except Exception:
                     pass
 
-            await asyncio.gather(forward_to_client(), forward_to_server(), return_exceptions=True)
+            # どちらかの向きが終わったらもう一方も止め、両側の接続を閉じる
+            # （gatherで両方を待つと、ブラウザが切断しても上流からの受信を待ち続ける）
+            tasks = [asyncio.ensure_future(forward_to_client()), asyncio.ensure_future(forward_to_server())]
+            try:
+                await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                await ws.close()
+        try:
+            await websocket.close()
+        except Exception:
+            pass
     except Exception as e:
         try:
             await websocket.close(code=1011, reason=str(e)[:123])
         except Exception:
             pass
+    finally:
+        WEBSOCKET_RELAYS_ACTIVE.dec(str(target_port))
 
-@app.get("/api/ports")
-async def get_ports():
-    ports = await scan_ports()
-    ports = [p for p in ports if p["port"] != 8888]
+async def enrich_port(p: PortRecord, is_new: bool = True, info: Optional[ProcessInfo] = None,
+                      siblings: Optional[dict] = None) -> PortRecord:
+    """ポートのレコードにプロセス情報・タイトル・サムネイルを追加
+
+    siblings を渡すと、同じプロセスが同じ内容のページを返すポート（同じサーバーを
+    複数のポートで公開している場合）は先に処理したポートのサムネイルを共有し、撮影しない。
+    タイトルやプロセスツリーが同じだけでは別のアプリのことがある（雛形のままのタイトルや
+    dockerd の下の docker-proxy など）ので共有しない。
+    """
+    sniff = info is None
+    if info is None:
+        info = await get_process_info(p.port)
+    p.set_process(info)
+    if sniff:
+        # まとめて処理するときは enrich_ports が全ポートを並行に判別しておく
+        p.protocol = await sniff_port(p)
+    p.thumbnail_stale = False
+    if not is_web_port(p, info):
+        p.title, p.thumbnail = None, None
+        return p
+
+    p.title, digest = await fetch_page(p.port)
+    key = (info.pid, digest)
+    if siblings is not None and p.title and info.pid is not None:
+        primary = siblings.get(key)
+        if primary is not None:
+            p.thumbnail = primary.thumbnail
+            p.thumbnail_stale = primary.thumbnail_stale
+            p.thumbnail_of = primary.port
+            return p
+        siblings[key] = p
+
+    if not p.title:
+        p.thumbnail = None
+    elif is_new:
+        # 新規ポートは撮影完了を待つ
+        p.title, p.thumbnail = await get_page_info(p.port, PRIORITY_NEW, p.title)
+    else:
+        # 既存ポートはキャッシュを返し、古ければ低優先度で撮り直す
+        # （表示中のカードはフロントエンドが /api/ports/{port}/thumbnail で優先度を上げる）
+        p.thumbnail, stale = screenshot_scheduler.cached(p.port)
+        if stale:
+            p.thumbnail_stale = True
+            screenshot_scheduler.submit(p.port, PRIORITY_STALE)
+    return p
+
+async def enrich_ports(ports: List[PortRecord], known_ports: Optional[set] = None):
+    """ポートをまとめて情報付けし、1件ずつ返す（lsof/psは1回、同じサーバーの撮影は1回）"""
+    infos = await get_processes_info([p.port for p in ports])
+    # プロトコルの判別は全ポート並行に行う
     for p in ports:
-        info = get_process_info(p["port"])
-        p["process"] = info["process"]
-        p["origin"] = info["origin"]
-        if info["is_likely_web"]:
-            p["title"], p["thumbnail"] = await get_page_info(p["port"])
+        p.set_process(infos[p.port])
+    protocols = await asyncio.gather(*(sniff_port(p) for p in ports))
+    for p, protocol in zip(ports, protocols):
+        p.protocol = protocol
+    siblings = {}
+    for p in ports:
+        is_new = known_ports is None or p.port not in known_ports
+        await enrich_port(p, is_new, infos[p.port], siblings)
+        # 前回から変わっていなければエンコード結果を使い回す
+        previous = port_snapshot.get(p.port)
+        if previous is not None:
+            p.adopt_encoding(previous)
+        yield p
+
+async def restore_state():
+    """保存済みの状態を読み込み、裏で最新の状態に更新する"""
+    if state_store is None:
+        return
+    records, thumbnails, learned = await state_store.load()
+    port_snapshot.update(records)
+    scan_plan.learned.update(learned)
+    for port, (thumbnail, captured_at) in thumbnails.items():
+        screenshot_scheduler.preload(port, thumbnail, captured_at)
+    if records:
+        asyncio.ensure_future(revalidate_snapshot())
+
+async def revalidate_snapshot():
+    await refresh_snapshot(full=True)
+
+# ---- /api/ports（バージョン付きスナップショット） ----
+# ポーリングするスクリプトやメニューバーのウィジェットのために、スナップショットをスキャンせずに返し
+# （古ければ裏でスキャンし直す）、ETagが同じなら304だけを返す
+
+SNAPSHOT_MAX_AGE = float(os.environ.get("LOCALPORTAL_SNAPSHOT_MAX_AGE", "5"))
+
+_refresh_task = None
+_ports_body = (None, b"")  # (ETag, レスポンスボディ)
+
+async def _rescan(full: bool):
+    ports = await scan_plan.scan(full)
+    screenshot_scheduler.retain(p.port for p in ports)
+    # スナップショットにあるポートは撮影を待たない
+    async for _ in enrich_ports(ports, set(port_snapshot)):
+        pass
+    remember_ports(ports)
+
+async def refresh_snapshot(full: bool = False):
+    """スキャンしてスナップショットを更新（同時に呼ばれた場合は実行中のものを待つ）"""
+    global _refresh_task
+    if _refresh_task is not None and not _refresh_task.done():
+        await asyncio.shield(_refresh_task)
+        if not full:
+            return
+    if _refresh_task is None or _refresh_task.done():
+        _refresh_task = asyncio.ensure_future(_rescan(full))
+    await asyncio.shield(_refresh_task)
+
+def snapshot_etag() -> str:
+    # サムネイルの撮影と古くなったことも変更ログに入るので、version がそのままETagになる
+    record_stale_thumbnails()
+    return f'"{change_log.event_id()}"'
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    return any(tag.strip() in (etag, '*') for tag in if_none_match.split(','))
+
+def encode_changes(changes: List[tuple]) -> bytes:
+    parts = []
+    for _, port, record in changes:
+        if record is None:
+            parts.append(b'{"port":%d,"removed":true}' % port)
         else:
-            p["title"], p["thumbnail"] = None, None
-    return {"ports": ports}
+            parts.append(with_cached_thumbnail(record).encode())
+    return b'[' + b','.join(parts) + b']'
+
+@app.get("/api/ports")
+async def get_ports(request: Request, full: bool = False, since: Optional[str] = None):
+    """ポートの一覧
+
+    現在のスナップショットをすぐに返し、SNAPSHOT_MAX_AGE 秒より古ければ裏でスキャンし直す
+    （まだ一度もスキャンしていない場合と full を指定した場合だけはスキャンを待つ）。
+    If-None-Match がETagと一致すれば304、since に以前の version を渡すとその後の変更だけを返す
+    （履歴が分からない場合は "full": true で全件）。
+    """
+    global _ports_body
+    if full or (not snapshot_refreshed_at and not port_snapshot):
+        await refresh_snapshot(full)
+    elif time.time() - snapshot_refreshed_at >= SNAPSHOT_MAX_AGE:
+        asyncio.ensure_future(refresh_snapshot())
+
+    etag = snapshot_etag()
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    version = change_log.event_id()  # snapshot_etag() で古くなったサムネイルを記録した後のもの
+    resume_from = change_log.parse_event_id(since)
+    changes = change_log.since(resume_from) if resume_from is not None else None
+    if changes is not None:
+        body = b'{"version":%s,"full":false,"changes":%s}' % (dumps(version), encode_changes(changes))
+        return Response(body, media_type="application/json", headers=headers)
+
+    # 同じバージョンのボディは使い回す
+    if _ports_body[0] != etag:
+        ports = cached_ports()
+        _ports_body = (etag, encode_ports(ports, version=version, full=True, groups=group_ports(ports)))
+    return Response(_ports_body[1], media_type="application/json", headers=headers)
+
+@app.get("/api/ports/cached")
+async def get_cached_ports():
+    """最後に確認したポートの一覧（スキャンせずに即座に返す）"""
+    ports = cached_ports()
+    return Response(encode_ports(ports, groups=group_ports(ports)), media_type="application/json")
+
+@app.get("/api/ports/history")
+async def get_ports_history():
+    """全ポートの応答性の履歴（スパークライン用）"""
+    return Response(dumps({"size": HISTORY_SIZE, "ports": responsiveness.sparklines()}), media_type="application/json")
+
+@app.get("/api/ports/{port}/history")
+async def get_port_history(port: int):
+    """ポートの応答性の履歴（接続時間・TTFB・ステータス、古い順）"""
+    history = responsiveness.get(port)
+    if history is None:
+        return JSONResponse({"error": "No history for this port"}, status_code=404)
+    return Response(dumps(dict(history, port=port)), media_type="application/json")
+
+@app.get("/api/ports/{port}/thumbnail")
+async def get_thumbnail(port: int):
+    """画面に表示されたカードのサムネイルを取得（古ければ優先して撮り直す）
+
+    撮影するのはスキャンでタイトルを取得できたWebのポートだけ（任意のポートを撮影させない）。
+    """
+    record = port_snapshot.get(port)
+    if record is None or not record.title:
+        return JSONResponse({"error": "No web page on this port"}, status_code=404)
+    thumbnail, stale = screenshot_scheduler.cached(port)
+    if stale:
+        thumbnail = await screenshot_scheduler.request(port, PRIORITY_VISIBLE) or thumbnail
+    return {"port": port, "thumbnail": thumbnail}
 
 @app.post("/api/control/stop")
 async def stop_service():
@@ -360,547 +2558,316 @@ async def stop_service():
     thread.start()
     return JSONResponse({"success": True})
 
-@app.get("/api/ports/stream")
-async def stream_ports(existing: str = ""):
+# ---- 切断・再読み込み時の取り消し ----
+# タブを閉じたり更新を連打したりしたときに、不要になったスキャン・情報取得・撮影を続けない
+
+DISCONNECT_POLL_INTERVAL = 0.5
+# 途中のプロキシやブラウザに接続を切られないよう、何も送らない時間が続いたらコメント行を送る
+HEARTBEAT_INTERVAL = 15.0
+_active_streams: Dict[str, asyncio.Task] = {}  # クライアントID -> 実行中の更新
+
+def cancellable_stream(request: Request, produce, client_id: Optional[str] = None):
+    """produce(queue) をタスクで実行し、キューに入れられたバイト列をそのまま流す
+
+    クライアントが切断したとき、または同じクライアントIDで新しいストリームが始まったときに
+    タスクを取り消す（実行中の情報取得や撮影待ちもその場で止まる）。
+    """
     async def generate():
+        last_sent = time.monotonic()
+        queue = asyncio.Queue()
+        task = asyncio.ensure_future(produce(queue))
+        task.add_done_callback(lambda _: queue.put_nowait(None))
+        if client_id:
+            previous = _active_streams.get(client_id)
+            if previous is not None:
+                previous.cancel()
+            _active_streams[client_id] = task
+        try:
+            while True:
+                try:
+                    item = await asyncio.wait_for(queue.get(), DISCONNECT_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    if time.monotonic() - last_sent >= HEARTBEAT_INTERVAL:
+                        last_sent = time.monotonic()
+                        yield b": heartbeat\n\n"
+                    continue
+                if item is None:
+                    break
+                last_sent = time.monotonic()
+                yield item
+            if task.done() and not task.cancelled():
+                task.result()
+        finally:
+            task.cancel()
+            if client_id and _active_streams.get(client_id) is task:
+                del _active_streams[client_id]
+    return generate()
+
+def change_event(version: int, port: int, record: Optional[PortRecord], event: str = "") -> bytes:
+    """変更ログの1件をSSEのイベントにする（削除は removed イベント）"""
+    if record is None:
+        return b"id: %s\nevent: removed\ndata: {\"port\":%d}\n\n" % (change_log.event_id(version).encode(), port)
+    event_line = b"event: %s\n" % event.encode() if event else b""
+    return b"id: %s\n%sdata: %s\n\n" % (change_log.event_id(version).encode(), event_line,
+                                           with_cached_thumbnail(record).encode())
+
+@app.get("/api/ports/stream")
+async def stream_ports(request: Request, existing: str = "", full: bool = False, client: str = ""):
+    """スキャン結果をSSEで1件ずつ返す（client が同じ古いストリームは取り消す）
+
+    再接続（Last-Event-ID）の場合はスキャンせず、それ以降の変更と現在のポート一覧だけを返す。
+    """
+    resume_from = change_log.parse_event_id(request.headers.get("last-event-id"))
+    changes = change_log.since(resume_from) if resume_from is not None else None
+
+    async def resume(queue: asyncio.Queue):
+        for version, port, record in changes:
+            queue.put_nowait(change_event(version, port, record))
+        queue.put_nowait(b"event: ports\ndata: %s\n\n" % dumps({"ports": sorted(port_snapshot)}))
+        queue.put_nowait(b"id: %s\ndata: [DONE]\n\n" % change_log.event_id().encode())
+
+    async def produce(queue: asyncio.Queue):
         existing_ports = set(map(int, existing.split(','))) if existing else set()
-        ports = await scan_ports()
-        ports = [p for p in ports if p["port"] != 8888]
-        
+        ports = await scan_plan.scan(full)
+
         # 新しいポートを優先、既存ポートは後回し
-        new_ports = [p for p in ports if p["port"] not in existing_ports]
-        old_ports = [p for p in ports if p["port"] in existing_ports]
+        new_ports = [p for p in ports if p.port not in existing_ports]
+        old_ports = [p for p in ports if p.port in existing_ports]
         sorted_ports = new_ports + old_ports
-        
-        for p in sorted_ports:
-            info = get_process_info(p["port"])
-            p["process"] = info["process"]
-            p["origin"] = info["origin"]
-            if info["is_likely_web"]:
-                p["title"], p["thumbnail"] = await get_page_info(p["port"])
-            else:
-                p["title"], p["thumbnail"] = None, None
-            yield f"data: {json.dumps(p)}\n\n"
-        yield "data: [DONE]\n\n"
-    return StreamingResponse(generate(), media_type="text/event-stream")
 
-@app.get("/", response_class=HTMLResponse)
-async def root():
-    return """
-<!DOCTYPE html>
+        # 消えたポートの撮影ジョブは取り消す
+        screenshot_scheduler.retain(p.port for p in ports)
+
+        async for p in enrich_ports(sorted_ports, existing_ports):
+            # 送った分はスナップショットに反映しておき、再接続時にはその続きから送る
+            apply_snapshot(p)
+            queue.put_nowait(b"id: %s\ndata: %s\n\n" % (change_log.event_id().encode(), p.encode()))
+        remember_ports(ports)
+        queue.put_nowait(b"id: %s\ndata: [DONE]\n\n" % change_log.event_id().encode())
+
+    return StreamingResponse(cancellable_stream(request, resume if changes is not None else produce, client),
+                             media_type="text/event-stream")
+
+# ---- LISTENソケットの監視 ----
+# フルスキャンを待たずにサーバーの起動・停止を検出してSSEで通知する
+
+LISTEN_POLL_INTERVAL = 0.5
+# netstat を起動して調べる環境（macOS）では、変化がない間は確認の間隔を倍にしていく（この秒数まで）
+LISTEN_NETSTAT_MAX_INTERVAL = float(os.environ.get("LOCALPORTAL_LISTEN_NETSTAT_MAX_INTERVAL", "4"))
+
+def _decode_proc_address(hex_address: str) -> str:
+    """/proc/net/tcp(6) のアドレス（32ビットごとのリトルエンディアン）を文字列にする"""
+    raw = b''.join(bytes.fromhex(hex_address[i:i + 8])[::-1] for i in range(0, len(hex_address), 8))
+    return socket.inet_ntop(socket.AF_INET6 if len(raw) == 16 else socket.AF_INET, raw)
+
+def _read_proc_listeners(path: str, listeners: dict, addresses: Optional[dict] = None):
+    """/proc/net/tcp(6) からLISTEN中のソケットを読む（port -> inode集合、port -> アドレス集合）"""
+    with open(path) as f:
+        next(f, None)
+        for line in f:
+            fields = line.split()
+            # st が 0A なら LISTEN
+            if len(fields) < 10 or fields[3] != '0A':
+                continue
+            hex_address, hex_port = fields[1].rsplit(':', 1)
+            port = int(hex_port, 16)
+            listeners.setdefault(port, set()).add(fields[9])
+            if addresses is not None:
+                addresses.setdefault(port, set()).add(_decode_proc_address(hex_address))
+
+def _read_netstat_listeners(listeners: dict, addresses: Optional[dict] = None):
+    """netstat の出力からLISTEN中のポートを読む（macOS用、port -> ソケットのアドレス集合）
+
+    -A で出力される先頭の列（カーネル内のソケットのアドレス）を /proc の inode の代わりに使い、
+    同じポートでサーバーが再起動したことを検出する。
+    """
+    result = run_command(['netstat', '-anA', '-p', 'tcp'], timeout=2)
+    for line in result.stdout.splitlines():
+        fields = line.split()
+        # Socket, (Flowhash,) Proto, Recv-Q, Send-Q, Local Address, Foreign Address, (state)
+        if len(fields) < 7 or fields[-1] != 'LISTEN':
+            continue
+        # ローカルアドレスは "127.0.0.1.5173" や "*.5173"、"::1.5173" の形式
+        try:
+            address, port = fields[-3].rsplit('.', 1)
+            port = int(port)
+        except ValueError:
+            continue
+        listeners.setdefault(port, set()).add(fields[0])
+        if addresses is not None:
+            if address == '*':
+                # tcp46 はIPv4/IPv6の両方で待ち受けている
+                address = '::' if fields[-6] == 'tcp6' else '0.0.0.0'
+            addresses.setdefault(port, set()).add(address)
+
+def read_listeners() -> Optional[Dict[int, frozenset]]:
+    """LISTEN中のTCPポートを取得（取得できない環境ではNone）
+
+    Linuxでは /proc/net/tcp を読むだけなのでプロセス起動もソケット接続も発生しない。
+    inode（macOSではソケットのアドレス）も比較するので、同じポートでサーバーが再起動した場合も検出できる。
+    """
+    listeners = {}
+    try:
+        if os.path.exists('/proc/net/tcp'):
+            for path in ('/proc/net/tcp', '/proc/net/tcp6'):
+                if os.path.exists(path):
+                    _read_proc_listeners(path, listeners)
+        else:
+            _read_netstat_listeners(listeners)
+    except Exception:
+        return None
+    return {port: frozenset(inodes) for port, inodes in listeners.items()}
+
+def read_bound_addresses() -> Optional[Dict[int, List[str]]]:
+    """LISTEN中のTCPポートとそのアドレスを取得（取得できない環境ではNone）"""
+    listeners, addresses = {}, {}
+    try:
+        if os.path.exists('/proc/net/tcp'):
+            for path in ('/proc/net/tcp', '/proc/net/tcp6'):
+                if os.path.exists(path):
+                    _read_proc_listeners(path, listeners, addresses)
+        else:
+            _read_netstat_listeners(listeners, addresses)
+    except Exception:
+        return None
+    return {port: sorted(found) for port, found in addresses.items()}
+
+class ListenerWatcher:
+    """LISTENソケットの増減を監視して購読者に通知する
+
+    購読者がいる間だけポーリングし、変化があったポートだけを処理する。
+    追加されたポートはプロセス情報・プロトコル・タイトルを取得したら ("added", レコード) を、
+    撮影が終わったら ("thumbnail", {"port": ポート番号, "thumbnail": base64}) を、
+    消えたポートは即座に ("removed", {"port": ポート番号}) を配信する。
+    """
+
+    def __init__(self, plan: ScanPlan, interval: float = LISTEN_POLL_INTERVAL):
+        self.plan = plan
+        self.interval = interval
+        # /proc を読むだけの環境では間隔を広げない
+        self.max_interval = interval if os.path.exists('/proc/net/tcp') else max(interval, LISTEN_NETSTAT_MAX_INTERVAL)
+        self._subscribers = set()
+        self._task = None
+        self._pending = {}  # port -> 情報取得中のタスク
+
+    def subscribe(self) -> asyncio.Queue:
+        queue = asyncio.Queue()
+        self._subscribers.add(queue)
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self._subscribers.discard(queue)
+        if not self._subscribers and self._task is not None:
+            self._task.cancel()
+            self._task = None
+            for task in self._pending.values():
+                task.cancel()
+            self._pending.clear()
+
+    def _broadcast(self, event: str, data):
+        # remember_port/forget_port の後に呼ぶので、変更ログのバージョンがこのイベントのID
+        for queue in self._subscribers:
+            queue.put_nowait((change_log.version, event, data))
+
+    def _watched(self, listeners: Dict[int, frozenset]) -> Dict[int, frozenset]:
+        return {port: inodes for port, inodes in listeners.items() if self.plan.contains(port)}
+
+    async def _announce(self, port: int):
+        try:
+            bound = await run_blocking(read_bound_addresses)
+            record = await run_blocking(check_port, port, bound.get(port, []) if bound is not None else None)
+            if record is None:
+                return
+            record_upstream(record)
+            # Chromiumでの撮影（最大 THUMBNAIL_CAPTURE_TIMEOUT 秒）は待たずに知らせる
+            record = await enrich_port(record, is_new=False)
+            remember_port(record)
+            self._broadcast("added", record)
+            if record.title and record.thumbnail_stale:
+                thumbnail = await screenshot_scheduler.request(port, PRIORITY_NEW)
+                if thumbnail:
+                    self._broadcast("thumbnail", {"port": port, "thumbnail": thumbnail})
+        finally:
+            self._pending.pop(port, None)
+
+    async def _run(self):
+        previous = await run_blocking(read_listeners)
+        if previous is None:
+            return
+        previous = self._watched(previous)
+
+        delay = self.interval
+        while True:
+            await asyncio.sleep(delay)
+            current = await run_blocking(read_listeners)
+            if current is None:
+                continue
+            current = self._watched(current)
+            if current == previous:
+                delay = min(delay * 2, self.max_interval)
+                continue
+            delay = self.interval
+
+            for port in previous.keys() - current.keys():
+                task = self._pending.pop(port, None)
+                if task is not None:
+                    task.cancel()
+                screenshot_scheduler.cancel(port)
+                forget_port(port)
+                forget_upstream(port)
+                self._broadcast("removed", {"port": port})
+
+            for port, inodes in current.items():
+                if previous.get(port) == inodes:
+                    continue
+                # 新しいポート、または同じポートで再起動したサーバー
+                self.plan.learn([port])
+                task = self._pending.pop(port, None)
+                if task is not None:
+                    task.cancel()
+                screenshot_scheduler.cancel(port)
+                self._pending[port] = asyncio.ensure_future(self._announce(port))
+
+            previous = current
+
+listener_watcher = ListenerWatcher(scan_plan)
+
+@app.get("/api/ports/events")
+async def port_events(request: Request):
+    """ポートの追加・削除をSSEで通知（Last-Event-ID 以降の変更は変更ログから送り直す）"""
+    resume_from = change_log.parse_event_id(request.headers.get("last-event-id"))
+
+    async def produce(output: asyncio.Queue):
+        queue = listener_watcher.subscribe()
+        replayed = change_log.version
+        try:
+            changes = change_log.since(resume_from) if resume_from is not None else None
+            for version, port, record in changes or ():
+                output.put_nowait(change_event(version, port, record, "added"))
+            while True:
+                version, event, data = await queue.get()
+                if changes is not None and version <= replayed:
+                    continue
+                payload = data.encode() if isinstance(data, PortRecord) else dumps(data)
+                output.put_nowait(b"id: %s\nevent: %s\ndata: %s\n\n"
+                                  % (change_log.event_id(version).encode(), event.encode(), payload))
+        finally:
+            listener_watcher.unsubscribe(queue)
+    return StreamingResponse(cancellable_stream(request, produce), media_type="text/event-stream")
+
+# ダッシュボードのHTML（CSS/JSは /static からハッシュ付きファイル名で配信）
+DASHBOARD_HTML = """<!DOCTYPE html>
 <html>
 <head>
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>Local Portal</title>
     <link rel="icon" href="/static/favicon.png" type="image/png">
-    <style>
-        :root {
-            --bg: #ffffff;
-            --bg-secondary: #f8f9fa;
-            --bg-card: #ffffff;
-            --text: #1a1a1a;
-            --text-secondary: #6c757d;
-            --border: #e9ecef;
-            --shadow: rgba(0,0,0,0.1);
-            --accent: #6366f1;
-            --accent-hover: #4f46e5;
-        }
-        [data-theme="dark"] {
-            --bg: #0f172a;
-            --bg-secondary: #1e293b;
-            --bg-card: #1e293b;
-            --text: #f1f5f9;
-            --text-secondary: #94a3b8;
-            --border: #334155;
-            --shadow: rgba(0,0,0,0.3);
-            --accent: #818cf8;
-            --accent-hover: #6366f1;
-        }
-        * { margin: 0; padding: 0; box-sizing: border-box; }
-        body {
-            font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, Oxygen, Ubuntu, sans-serif;
-            background: var(--bg);
-            color: var(--text);
-            transition: background 0.3s, color 0.3s;
-            min-height: 100vh;
-            padding: 20px;
-        }
-        .container { max-width: 1200px; margin: 0 auto; }
-        header {
-            display: flex;
-            justify-content: space-between;
-            align-items: center;
-            margin-bottom: 20px;
-            padding-bottom: 20px;
-            border-bottom: 2px solid var(--border);
-            position: relative;
-        }
-        .status-bar {
-            background: var(--bg-card);
-            border: 1px solid var(--border);
-            border-radius: 8px;
-            padding: 12px 20px;
-            margin-bottom: 20px;
-            display: flex;
-            align-items: center;
-            gap: 10px;
-            font-size: 14px;
-            color: var(--text-secondary);
-        }
-        .status-bar.scanning {
-            border-color: var(--accent);
-            background: linear-gradient(90deg, var(--bg-card), var(--bg-secondary), var(--bg-card));
-            background-size: 200% 100%;
-            animation: scanning 2s linear infinite;
-        }
-        .status-bar.complete {
-            border-color: var(--border);
-            color: var(--text-secondary);
-            opacity: 0.6;
-        }
-        .status-bar.complete .spinner {
-            display: none;
-        }
-        .status-bar.stopping {
-            border-color: #ef4444;
-            background: linear-gradient(90deg, var(--bg-card), var(--bg-secondary), var(--bg-card));
-            background-size: 200% 100%;
-            animation: scanning 2s linear infinite;
-            color: #ef4444;
-        }
-        .status-bar.stopped {
-            border-color: #ef4444;
-            color: #ef4444;
-            background: var(--bg-card);
-        }
-        .status-bar.stopped .spinner {
-            display: none;
-        }
-
-        @keyframes scanning {
-            0% { background-position: 200% 0; }
-            100% { background-position: -200% 0; }
-        }
-
-        h1 {
-            font-size: 2rem;
-            font-weight: 700;
-            background: linear-gradient(135deg, var(--accent), #ec4899);
-            -webkit-background-clip: text;
-            -webkit-text-fill-color: transparent;
-            background-clip: text;
-        }
-        .controls {
-            display: flex;
-            gap: 12px;
-            align-items: center;
-        }
-        button {
-            padding: 10px 20px;
-            border: none;
-            border-radius: 8px;
-            font-size: 14px;
-            font-weight: 500;
-            cursor: pointer;
-            transition: all 0.2s;
-            display: flex;
-            align-items: center;
-            gap: 8px;
-        }
-        .btn-primary {
-            background: var(--accent);
-            color: white;
-        }
-        .btn-primary:hover:not(:disabled) {
-            background: var(--accent-hover);
-            transform: translateY(-1px);
-            box-shadow: 0 4px 12px var(--shadow);
-        }
-        .btn-primary:disabled {
-            opacity: 0.5;
-            cursor: not-allowed;
-        }
-        .btn-secondary {
-            background: var(--bg-card);
-            color: var(--text);
-            border: 1px solid var(--border);
-        }
-        .btn-secondary:hover {
-            background: var(--bg-secondary);
-        }
-        .btn-icon {
-            background: var(--bg-card);
-            color: var(--text);
-            border: 1px solid var(--border);
-            padding: 10px;
-        }
-        .btn-icon:hover:not(:disabled) {
-            background: var(--bg-secondary);
-        }
-        .btn-icon:disabled {
-            opacity: 0.5;
-            cursor: not-allowed;
-        }
-        .btn-stop {
-            padding: 6px 12px;
-            background: transparent;
-            color: var(--text-secondary);
-            border: 1px solid transparent;
-            font-size: 12px;
-            opacity: 0.3;
-        }
-        .btn-stop:hover {
-            opacity: 1;
-            border-color: var(--border);
-            background: var(--bg-secondary);
-        }
-        .modal {
-            display: none;
-            position: fixed;
-            top: 0;
-            left: 0;
-            width: 100%;
-            height: 100%;
-            background: rgba(0,0,0,0.5);
-            z-index: 1000;
-            align-items: center;
-            justify-content: center;
-        }
-        .modal.show {
-            display: flex;
-        }
-        .modal-content {
-            background: var(--bg-card);
-            border-radius: 12px;
-            padding: 24px;
-            max-width: 500px;
-            width: 90%;
-            box-shadow: 0 8px 32px var(--shadow);
-        }
-        .modal-title {
-            font-size: 18px;
-            font-weight: 600;
-            margin-bottom: 12px;
-            color: var(--text);
-        }
-        .modal-body {
-            color: var(--text-secondary);
-            margin-bottom: 20px;
-            line-height: 1.6;
-        }
-        .modal-actions {
-            display: flex;
-            gap: 12px;
-            justify-content: flex-end;
-        }
-        .stopped-message {
-            text-align: center;
-            padding: 40px 20px;
-        }
-        .stopped-message h2 {
-            font-size: 24px;
-            margin-bottom: 16px;
-            color: var(--text);
-        }
-        .stopped-message p {
-            color: var(--text-secondary);
-            margin-bottom: 24px;
-        }
-        .cmd-wrapper {
-            display: flex;
-            align-items: center;
-            gap: 8px;
-            margin-bottom: 16px;
-        }
-        .cmd-display {
-            flex: 1;
-            background: var(--bg-secondary);
-            padding: 12px 16px;
-            border-radius: 8px;
-            font-family: 'Monaco', 'Courier New', monospace;
-            font-size: 13px;
-            color: var(--accent);
-            word-break: break-all;
-        }
-        .btn-copy {
-            padding: 12px;
-            background: var(--bg-secondary);
-            border: 1px solid var(--border);
-            border-radius: 8px;
-            cursor: pointer;
-            transition: all 0.2s;
-        }
-        .btn-copy:hover {
-            background: var(--accent);
-            color: white;
-            border-color: var(--accent);
-        }
-
-
-
-        .spinner {
-            display: inline-block;
-            width: 20px;
-            height: 20px;
-            border: 3px solid var(--border);
-            border-top-color: var(--accent);
-            border-radius: 50%;
-            animation: spin 0.8s linear infinite;
-            margin-right: 10px;
-        }
-        @keyframes spin {
-            to { transform: rotate(360deg); }
-        }
-        .skeleton {
-            background: linear-gradient(90deg, var(--bg-secondary) 25%, var(--border) 50%, var(--bg-secondary) 75%);
-            background-size: 200% 100%;
-            animation: shimmer 1.5s infinite;
-            border-radius: 6px;
-        }
-        @keyframes shimmer {
-            0% { background-position: 200% 0; }
-            100% { background-position: -200% 0; }
-        }
-        .skeleton-card {
-            background: var(--bg-card);
-            border: 1px solid var(--border);
-            border-radius: 12px;
-            overflow: hidden;
-            box-shadow: 0 2px 8px var(--shadow);
-        }
-        .skeleton-thumbnail {
-            width: 100%;
-            height: 180px;
-            background: linear-gradient(90deg, var(--bg-secondary) 25%, var(--border) 50%, var(--bg-secondary) 75%);
-            background-size: 200% 100%;
-            animation: shimmer 1.5s infinite;
-        }
-        .skeleton-body {
-            padding: 20px;
-        }
-        .skeleton-header {
-            display: flex;
-            justify-content: space-between;
-            margin-bottom: 12px;
-        }
-        .skeleton-badge {
-            width: 60px;
-            height: 32px;
-        }
-        .skeleton-process {
-            width: 80px;
-            height: 24px;
-        }
-        .skeleton-title {
-            width: 70%;
-            height: 20px;
-            margin-bottom: 8px;
-        }
-        .skeleton-link {
-            width: 90%;
-            height: 16px;
-        }
-        .grid {
-            display: grid;
-            gap: 16px;
-            grid-template-columns: repeat(auto-fill, minmax(350px, 1fr));
-        }
-        .portal-card {
-            background: var(--bg-secondary);
-            border: 1px solid var(--border);
-            border-radius: 12px;
-            padding: 20px;
-            text-decoration: none;
-            display: flex;
-            align-items: center;
-            gap: 16px;
-            color: inherit;
-            opacity: 0.6;
-            pointer-events: none;
-        }
-        .portal-icon {
-            font-size: 48px;
-            background: linear-gradient(135deg, var(--accent), #ec4899);
-            -webkit-background-clip: text;
-            -webkit-text-fill-color: transparent;
-            background-clip: text;
-            opacity: 0.5;
-        }
-        .portal-info {
-            flex: 1;
-        }
-        .portal-title {
-            font-size: 14px;
-            font-weight: 600;
-            color: var(--text-secondary);
-            margin-bottom: 4px;
-        }
-        .portal-meta {
-            font-size: 12px;
-            color: var(--text-secondary);
-            opacity: 0.7;
-        }
-        .card {
-            background: var(--bg-card);
-            border: 1px solid var(--border);
-            border-radius: 12px;
-            overflow: hidden;
-            transition: all 0.2s;
-            box-shadow: 0 2px 8px var(--shadow);
-            cursor: pointer;
-            text-decoration: none;
-            display: block;
-            color: inherit;
-        }
-        .card-thumbnail {
-            width: 100%;
-            height: 180px;
-            object-fit: cover;
-            background: var(--bg-secondary);
-        }
-        .card-body {
-            padding: 20px;
-        }
-        .card:hover {
-            transform: translateY(-2px);
-            box-shadow: 0 8px 24px var(--shadow);
-            border-color: var(--accent);
-        }
-        .card:hover .card-thumbnail {
-            opacity: 0.9;
-        }
-        .card.checking {
-            opacity: 0.5;
-            pointer-events: none;
-        }
-        .card-header {
-            display: flex;
-            justify-content: space-between;
-            align-items: center;
-            margin-bottom: 12px;
-        }
-        .port-badge {
-            background: var(--accent);
-            color: white;
-            padding: 6px 12px;
-            border-radius: 6px;
-            font-weight: 600;
-            font-size: 18px;
-        }
-        .process-badge {
-            background: var(--bg-secondary);
-            color: var(--text-secondary);
-            padding: 4px 10px;
-            border-radius: 6px;
-            font-size: 12px;
-            font-weight: 500;
-        }
-        .card-title {
-            color: var(--text);
-            font-size: 15px;
-            margin-bottom: 8px;
-            font-weight: 500;
-        }
-        .card-link {
-            color: var(--accent);
-            text-decoration: none;
-            font-size: 14px;
-            word-break: break-all;
-        }
-        .card-link:hover {
-            text-decoration: underline;
-        }
-        .card-origin {
-            display: flex;
-            align-items: center;
-            gap: 6px;
-            font-size: 12px;
-            color: var(--text-secondary);
-            margin-bottom: 8px;
-            padding: 4px 8px;
-            background: var(--bg-secondary);
-            border-radius: 4px;
-        }
-        .origin-icon {
-            font-size: 14px;
-            flex-shrink: 0;
-        }
-        .origin-text {
-            overflow: hidden;
-            text-overflow: ellipsis;
-            white-space: nowrap;
-            cursor: help;
-            font-family: 'SF Mono', 'Monaco', 'Menlo', 'Consolas', monospace;
-        }
-        .empty {
-            text-align: center;
-            padding: 60px 20px;
-            color: var(--text-secondary);
-        }
-        .section-title {
-            font-size: 1.2rem;
-            font-weight: 600;
-            margin: 32px 0 16px 0;
-            color: var(--text);
-        }
-        .non-web-table {
-            width: 100%;
-            background: var(--bg-card);
-            border: 1px solid var(--border);
-            border-radius: 12px;
-            overflow: hidden;
-            box-shadow: 0 2px 8px var(--shadow);
-        }
-        .non-web-table table {
-            width: 100%;
-            border-collapse: collapse;
-        }
-        .non-web-table th {
-            background: var(--bg-secondary);
-            text-align: left;
-            padding: 12px 16px;
-            font-size: 13px;
-            font-weight: 600;
-            color: var(--text-secondary);
-            text-transform: uppercase;
-            letter-spacing: 0.5px;
-            white-space: nowrap;
-        }
-        .non-web-table th:first-child,
-        .non-web-table td:first-child {
-            text-align: right;
-        }
-        .non-web-table th:nth-child(3),
-        .non-web-table td:nth-child(3) {
-            max-width: 400px;
-            overflow: hidden;
-            text-overflow: ellipsis;
-            white-space: nowrap;
-        }
-        .non-web-table th:last-child,
-        .non-web-table td:last-child {
-            text-align: right;
-        }
-        .non-web-table td {
-            padding: 12px 16px;
-            border-top: 1px solid var(--border);
-            font-size: 14px;
-            font-family: 'SF Mono', 'Monaco', 'Menlo', 'Consolas', monospace;
-            color: var(--text);
-        }
-        .non-web-table tr:hover {
-            background: var(--bg-secondary);
-        }
-        @media (max-width: 600px) {
-            h1 { font-size: 1.3rem; }
-            header > div { gap: 8px !important; }
-            .controls { gap: 8px; }
-            button { padding: 8px 12px; font-size: 13px; }
-            .btn-icon { padding: 8px; }
-            .btn-stop { padding: 4px 8px; font-size: 11px; }
-        }
-    </style>
+    <link rel="stylesheet" href="{css}">
 </head>
 <body>
     <div class="container">
@@ -930,413 +2897,22 @@ async def root():
         </div>
         <div id="content"></div>
     </div>
-    <script>
-        function confirmStop() {
-            const modal = document.getElementById('modal');
-            document.getElementById('modalTitle').textContent = 'サービスを停止しますか？';
-            document.getElementById('modalBody').textContent = 'Local Portalが停止します。再度起動するにはターミナルでコマンドを実行する必要があります。';
-            modal.classList.add('show');
-        }
-        
-        function closeModal() {
-            document.getElementById('modal').classList.remove('show');
-        }
-        
-        async function executeAction() {
-            closeModal();
-            
-            const statusBar = document.getElementById('status');
-            const statusText = document.getElementById('statusText');
-            statusBar.className = 'status-bar stopping';
-            statusText.textContent = 'サービスを停止しています...';
-            
-            await fetch('/api/control/stop', { method: 'POST' });
-            setTimeout(() => showStopped(), 1000);
-        }
-        
-        function showStopped() {
-            document.getElementById('refreshBtn').disabled = true;
-            document.getElementById('themeBtn').disabled = true;
-            
-            const statusBar = document.getElementById('status');
-            const statusText = document.getElementById('statusText');
-            statusBar.className = 'status-bar stopped';
-            statusText.textContent = '⏹️ サービスを停止しました';
-            
-            const cmd = 'launchctl load ~/Library/LaunchAgents/com.localportal.plist';
-            document.getElementById('content').innerHTML = `
-                <div class="stopped-message">
-                    <h2>再起動方法</h2>
-                    <p>以下のコマンドをターミナルで実行してください。</p>
-                    <div class="cmd-wrapper">
-                        <div class="cmd-display">${cmd}</div>
-                        <button class="btn-copy" onclick="navigator.clipboard.writeText('${cmd}')" title="コピー">📋</button>
-                    </div>
-                </div>
-            `;
-        }
-        
-        function toggleTheme() {
-            const html = document.documentElement;
-            const current = html.getAttribute('data-theme');
-            const next = current === 'dark' ? 'light' : 'dark';
-            html.setAttribute('data-theme', next);
-            localStorage.setItem('theme', next);
-        }
-        
-        function initTheme() {
-            const saved = localStorage.getItem('theme');
-            const prefersDark = window.matchMedia('(prefers-color-scheme: dark)').matches;
-            const theme = saved || (prefersDark ? 'dark' : 'light');
-            document.documentElement.setAttribute('data-theme', theme);
-        }
-        
-        function showSkeleton() {
-            const skeletonHTML = `
-                <h2 class="section-title">🌐 Webサーバー</h2>
-                <div id="web-grid" class="grid">
-                    <div class="portal-card">
-                        <div class="portal-icon">🚀</div>
-                        <div class="portal-info">
-                            <div class="portal-title">Local Portal</div>
-                            <div class="portal-meta">Port 8888 · uvicorn</div>
-                        </div>
-                    </div>
-                    ${Array(3).fill(0).map(() => `
-                        <div class="skeleton-card">
-                            <div class="skeleton-thumbnail"></div>
-                            <div class="skeleton-body">
-                                <div class="skeleton-header">
-                                    <div class="skeleton skeleton-badge"></div>
-                                    <div class="skeleton skeleton-process"></div>
-                                </div>
-                                <div class="skeleton skeleton-title"></div>
-                                <div class="skeleton skeleton-link"></div>
-                            </div>
-                        </div>
-                    `).join('')}
-                </div>
-                <h2 class="section-title">🔌 その他のサービス</h2>
-                <div id="non-web-table" class="non-web-table"><table><thead><tr><th>ポート</th><th>プロセス</th><th>起動元</th><th>起動時刻</th></tr></thead><tbody></tbody></table></div>
-            `;
-            document.getElementById('content').innerHTML = skeletonHTML;
-        }
-        
-        let currentPorts = new Set();
-        let statusTimeout = null;
-        
-        async function refresh() {
-            const existingPorts = Array.from(currentPorts).join(',');
-            const isFirstLoad = currentPorts.size === 0;
-            
-            // ステータス更新
-            const statusBar = document.getElementById('status');
-            const statusText = document.getElementById('statusText');
-            statusBar.className = 'status-bar scanning';
-            statusText.textContent = 'ポートスキャン中...';
-            
-            if (isFirstLoad) {
-                showSkeleton();
-            } else {
-                // セクションタイトルを更新中表示に
-                const webTitle = document.querySelector('.section-title');
-                const nonWebTitle = document.querySelectorAll('.section-title')[1];
-                if (webTitle) webTitle.textContent = '🌐 Webサーバー (更新中...)';
-                if (nonWebTitle) nonWebTitle.textContent = '🔌 その他のサービス (更新中...)';
-                // 既存カードを確認中状態にする
-                document.querySelectorAll('.card').forEach(card => card.classList.add('checking'));
-                document.querySelectorAll('#non-web-table tbody tr').forEach(row => row.style.opacity = '0.5');
-            }
-            
-            const newPorts = new Set();
-            const webPorts = [];
-            const nonWebPorts = [];
-            
-            const eventSource = new EventSource(`/api/ports/stream?existing=${existingPorts}`);
-            
-            eventSource.onmessage = (event) => {
-                if (event.data === '[DONE]') {
-                    eventSource.close();
-                    
-                    // 消えたポートのカードを削除
-                    document.querySelectorAll('.card:not(.portal-card)').forEach(card => {
-                        const port = parseInt(card.dataset.port);
-                        if (!newPorts.has(port)) {
-                            card.remove();
-                        }
-                    });
-                    document.querySelectorAll('#non-web-table tbody tr').forEach(row => {
-                        const port = parseInt(row.dataset.port);
-                        if (!newPorts.has(port)) {
-                            row.remove();
-                        } else {
-                            row.style.opacity = '1';
-                        }
-                    });
-                    
-                    currentPorts = newPorts;
-                    
-                    // ステータス更新
-                    statusBar.className = 'status-bar complete';
-                    statusText.textContent = `✓ スキャン完了 (Webサーバー: ${webPorts.length}個、その他: ${nonWebPorts.length}個)`;
-                    
-                    // セクションタイトル更新
-                    const webTitle = document.querySelector('.section-title');
-                    const nonWebTitle = document.querySelectorAll('.section-title')[1];
-                    if (webTitle) webTitle.textContent = `🌐 Webサーバー (${webPorts.length})`;
-                    if (nonWebTitle) nonWebTitle.textContent = `🔌 その他のサービス (${nonWebPorts.length})`;
-                    
-                    // Webサーバーが0個の場合、スケルトンを削除
-                    if (webPorts.length === 0) {
-                        const grid = document.getElementById('web-grid');
-                        if (grid) {
-                            grid.innerHTML = `
-                                <div class="portal-card">
-                                    <div class="portal-icon">🚀</div>
-                                    <div class="portal-info">
-                                        <div class="portal-title">Local Portal</div>
-                                        <div class="portal-meta">Port 8888 · uvicorn</div>
-                                    </div>
-                                </div>
-                            `;
-                        }
-                    }
-
-                    if (webPorts.length === 0 && nonWebPorts.length === 0) {
-                        document.getElementById('content').insertAdjacentHTML('beforeend',
-                            `<div class="empty">📭 他に開いているポートが見つかりませんでした</div>`
-                        );
-                    }
-                    return;
-                }
-                
-                // ステータス更新（検出中）
-                statusText.textContent = `ポートスキャン中... (Webサーバー: ${webPorts.length}個、その他: ${nonWebPorts.length}個)`;
-                
-                const port = JSON.parse(event.data);
-                const isNewPort = !currentPorts.has(port.port);
-                newPorts.add(port.port);
-                
-                if (port.title) {
-                    webPorts.push(port);
-                    renderWebPort(port);
-                    // 新規ポートの場合、ステータスに表示
-                    if (isNewPort) {
-                        if (statusTimeout) clearTimeout(statusTimeout);
-                        statusText.textContent = `✨ 新規ポート検出: ${port.port} (${port.process})`;
-                        statusTimeout = setTimeout(() => {
-                            if (statusBar.className === 'status-bar scanning') {
-                                statusText.textContent = 'ポートスキャン中...';
-                            }
-                        }, 2000);
-                    }
-                } else {
-                    nonWebPorts.push(port);
-                    renderNonWebPort(port);
-                    // 新規ポートの場合、ステータスに表示
-                    if (isNewPort) {
-                        if (statusTimeout) clearTimeout(statusTimeout);
-                        statusText.textContent = `✨ 新規ポート検出: ${port.port} (${port.process})`;
-                        statusTimeout = setTimeout(() => {
-                            if (statusBar.className === 'status-bar scanning') {
-                                statusText.textContent = 'ポートスキャン中...';
-                            }
-                        }, 2000);
-                    }
-                }
-            };
-            
-            eventSource.onerror = () => {
-                eventSource.close();
-            };
-        }
-        
-        function getBaseHostname() {
-            const parts = window.location.hostname.split('.');
-            // 3パート以上なら最後の2パートを使用（5173.air.local -> air.local）
-            // 2パート以下ならそのまま使用（air.local -> air.local）
-            return parts.length > 2 ? parts.slice(-2).join('.') : parts.join('.');
-        }
-
-        function getServerUrl(port) {
-            const base = getBaseHostname();
-            return `https://${port}.${base}:8888`;
-        }
-
-        async function checkDnsSetup() {
-            try {
-                const response = await fetch('/api/hostname');
-                const data = await response.json();
-
-                // 現在のホスト名がローカルドメインか確認
-                const currentHost = window.location.hostname;
-                const parts = currentHost.split('.');
-                const baseDomain = parts.length > 2 ? parts.slice(-2).join('.') : currentHost;
-
-                // テスト用のサブドメインにフェッチしてDNS解決を確認
-                // （実際にはサーバーがないポートでも、DNS解決できればOK）
-                if (!localStorage.getItem('dnsSetupComplete')) {
-                    showDnsSetupModal(data.hostname, data.setup_command);
-                }
-            } catch (e) {
-                console.error('DNS check failed:', e);
-            }
-        }
-
-        function showDnsSetupModal(hostname, setupCommand) {
-            const modal = document.getElementById('modal');
-            document.getElementById('modalTitle').textContent = 'DNS設定が必要です';
-            document.getElementById('modalBody').innerHTML = `
-                <p>リバースプロキシ機能を利用するには、DNSの設定が必要です。</p>
-                <p>以下のコマンドを一度だけ実行してください:</p>
-                <div class="cmd-wrapper">
-                    <div class="cmd-display" id="dnsCommand">${setupCommand}</div>
-                    <button class="btn-copy" onclick="navigator.clipboard.writeText(document.getElementById('dnsCommand').textContent)" title="コピー">📋</button>
-                </div>
-                <p style="margin-top: 12px; font-size: 13px; color: var(--text-secondary);">
-                    設定後、ブラウザを再起動してください。
-                </p>
-            `;
-            document.getElementById('confirmBtn').textContent = '設定済み';
-            document.getElementById('confirmBtn').onclick = () => {
-                localStorage.setItem('dnsSetupComplete', 'true');
-                closeModal();
-            };
-            modal.classList.add('show');
-        }
-
-        function getOriginIcon(type) {
-            const icons = {
-                'launchd': '⚙️',
-                'docker': '🐳',
-                'terminal': '🖥️',
-                'unknown': '❓'
-            };
-            return icons[type] || '❓';
-        }
-
-        function getOriginDisplay(origin) {
-            if (!origin) return { icon: '❓', text: '', title: '' };
-            const icon = getOriginIcon(origin.type);
-            let text = origin.label || origin.parent || '';
-            let title = '';
-            if (origin.command) {
-                // コマンドが長い場合は省略
-                const cmd = origin.command;
-                text = text ? `${text} (${cmd.length > 30 ? cmd.substring(0, 30) + '...' : cmd})` : cmd;
-                title = cmd;
-            }
-            return { icon, text, title };
-        }
-
-        function renderWebPort(p) {
-            const grid = document.getElementById('web-grid');
-            if (grid.querySelector('.skeleton-card')) {
-                grid.innerHTML = `
-                    <div class="portal-card">
-                        <div class="portal-icon">🚀</div>
-                        <div class="portal-info">
-                            <div class="portal-title">Local Portal</div>
-                            <div class="portal-meta">Port 8888 · uvicorn</div>
-                        </div>
-                    </div>
-                `;
-            }
-            
-            // 既存カードを更新または新規作成
-            let card = grid.querySelector(`[data-port="${p.port}"]`);
-            const title = p.title || 'Untitled';
-            const thumbnail = p.thumbnail ? `<img class="card-thumbnail" src="data:image/png;base64,${p.thumbnail}" alt="${title}">` : '';
-            const origin = getOriginDisplay(p.origin);
-            const originHtml = origin.text ? `
-                <div class="card-origin">
-                    <span class="origin-icon">${origin.icon}</span>
-                    <span class="origin-text" title="${origin.title || origin.text}">${origin.text}</span>
-                </div>` : '';
-
-            if (card) {
-                card.classList.remove('checking');
-                card.innerHTML = `
-                    ${thumbnail}
-                    <div class="card-body">
-                        <div class="card-header">
-                            <span class="port-badge">${p.port}</span>
-                            <span class="process-badge">${p.process}</span>
-                        </div>
-                        <div class="card-title">${title}</div>
-                        ${originHtml}
-                        <div class="card-link">${getServerUrl(p.port)}</div>
-                    </div>
-                `;
-            } else {
-                card = document.createElement('a');
-                card.className = 'card';
-                card.dataset.port = p.port;
-                card.href = getServerUrl(p.port);
-                card.target = '_blank';
-                card.innerHTML = `
-                    ${thumbnail}
-                    <div class="card-body">
-                        <div class="card-header">
-                            <span class="port-badge">${p.port}</span>
-                            <span class="process-badge">${p.process}</span>
-                        </div>
-                        <div class="card-title">${title}</div>
-                        ${originHtml}
-                        <div class="card-link">${getServerUrl(p.port)}</div>
-                    </div>
-                `;
-                
-                // ポート番号順に挿入
-                const cards = Array.from(grid.querySelectorAll('.card'));
-                const insertIndex = cards.findIndex(c => parseInt(c.dataset.port) > p.port);
-                if (insertIndex === -1) {
-                    grid.appendChild(card);
-                } else {
-                    grid.insertBefore(card, cards[insertIndex]);
-                }
-            }
-        }
-        
-        function renderNonWebPort(p) {
-            const tbody = document.querySelector('#non-web-table tbody');
-            let row = tbody.querySelector(`[data-port="${p.port}"]`);
-            const origin = getOriginDisplay(p.origin);
-            const startTime = p.origin?.start_time || '-';
-            const originText = origin.text || '-';
-            const originTitle = origin.title || originText;
-            const rowHtml = `
-                <td>${p.port}</td>
-                <td>${p.process}</td>
-                <td title="${originTitle}">${origin.icon} ${originText}</td>
-                <td>${startTime}</td>
-            `;
-
-            if (row) {
-                row.style.opacity = '1';
-                row.innerHTML = rowHtml;
-            } else {
-                row = document.createElement('tr');
-                row.dataset.port = p.port;
-                row.innerHTML = rowHtml;
-
-                // ポート番号順に挿入
-                const rows = Array.from(tbody.querySelectorAll('tr'));
-                const insertIndex = rows.findIndex(r => parseInt(r.dataset.port) > p.port);
-                if (insertIndex === -1) {
-                    tbody.appendChild(row);
-                } else {
-                    tbody.insertBefore(row, rows[insertIndex]);
-                }
-            }
-        }
-        
-
-        
-        initTheme();
-        checkDnsSetup();
-        refresh();
-    </script>
+    <script src="{js}"></script>
 </body>
 </html>
 """
+_dashboard_html = DASHBOARD_HTML.format(
+    css=static_files.urls["dashboard.css"],
+    js=static_files.urls["dashboard.js"],
+).encode("utf-8")
+_dashboard_etag = f'"{hashlib.sha256(_dashboard_html).hexdigest()[:16]}"'
+
+@app.get("/", response_class=HTMLResponse)
+async def root(request: Request):
+    # HTMLは毎回再検証させ、変更がなければ304を返す
+    headers = {"ETag": _dashboard_etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == _dashboard_etag:
+        return Response(status_code=304, headers=headers)
+    return HTMLResponse(_dashboard_html, headers=headers)
+
+startup_timeline["import_ms"] = _elapsed_ms()
@@ -0,0 +1,99 @@
+"""マルチワーカー起動
+
+プロキシとダッシュボードを処理するuvicornワーカーを複数起動し、
+スキャンとサムネイル撮影は専用のスキャナープロセス1つに任せる。
+スキャナーはUnixソケットで待ち受け、ワーカーはスキャン関連のAPIをそこへ中継する。
+（ワーカーごとにChromiumを起動したりポートをスキャンしたりしない）
+
+    python serve.py --workers 4 --host 0.0.0.0 --port 8888 \\
+        --ssl-keyfile certs/key.pem --ssl-certfile certs/cert.pem
+"""
+import argparse
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import uvicorn
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+SCANNER_RESTART_DELAY = 1.0
+
+def default_socket_path() -> str:
+    return f"/tmp/localportal-{os.getuid()}-scanner.sock"
+
+class ScannerSupervisor:
+    """スキャナープロセスを起動し、終了したら再起動する"""
+
+    def __init__(self, socket_path: str):
+        self.socket_path = socket_path
+        self.process = None
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._spawn()
+        self._thread.start()
+
+    def _spawn(self):
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        env = dict(os.environ)
+        # スキャナー自身は中継しない
+        env.pop("LOCALPORTAL_SCANNER_SOCKET", None)
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--uds", self.socket_path, "--log-level", "warning"],
+            cwd=PROJECT_DIR,
+            env=env,
+        )
+
+    def _run(self):
+        while not self._stopping.is_set():
+            if self.process.poll() is not None and not self._stopping.is_set():
+                print(f"scanner exited with {self.process.returncode}, restarting", file=sys.stderr)
+                time.sleep(SCANNER_RESTART_DELAY)
+                if not self._stopping.is_set():
+                    self._spawn()
+            self._stopping.wait(0.5)
+
+    def stop(self):
+        self._stopping.set()
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+def main():
+    parser = argparse.ArgumentParser(description="Local Portal マルチワーカー起動")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8888)
+    parser.add_argument("--ssl-keyfile")
+    parser.add_argument("--ssl-certfile")
+    parser.add_argument("--scanner-socket", default=default_socket_path())
+    args = parser.parse_args()
+
+    os.chdir(PROJECT_DIR)
+    supervisor = ScannerSupervisor(args.scanner_socket)
+    supervisor.start()
+    # ワーカーはこの環境変数を見てスキャン関連のAPIを中継する
+    os.environ["LOCALPORTAL_SCANNER_SOCKET"] = args.scanner_socket
+    try:
+        uvicorn.run(
+            "main:app",
+            host=args.host,
+            port=args.port,
+            workers=args.workers,
+            ssl_keyfile=args.ssl_keyfile,
+            ssl_certfile=args.ssl_certfile,
+        )
+    finally:
+        supervisor.stop()
+
+if __name__ == "__main__":
+    main()
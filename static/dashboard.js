@@ -0,0 +1,752 @@
+function confirmStop() {
+    const modal = document.getElementById('modal');
+    document.getElementById('modalTitle').textContent = 'サービスを停止しますか？';
+    document.getElementById('modalBody').textContent = 'Local Portalが停止します。再度起動するにはターミナルでコマンドを実行する必要があります。';
+    modal.classList.add('show');
+}
+
+function closeModal() {
+    document.getElementById('modal').classList.remove('show');
+}
+
+async function executeAction() {
+    closeModal();
+
+    const statusBar = document.getElementById('status');
+    const statusText = document.getElementById('statusText');
+    statusBar.className = 'status-bar stopping';
+    statusText.textContent = 'サービスを停止しています...';
+
+    await fetch('/api/control/stop', { method: 'POST' });
+    setTimeout(() => showStopped(), 1000);
+}
+
+function showStopped() {
+    document.getElementById('refreshBtn').disabled = true;
+    document.getElementById('themeBtn').disabled = true;
+
+    const statusBar = document.getElementById('status');
+    const statusText = document.getElementById('statusText');
+    statusBar.className = 'status-bar stopped';
+    statusText.textContent = '⏹️ サービスを停止しました';
+
+    const cmd = 'launchctl load ~/Library/LaunchAgents/com.localportal.plist';
+    document.getElementById('content').innerHTML = `
+        <div class="stopped-message">
+            <h2>再起動方法</h2>
+            <p>以下のコマンドをターミナルで実行してください。</p>
+            <div class="cmd-wrapper">
+                <div class="cmd-display">${cmd}</div>
+                <button class="btn-copy" onclick="navigator.clipboard.writeText('${cmd}')" title="コピー">📋</button>
+            </div>
+        </div>
+    `;
+}
+
+function toggleTheme() {
+    const html = document.documentElement;
+    const current = html.getAttribute('data-theme');
+    const next = current === 'dark' ? 'light' : 'dark';
+    html.setAttribute('data-theme', next);
+    localStorage.setItem('theme', next);
+}
+
+function initTheme() {
+    const saved = localStorage.getItem('theme');
+    const prefersDark = window.matchMedia('(prefers-color-scheme: dark)').matches;
+    const theme = saved || (prefersDark ? 'dark' : 'light');
+    document.documentElement.setAttribute('data-theme', theme);
+}
+
+function showSkeleton() {
+    const skeletonHTML = `
+        <h2 class="section-title">🌐 Webサーバー</h2>
+        <div id="web-grid" class="grid">
+            <div class="portal-card">
+                <div class="portal-icon">🚀</div>
+                <div class="portal-info">
+                    <div class="portal-title">Local Portal</div>
+                    <div class="portal-meta">Port 8888 · uvicorn</div>
+                </div>
+            </div>
+            ${Array(3).fill(0).map(() => `
+                <div class="skeleton-card">
+                    <div class="skeleton-thumbnail"></div>
+                    <div class="skeleton-body">
+                        <div class="skeleton-header">
+                            <div class="skeleton skeleton-badge"></div>
+                            <div class="skeleton skeleton-process"></div>
+                        </div>
+                        <div class="skeleton skeleton-title"></div>
+                        <div class="skeleton skeleton-link"></div>
+                    </div>
+                </div>
+            `).join('')}
+        </div>
+        <h2 class="section-title">🔌 その他のサービス</h2>
+        <div id="non-web-table" class="non-web-table"><table><thead><tr><th>ポート</th><th>プロセス</th><th>起動元</th><th>起動時刻</th></tr></thead><tbody></tbody></table></div>
+    `;
+    document.getElementById('content').innerHTML = skeletonHTML;
+    webCards.clear();
+    nonWebRows.clear();
+    webOrder.length = 0;
+    nonWebOrder.length = 0;
+    renderedRange = null;
+}
+
+let currentPorts = new Set();
+let statusTimeout = null;
+
+// ポート番号をキーにした描画状態（port -> { el, view, ... }）
+const webCards = new Map();
+const nonWebRows = new Map();
+// 表示順（ポート番号の昇順）
+const webOrder = [];
+const nonWebOrder = [];
+
+// SSEで届いた更新は1フレームにまとめて反映する
+let pendingPorts = [];
+let flushScheduled = false;
+let scanCounts = { web: 0, nonWeb: 0 };
+
+function setSectionTitles(webText, nonWebText) {
+    const titles = document.querySelectorAll('.section-title');
+    if (titles[0]) titles[0].textContent = webText;
+    if (titles[1]) titles[1].textContent = nonWebText;
+}
+
+function showStatus(text) {
+    const statusText = document.getElementById('statusText');
+    if (statusText.textContent !== text) statusText.textContent = text;
+}
+
+// スキャン中に検出したポート（スキャン中以外はnull）
+let scanningPorts = null;
+
+// タブごとのID（同じタブの新しい更新がサーバー側で古い更新を取り消す）
+const clientId = Math.random().toString(36).slice(2);
+let activeScan = null;
+
+async function refresh() {
+    // 前回の更新がまだ終わっていなければ打ち切る
+    if (activeScan) activeScan.close();
+
+    const existingPorts = Array.from(currentPorts).join(',');
+    const isFirstLoad = currentPorts.size === 0;
+
+    // ステータス更新
+    const statusBar = document.getElementById('status');
+    statusBar.className = 'status-bar scanning';
+    showStatus('ポートスキャン中...');
+
+    if (isFirstLoad) {
+        showSkeleton();
+    } else {
+        // セクションタイトルを更新中表示に
+        setSectionTitles('🌐 Webサーバー (更新中...)', '🔌 その他のサービス (更新中...)');
+        // 既存カードを確認中状態にする
+        webCards.forEach(entry => entry.el.classList.add('checking'));
+        nonWebRows.forEach(entry => entry.el.classList.add('checking'));
+    }
+    document.querySelectorAll('#content > .empty').forEach(el => el.remove());
+
+    const newPorts = new Set();
+    scanningPorts = newPorts;
+    scanCounts = { web: 0, nonWeb: 0 };
+    pendingPorts = [];
+
+    const eventSource = new EventSource(`/api/ports/stream?existing=${existingPorts}&client=${clientId}`);
+    activeScan = eventSource;
+
+    const finish = () => {
+        // 残っている更新を反映してから後片付け
+        flushPorts();
+
+        // 消えたポートのカード・行を削除
+        webCards.forEach((entry, port) => {
+            if (!newPorts.has(port)) removeWebPort(port);
+        });
+        nonWebRows.forEach((entry, port) => {
+            if (!newPorts.has(port)) {
+                removeNonWebPort(port);
+            } else {
+                entry.el.classList.remove('checking');
+            }
+        });
+        scheduleTableRender();
+
+        portGroups.forEach((group, port) => {
+            if (!newPorts.has(port)) portGroups.delete(port);
+        });
+        updateGroupLabels();
+        loadSparklines();
+
+        currentPorts = newPorts;
+        scanningPorts = null;
+        const webCount = webCards.size;
+        const nonWebCount = nonWebRows.size;
+
+        // ステータス更新
+        statusBar.className = 'status-bar complete';
+        showStatus(`✓ スキャン完了 (Webサーバー: ${webCount}個、その他: ${nonWebCount}個)`);
+
+        // セクションタイトル更新
+        setSectionTitles(`🌐 Webサーバー (${webCount})`, `🔌 その他のサービス (${nonWebCount})`);
+
+        // スケルトンが残っていれば削除
+        removeSkeletons();
+
+        if (webCount === 0 && nonWebCount === 0) {
+            document.getElementById('content').insertAdjacentHTML('beforeend',
+                `<div class="empty">📭 他に開いているポートが見つかりませんでした</div>`
+            );
+        }
+    };
+
+    eventSource.onmessage = (event) => {
+        if (event.data === '[DONE]') {
+            eventSource.close();
+            activeScan = null;
+            finish();
+            return;
+        }
+
+        const port = JSON.parse(event.data);
+        newPorts.add(port.port);
+        pendingPorts.push(port);
+        if (!flushScheduled) {
+            flushScheduled = true;
+            requestAnimationFrame(flushPorts);
+        }
+    };
+
+    // 再接続した場合はサーバーが Last-Event-ID 以降の変更と現在のポート一覧だけを送ってくる
+    eventSource.addEventListener('removed', (event) => {
+        const { port } = JSON.parse(event.data);
+        newPorts.delete(port);
+    });
+    eventSource.addEventListener('ports', (event) => {
+        for (const port of JSON.parse(event.data).ports) newPorts.add(port);
+    });
+
+    eventSource.onerror = () => {
+        // 接続が切れてもブラウザが自動で再接続するので、閉じられた場合だけ後片付けする
+        if (eventSource.readyState === EventSource.CLOSED && activeScan === eventSource) activeScan = null;
+    };
+}
+
+function flushPorts() {
+    flushScheduled = false;
+    if (pendingPorts.length === 0) return;
+    const batch = pendingPorts;
+    pendingPorts = [];
+
+    let newlyFound = null;
+    for (const port of batch) {
+        const isNewPort = !currentPorts.has(port.port);
+        if (port.title) {
+            scanCounts.web++;
+            renderWebPort(port);
+        } else {
+            scanCounts.nonWeb++;
+            renderNonWebPort(port);
+        }
+        if (isNewPort) newlyFound = port;
+    }
+
+    const statusBar = document.getElementById('status');
+    if (statusBar.className !== 'status-bar scanning') return;
+    if (newlyFound) {
+        // 新規ポートの場合、ステータスに表示
+        if (statusTimeout) clearTimeout(statusTimeout);
+        showStatus(`✨ 新規ポート検出: ${newlyFound.port} (${newlyFound.process})`);
+        statusTimeout = setTimeout(() => {
+            statusTimeout = null;
+            if (statusBar.className === 'status-bar scanning') {
+                showStatus(`ポートスキャン中... (Webサーバー: ${scanCounts.web}個、その他: ${scanCounts.nonWeb}個)`);
+            }
+        }, 2000);
+    } else if (!statusTimeout) {
+        // ステータス更新（検出中）
+        showStatus(`ポートスキャン中... (Webサーバー: ${scanCounts.web}個、その他: ${scanCounts.nonWeb}個)`);
+    }
+}
+
+function getBaseHostname() {
+    const parts = window.location.hostname.split('.');
+    // 3パート以上なら最後の2パートを使用（5173.air.local -> air.local）
+    // 2パート以下ならそのまま使用（air.local -> air.local）
+    return parts.length > 2 ? parts.slice(-2).join('.') : parts.join('.');
+}
+
+function getServerUrl(port) {
+    const base = getBaseHostname();
+    return `https://${port}.${base}:8888`;
+}
+
+async function checkDnsSetup() {
+    try {
+        const response = await fetch('/api/hostname');
+        const data = await response.json();
+
+        // 現在のホスト名がローカルドメインか確認
+        const currentHost = window.location.hostname;
+        const parts = currentHost.split('.');
+        const baseDomain = parts.length > 2 ? parts.slice(-2).join('.') : currentHost;
+
+        // テスト用のサブドメインにフェッチしてDNS解決を確認
+        // （実際にはサーバーがないポートでも、DNS解決できればOK）
+        if (!localStorage.getItem('dnsSetupComplete')) {
+            showDnsSetupModal(data.hostname, data.setup_command);
+        }
+    } catch (e) {
+        console.error('DNS check failed:', e);
+    }
+}
+
+function showDnsSetupModal(hostname, setupCommand) {
+    const modal = document.getElementById('modal');
+    document.getElementById('modalTitle').textContent = 'DNS設定が必要です';
+    document.getElementById('modalBody').innerHTML = `
+        <p>リバースプロキシ機能を利用するには、DNSの設定が必要です。</p>
+        <p>以下のコマンドを一度だけ実行してください:</p>
+        <div class="cmd-wrapper">
+            <div class="cmd-display" id="dnsCommand">${setupCommand}</div>
+            <button class="btn-copy" onclick="navigator.clipboard.writeText(document.getElementById('dnsCommand').textContent)" title="コピー">📋</button>
+        </div>
+        <p style="margin-top: 12px; font-size: 13px; color: var(--text-secondary);">
+            設定後、ブラウザを再起動してください。
+        </p>
+    `;
+    document.getElementById('confirmBtn').textContent = '設定済み';
+    document.getElementById('confirmBtn').onclick = () => {
+        localStorage.setItem('dnsSetupComplete', 'true');
+        closeModal();
+    };
+    modal.classList.add('show');
+}
+
+function getOriginIcon(type) {
+    const icons = {
+        'launchd': '⚙️',
+        'docker': '🐳',
+        'terminal': '🖥️',
+        'unknown': '❓'
+    };
+    return icons[type] || '❓';
+}
+
+function getOriginDisplay(origin) {
+    if (!origin) return { icon: '❓', text: '', title: '' };
+    const icon = getOriginIcon(origin.type);
+    let text = origin.label || origin.parent || '';
+    let title = '';
+    if (origin.command) {
+        // コマンドが長い場合は省略
+        const cmd = origin.command;
+        text = text ? `${text} (${cmd.length > 30 ? cmd.substring(0, 30) + '...' : cmd})` : cmd;
+        title = cmd;
+    }
+    return { icon, text, title };
+}
+
+// 昇順配列の中で port を挿入すべき位置（二分探索）
+function sortedIndex(order, port) {
+    let lo = 0;
+    let hi = order.length;
+    while (lo < hi) {
+        const mid = (lo + hi) >>> 1;
+        if (order[mid] < port) lo = mid + 1;
+        else hi = mid;
+    }
+    return lo;
+}
+
+function removeFromOrder(order, port) {
+    const i = sortedIndex(order, port);
+    if (order[i] === port) order.splice(i, 1);
+}
+
+function createElement(tag, className) {
+    const el = document.createElement(tag);
+    if (className) el.className = className;
+    return el;
+}
+
+// 値が変わったフィールドだけDOMに反映する
+function patch(entry, key, value, apply) {
+    if (entry.view[key] === value) return;
+    entry.view[key] = value;
+    apply(value);
+}
+
+function removeSkeletons() {
+    document.querySelectorAll('#web-grid .skeleton-card').forEach(el => el.remove());
+}
+
+function createWebCard(port) {
+    const el = createElement('a', 'card');
+    el.dataset.port = port;
+    el.href = getServerUrl(port);
+    el.target = '_blank';
+
+    const body = createElement('div', 'card-body');
+    const header = createElement('div', 'card-header');
+    const portBadge = createElement('span', 'port-badge');
+    portBadge.textContent = port;
+    const processBadge = createElement('span', 'process-badge');
+    header.append(portBadge, processBadge);
+
+    const title = createElement('div', 'card-title');
+    const origin = createElement('div', 'card-origin');
+    const originIcon = createElement('span', 'origin-icon');
+    const originText = createElement('span', 'origin-text');
+    origin.append(originIcon, originText);
+
+    const siblings = createElement('div', 'card-group');
+    siblings.style.display = 'none';
+
+    const link = createElement('div', 'card-link');
+    link.textContent = getServerUrl(port);
+
+    body.append(header, title, origin, siblings, link);
+    el.append(body);
+    return { el, view: {}, img: null, processBadge, title, origin, originIcon, originText, siblings };
+}
+
+function setCardThumbnail(entry, thumbnail) {
+    if (!thumbnail) return;
+    patch(entry, 'thumbnail', thumbnail, value => {
+        if (!entry.img) {
+            entry.img = createElement('img', 'card-thumbnail');
+            entry.img.decoding = 'async';
+            entry.el.prepend(entry.img);
+        }
+        entry.img.src = `data:image/png;base64,${value}`;
+    });
+}
+
+function renderWebPort(p) {
+    removeSkeletons();
+    if (nonWebRows.has(p.port)) {
+        removeNonWebPort(p.port);
+        scheduleTableRender();
+    }
+
+    // 既存カードを更新または新規作成
+    let entry = webCards.get(p.port);
+    if (!entry) {
+        entry = createWebCard(p.port);
+        webCards.set(p.port, entry);
+
+        // ポート番号順に挿入
+        const grid = document.getElementById('web-grid');
+        const i = sortedIndex(webOrder, p.port);
+        webOrder.splice(i, 0, p.port);
+        const next = i + 1 < webOrder.length ? webCards.get(webOrder[i + 1]).el : null;
+        grid.insertBefore(entry.el, next);
+    }
+    entry.el.classList.remove('checking');
+
+    const title = p.title || 'Untitled';
+    const origin = getOriginDisplay(p.origin);
+    patch(entry, 'process', p.process, value => { entry.processBadge.textContent = value; });
+    patch(entry, 'title', title, value => {
+        entry.title.textContent = value;
+        if (entry.img) entry.img.alt = value;
+    });
+    patch(entry, 'origin', `${origin.icon}\n${origin.text}\n${origin.title}`, () => {
+        entry.origin.style.display = origin.text ? '' : 'none';
+        entry.originIcon.textContent = origin.icon;
+        entry.originText.textContent = origin.text;
+        entry.originText.title = origin.title || origin.text;
+    });
+    // 同じプロセスツリーの別ポートと同じページならそのサムネイルを使う
+    entry.el.dataset.thumbnailPort = p.thumbnail_of || p.port;
+    setPortGroup(p.port, p.group);
+    // サムネイルが届かなかった場合は表示中のものを残す
+    setCardThumbnail(entry, p.thumbnail);
+    if (entry.img && !entry.img.alt) entry.img.alt = title;
+
+    // 古いサムネイルは画面に入ったときに撮り直しを依頼
+    if (p.thumbnail_stale) {
+        thumbnailObserver.observe(entry.el);
+    }
+}
+
+// ポート -> プロセスツリーの根のPID
+const portGroups = new Map();
+
+function setPortGroup(port, group) {
+    if (group == null) {
+        portGroups.delete(port);
+    } else {
+        portGroups.set(port, group);
+    }
+}
+
+// 同じプロセスツリーの他のポートをカードに表示
+function updateGroupLabels() {
+    const members = new Map();
+    portGroups.forEach((group, port) => {
+        if (!members.has(group)) members.set(group, []);
+        members.get(group).push(port);
+    });
+    webCards.forEach((entry, port) => {
+        const group = portGroups.get(port);
+        const others = group == null ? [] : members.get(group).filter(p => p !== port).sort((a, b) => a - b);
+        patch(entry, 'siblings', others.join(', '), value => {
+            entry.siblings.style.display = value ? '' : 'none';
+            entry.siblings.textContent = `🔗 同じプロセス: ${value}`;
+        });
+    });
+}
+
+// 応答時間の推移（TTFB、なければ接続時間）をカードに小さく描く
+const SPARKLINE_WIDTH = 120;
+const SPARKLINE_HEIGHT = 24;
+
+function sparklinePoints(values) {
+    const points = values.map((v, i) => [i, v]).filter(([, v]) => v != null);
+    if (points.length < 2) return '';
+    const max = Math.max(...points.map(([, v]) => v)) || 1;
+    const step = SPARKLINE_WIDTH / (values.length - 1);
+    return points.map(([i, v]) =>
+        `${(i * step).toFixed(1)},${(SPARKLINE_HEIGHT - v / max * (SPARKLINE_HEIGHT - 2) - 1).toFixed(1)}`
+    ).join(' ');
+}
+
+function renderSparkline(entry, history) {
+    const values = history.ttfb_ms.some(v => v != null) ? history.ttfb_ms : history.connect_ms;
+    const points = sparklinePoints(values);
+    const latest = values.filter(v => v != null).pop();
+    patch(entry, 'sparkline', `${points}|${latest}`, () => {
+        if (!entry.sparkline) {
+            entry.sparkline = createElement('div', 'card-sparkline');
+            entry.sparkline.innerHTML =
+                `<svg viewBox="0 0 ${SPARKLINE_WIDTH} ${SPARKLINE_HEIGHT}" preserveAspectRatio="none"><polyline/></svg><span></span>`;
+            entry.siblings.before(entry.sparkline);
+        }
+        entry.sparkline.style.display = points ? '' : 'none';
+        entry.sparkline.querySelector('polyline').setAttribute('points', points);
+        entry.sparkline.querySelector('span').textContent = latest != null ? `${latest}ms` : '';
+    });
+}
+
+async function loadSparklines() {
+    try {
+        const response = await fetch('/api/ports/history');
+        const data = await response.json();
+        webCards.forEach((entry, port) => {
+            const history = data.ports[port];
+            if (history) renderSparkline(entry, history);
+        });
+    } catch (e) {
+        console.error('History fetch failed:', e);
+    }
+}
+
+function removeWebPort(port) {
+    const entry = webCards.get(port);
+    if (!entry) return;
+    thumbnailObserver.unobserve(entry.el);
+    entry.el.remove();
+    webCards.delete(port);
+    removeFromOrder(webOrder, port);
+}
+
+const thumbnailObserver = new IntersectionObserver((entries) => {
+    entries.forEach(entry => {
+        if (!entry.isIntersecting) return;
+        thumbnailObserver.unobserve(entry.target);
+        loadThumbnail(parseInt(entry.target.dataset.port), parseInt(entry.target.dataset.thumbnailPort));
+    });
+});
+
+async function loadThumbnail(port, thumbnailPort = port) {
+    try {
+        const response = await fetch(`/api/ports/${thumbnailPort}/thumbnail`);
+        if (!response.ok) return;  // 一覧から消えたポート
+        const data = await response.json();
+        const entry = webCards.get(port);
+        if (entry) setCardThumbnail(entry, data.thumbnail);
+    } catch (e) {
+        console.error('Thumbnail fetch failed:', e);
+    }
+}
+
+function createNonWebRow(port) {
+    const el = createElement('tr');
+    el.dataset.port = port;
+    const cells = [createElement('td'), createElement('td'), createElement('td'), createElement('td')];
+    cells[0].textContent = port;
+    el.append(...cells);
+    return { el, view: {}, cells };
+}
+
+// 判別したプロトコルの表示名（HTTP以外）
+const PROTOCOL_LABELS = {
+    ssh: 'SSH', tls: 'TLS', h2: 'HTTP/2', mysql: 'MySQL', postgres: 'PostgreSQL', redis: 'Redis',
+};
+
+function renderNonWebPort(p) {
+    if (webCards.has(p.port)) removeWebPort(p.port);
+
+    let entry = nonWebRows.get(p.port);
+    if (!entry) {
+        entry = createNonWebRow(p.port);
+        nonWebRows.set(p.port, entry);
+        // ポート番号順に挿入（DOMへの反映は renderTableWindow で行う）
+        nonWebOrder.splice(sortedIndex(nonWebOrder, p.port), 0, p.port);
+        scheduleTableRender();
+    }
+    entry.el.classList.remove('checking');
+    setPortGroup(p.port, p.group);
+
+    const origin = getOriginDisplay(p.origin);
+    const originText = origin.text || '-';
+    const protocol = PROTOCOL_LABELS[p.protocol];
+    patch(entry, 'process', protocol ? `${p.process} (${protocol})` : p.process, value => { entry.cells[1].textContent = value; });
+    patch(entry, 'origin', `${origin.icon} ${originText}`, value => { entry.cells[2].textContent = value; });
+    patch(entry, 'originTitle', origin.title || originText, value => { entry.cells[2].title = value; });
+    patch(entry, 'startTime', p.origin?.start_time || '-', value => { entry.cells[3].textContent = value; });
+}
+
+function removeNonWebPort(port) {
+    const entry = nonWebRows.get(port);
+    if (!entry) return;
+    entry.el.remove();
+    nonWebRows.delete(port);
+    removeFromOrder(nonWebOrder, port);
+}
+
+// 行数が多いときは画面付近の行だけをDOMに置く
+const VIRTUALIZE_ROWS = 200;
+const OVERSCAN_ROWS = 20;
+let rowHeight = 45;
+let tableRenderScheduled = false;
+let renderedRange = null;
+const topSpacer = createElement('tr', 'spacer-row');
+const bottomSpacer = createElement('tr', 'spacer-row');
+
+function scheduleTableRender() {
+    renderedRange = null;
+    if (tableRenderScheduled) return;
+    tableRenderScheduled = true;
+    requestAnimationFrame(renderTableWindow);
+}
+
+function renderTableWindow() {
+    tableRenderScheduled = false;
+    const tbody = document.querySelector('#non-web-table tbody');
+    if (!tbody) return;
+    const total = nonWebOrder.length;
+
+    let start = 0;
+    let end = total;
+    if (total > VIRTUALIZE_ROWS) {
+        const rect = tbody.getBoundingClientRect();
+        const first = Math.floor(-rect.top / rowHeight);
+        const visible = Math.ceil(window.innerHeight / rowHeight);
+        start = Math.max(0, Math.min(total, first - OVERSCAN_ROWS));
+        end = Math.max(start, Math.min(total, first + visible + OVERSCAN_ROWS));
+    }
+    if (renderedRange && renderedRange[0] === start && renderedRange[1] === end) return;
+    renderedRange = [start, end];
+
+    const rows = [];
+    for (let i = start; i < end; i++) rows.push(nonWebRows.get(nonWebOrder[i]).el);
+    if (total > VIRTUALIZE_ROWS) {
+        topSpacer.style.height = `${start * rowHeight}px`;
+        bottomSpacer.style.height = `${(total - end) * rowHeight}px`;
+        tbody.replaceChildren(topSpacer, ...rows, bottomSpacer);
+    } else {
+        tbody.replaceChildren(...rows);
+    }
+    if (rows.length > 0 && rows[0].offsetHeight > 0) rowHeight = rows[0].offsetHeight;
+}
+
+window.addEventListener('scroll', () => {
+    if (nonWebOrder.length <= VIRTUALIZE_ROWS || tableRenderScheduled) return;
+    tableRenderScheduled = true;
+    requestAnimationFrame(renderTableWindow);
+}, { passive: true });
+window.addEventListener('resize', () => {
+    if (nonWebOrder.length > VIRTUALIZE_ROWS) scheduleTableRender();
+});
+
+function updateSectionCounts() {
+    const statusBar = document.getElementById('status');
+    if (statusBar.className === 'status-bar scanning') return;
+    setSectionTitles(`🌐 Webサーバー (${webCards.size})`, `🔌 その他のサービス (${nonWebRows.size})`);
+}
+
+// サーバーの起動・停止をサーバー側の監視から受け取る
+function watchPorts() {
+    const events = new EventSource('/api/ports/events');
+
+    events.addEventListener('added', (event) => {
+        if (!document.getElementById('web-grid')) return;
+        const port = JSON.parse(event.data);
+        if (scanningPorts) scanningPorts.add(port.port);
+        currentPorts.add(port.port);
+        document.querySelectorAll('#content > .empty').forEach(el => el.remove());
+        if (port.title) {
+            renderWebPort(port);
+        } else {
+            renderNonWebPort(port);
+        }
+        updateGroupLabels();
+        updateSectionCounts();
+        showStatus(`✨ 新規ポート検出: ${port.port} (${port.process})`);
+    });
+
+    // 新規ポートのサムネイルは撮影が終わってから届く
+    events.addEventListener('thumbnail', (event) => {
+        const { port, thumbnail } = JSON.parse(event.data);
+        const entry = webCards.get(port);
+        if (entry) setCardThumbnail(entry, thumbnail);
+    });
+
+    events.addEventListener('removed', (event) => {
+        if (!document.getElementById('web-grid')) return;
+        const { port } = JSON.parse(event.data);
+        if (scanningPorts) scanningPorts.delete(port);
+        currentPorts.delete(port);
+        removeWebPort(port);
+        removeNonWebPort(port);
+        portGroups.delete(port);
+        scheduleTableRender();
+        updateGroupLabels();
+        updateSectionCounts();
+    });
+}
+
+// 前回確認したポートをすぐに表示し、そのあとスキャンで更新する
+async function loadCachedPorts() {
+    try {
+        const response = await fetch('/api/ports/cached');
+        const data = await response.json();
+        if (data.ports.length === 0) return;
+        showSkeleton();
+        removeSkeletons();
+        for (const port of data.ports) {
+            if (port.title) {
+                renderWebPort(port);
+            } else {
+                renderNonWebPort(port);
+            }
+            currentPorts.add(port.port);
+        }
+        updateGroupLabels();
+        loadSparklines();
+        setSectionTitles(`🌐 Webサーバー (${webCards.size})`, `🔌 その他のサービス (${nonWebRows.size})`);
+    } catch (e) {
+        console.error('Cached ports fetch failed:', e);
+    }
+}
+
+initTheme();
+checkDnsSetup();
+loadCachedPorts().then(refresh);
+watchPorts();
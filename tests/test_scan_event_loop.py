@@ -0,0 +1,82 @@
+"""スキャン（ポートへの接続とlsof/ps）の間もイベントループが止まらないことの検査
+
+ブロッキングする処理を一定時間スリープするものに置き換え、スキャンの間に
+イベントループの遅れ（プロキシの応答が待たされる時間）を測る。
+処理がイベントループ上で実行されていれば、遅れはスリープの合計に近くなる。
+実際のプロキシのp99の計測は bench.py --check で行う。
+"""
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import local_portal
+
+main = local_portal.load_main()
+
+CHECK_PORT_SLEEP = 0.0002    # 1ポートへの接続
+INTROSPECTION_SLEEP = 0.3    # lsof / ps それぞれ
+MAX_LOOP_LAG = 0.1
+TICK = 0.005
+
+async def max_loop_lag(work) -> tuple:
+    """work を実行している間のイベントループの最大の遅れ（秒）と work の結果を返す"""
+    lag = 0.0
+    done = False
+
+    async def ticker():
+        nonlocal lag
+        while not done:
+            started = time.perf_counter()
+            await asyncio.sleep(TICK)
+            lag = max(lag, time.perf_counter() - started - TICK)
+
+    task = asyncio.ensure_future(ticker())
+    await asyncio.sleep(0)
+    try:
+        result = await work
+    finally:
+        done = True
+        await task
+    return lag, result
+
+def test_scan_does_not_block_event_loop(monkeypatch):
+    def check_port(port, bound_addresses=None):
+        time.sleep(CHECK_PORT_SLEEP)
+        return main.PortRecord(port, address="127.0.0.1") if port % 1000 == 0 else None
+
+    # LISTENの一覧による絞り込みを止め、全ポートに接続させる
+    monkeypatch.setattr(main, "read_bound_addresses", lambda: None)
+    monkeypatch.setattr(main, "check_port", check_port)
+    ports = range(3000, 10000)
+
+    started = time.perf_counter()
+    lag, found = asyncio.run(max_loop_lag(main.scan_port_list(ports)))
+    elapsed = time.perf_counter() - started
+
+    assert [r.port for r in found] == [3000, 4000, 5000, 6000, 7000, 8000, 9000]
+    # スキャン自体は MAX_LOOP_LAG より十分長くかかっている
+    assert elapsed > MAX_LOOP_LAG * 2
+    assert lag < MAX_LOOP_LAG, f"event loop blocked for {lag * 1000:.0f}ms during a {elapsed * 1000:.0f}ms scan"
+
+def test_process_info_does_not_block_event_loop(monkeypatch):
+    def listening_pids(port=None):
+        time.sleep(INTROSPECTION_SLEEP)
+        return {3000: "100", 3001: "100"}
+
+    def process_table(required=()):
+        time.sleep(INTROSPECTION_SLEEP)
+        return {"100": ("1", "node")}
+
+    monkeypatch.setattr(main, "_listening_pids", listening_pids)
+    monkeypatch.setattr(main, "_process_table", process_table)
+    monkeypatch.setattr(main, "get_docker_ports", lambda: {})
+    monkeypatch.setattr(main, "get_process_origin", lambda pid: None)
+
+    lag, infos = asyncio.run(max_loop_lag(main.get_processes_info([3000, 3001, 3002])))
+
+    assert infos[3000].process == "node" and infos[3000] is infos[3001]
+    assert infos[3002].pid is None
+    assert lag < MAX_LOOP_LAG, f"event loop blocked for {lag * 1000:.0f}ms during lsof/ps"
@@ -0,0 +1,142 @@
+"""サムネイル撮影ワーカー
+
+Chromium（Playwright）の操作とPNGのエンコードはこのプロセスで行い、
+プロキシを処理するイベントループとCPU・メモリを取り合わないようにする。
+main.py が標準入出力をパイプにして起動し、1行1件のJSONでやり取りする。
+
+    → {"id": 1, "op": "capture", "port": 3000}
+    ← {"id": 1, "thumbnail": "<base64>", "launch_s": 0.8, "capture_s": 1.2}
+    → {"id": 2, "op": "cancel", "target": 1}
+    → {"id": 3, "op": "warmup"}
+    ← {"id": 3, "launch_s": 0.8}
+
+エラーのときは "thumbnail" の代わりに "error" を返す。
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import sys
+import time
+
+# 撮影結果は1行で返すので、PNGのbase64が収まる大きさにしておく
+MAX_LINE = 64 * 1024 * 1024
+
+# Chromiumは起動コストが高いので1つを使い回す
+_playwright = None
+_browser = None
+_browser_lock = None
+
+async def get_browser() -> tuple:
+    """共有Chromiumインスタンスと、今回起動した場合はその所要時間を返す"""
+    global _playwright, _browser, _browser_lock
+
+    if _browser_lock is None:
+        _browser_lock = asyncio.Lock()
+    async with _browser_lock:
+        if _browser is None or not _browser.is_connected():
+            if _playwright is None:
+                from playwright.async_api import async_playwright
+                _playwright = await async_playwright().start()
+            started = time.perf_counter()
+            _browser = await _playwright.chromium.launch()
+            return _browser, time.perf_counter() - started
+    return _browser, None
+
+async def close_browser():
+    global _playwright, _browser
+    try:
+        if _browser is not None:
+            await _browser.close()
+        if _playwright is not None:
+            await _playwright.stop()
+    except Exception:
+        pass
+    _browser = None
+    _playwright = None
+
+async def capture_thumbnail(port: int) -> tuple:
+    """ページのスクリーンショットを撮影し、(base64, 起動時間, 撮影時間) を返す"""
+    browser, launch_s = await get_browser()
+    started = time.perf_counter()
+    page = await browser.new_page(viewport={'width': 1280, 'height': 720})
+    try:
+        await page.goto(f"http://localhost:{port}", timeout=5000, wait_until='load')
+        await page.wait_for_timeout(500)
+        screenshot = await page.screenshot(type='png')
+    finally:
+        await page.close()
+    return base64.b64encode(screenshot).decode('utf-8'), launch_s, time.perf_counter() - started
+
+class Worker:
+    """標準入力から依頼を読み、撮影結果を標準出力（元のfd 1）へ書く"""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._reader = reader
+        self._writer = writer
+        self._tasks = {}  # id -> 撮影中のTask
+
+    def _reply(self, message: dict):
+        self._writer.write(json.dumps(message).encode() + b"\n")
+
+    async def _handle(self, message: dict):
+        job_id = message["id"]
+        try:
+            if message["op"] == "warmup":
+                _, launch_s = await get_browser()
+                self._reply({"id": job_id, "launch_s": launch_s})
+                return
+            thumbnail, launch_s, capture_s = await capture_thumbnail(message["port"])
+            self._reply({"id": job_id, "thumbnail": thumbnail, "launch_s": launch_s, "capture_s": capture_s})
+        except asyncio.CancelledError:
+            self._reply({"id": job_id, "error": "cancelled"})
+        except Exception as e:
+            self._reply({"id": job_id, "error": str(e) or type(e).__name__})
+        finally:
+            self._tasks.pop(job_id, None)
+            await self._writer.drain()
+
+    async def run(self):
+        while True:
+            line = await self._reader.readline()
+            if not line:
+                break
+            message = json.loads(line)
+            if message["op"] == "cancel":
+                task = self._tasks.get(message["target"])
+                if task is not None:
+                    task.cancel()
+                continue
+            self._tasks[message["id"]] = asyncio.ensure_future(self._handle(message))
+        # 親が標準入力を閉じたら撮影中のものを取り消して終わる
+        for task in list(self._tasks.values()):
+            task.cancel()
+        await close_browser()
+
+async def serve(protocol_fd: int):
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader(limit=MAX_LINE)
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+    transport, protocol = await loop.connect_write_pipe(
+        asyncio.streams.FlowControlMixin, os.fdopen(protocol_fd, "wb")
+    )
+    writer = asyncio.StreamWriter(transport, protocol, None, loop)
+    await Worker(reader, writer).run()
+
+def main():
+    parser = argparse.ArgumentParser(description="Local Portal サムネイル撮影ワーカー")
+    parser.add_argument("--nice", type=int, default=10, help="プロセスの優先度を下げる量（Chromiumにも引き継がれる）")
+    args = parser.parse_args()
+
+    if args.nice > 0:
+        os.nice(args.nice)
+    # やり取りに使う標準出力を退避し、fd 1 は標準エラーに向けておく
+    # （Chromiumやライブラリの出力が応答に混ざらないようにする）
+    protocol_fd = os.dup(1)
+    os.dup2(2, 1)
+    sys.stdout = sys.stderr
+    asyncio.run(serve(protocol_fd))
+
+if __name__ == "__main__":
+    main()